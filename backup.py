@@ -0,0 +1,185 @@
+"""
+    Online backups of the database while a net is running.
+
+    Snapshots are taken with SQLite's backup API on a thread and connection
+    of their own. Each step copies a limited number of pages and then
+    pauses, so the copy never holds a read transaction or the disk for long.
+    With the database in WAL mode the copy's reads never block the writer.
+    Copying the file directly is not safe while it is being written, and
+    stopping logging to copy it is not acceptable during a long net.
+
+    Each snapshot is written to a temporary file and checked with
+    PRAGMA integrity_check. Only then is it renamed to its timestamped name,
+    e.g. dev-20240601-193000.db, so a file with that name is always a
+    complete, verified copy. The oldest snapshots past the number to keep
+    are deleted.
+
+    With the edit journal on, edits are in the journal until it is
+    compacted. The main window's service compacts it before each snapshot;
+    a snapshot taken from the command line only has what is in the
+    database file.
+
+        NETSCRIBE_BACKUP_DIR=backups python main.py
+        python backup.py --database dev.db --directory backups
+"""
+
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from persist import BUSY_TIMEOUT
+
+#Pages copied per step and seconds paused after each. At the default page
+#size a step is 256 KiB.
+PAGES_PER_STEP = 64
+STEP_PAUSE = 0.005
+
+#Restarts after which a copy stops pausing between steps
+MAX_RESTARTS = 3
+
+#Defaults for the service: minutes between snapshots and snapshots kept
+DEFAULT_INTERVAL = 10
+DEFAULT_KEEP = 12
+
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+class BackupError(Exception):
+    pass
+
+#Name of a snapshot of the database at path taken at a time.time()
+def snapshotName(path, when):
+    base = os.path.splitext(os.path.basename(path))[0]
+    return base + '-' + time.strftime(TIMESTAMP_FORMAT, time.localtime(when)) + '.db'
+
+#Existing snapshots of the database at path in a directory, oldest first.
+#The timestamps sort as text.
+def listSnapshots(path, directory):
+    base = os.path.splitext(os.path.basename(path))[0]
+    return sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(base) + '-????????-??????.db')))
+
+#Copy the database at path to target a few pages at a time, pausing after
+#each step. A write to the source by another connection restarts the copy
+#at the next step, so the snapshot is always of one consistent state.
+#After MAX_RESTARTS restarts the copy stops pausing, so a busy net cannot
+#keep it from ever finishing.
+def copyDatabase(path, target, pages=PAGES_PER_STEP, pause=STEP_PAUSE, progress=None):
+    state = {'remaining': None, 'restarts': 0}
+    
+    #SQLite only sleeps between steps when the source is locked, so the
+    #pause is taken here
+    def step(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] = state['restarts'] + 1
+        state['remaining'] = remaining
+        if progress is not None:
+            progress(status, remaining, total)
+        if state['restarts'] < MAX_RESTARTS:
+            time.sleep(pause)
+    
+    source = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    try:
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination, pages=pages, progress=step)
+            #A copy of a WAL database is in WAL mode too; a snapshot is
+            #never written again, so make it a single self-contained file
+            destination.execute('PRAGMA journal_mode = DELETE;')
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+#Rows of PRAGMA integrity_check for a database file; ['ok'] if it is sound
+def checkIntegrity(path):
+    con = sqlite3.connect(path)
+    try:
+        return [row[0] for row in con.execute('PRAGMA integrity_check;')]
+    finally:
+        con.close()
+
+#Take one verified snapshot of the database at path into a directory and
+#delete all but the newest keep. Returns the snapshot's path. Raises
+#BackupError, leaving no snapshot behind, if the copy fails its check.
+def takeSnapshot(path, directory, keep=DEFAULT_KEEP, when=None, **copyOptions):
+    os.makedirs(directory, exist_ok=True)
+    snapshot = os.path.join(directory, snapshotName(path, time.time() if when is None else when))
+    temporary = snapshot + '.tmp'
+    try:
+        copyDatabase(path, temporary, **copyOptions)
+        problems = checkIntegrity(temporary)
+        if problems != ['ok']:
+            raise BackupError('Snapshot of ' + path + ' failed its integrity check: ' + '; '.join(problems[:5]))
+        os.replace(temporary, snapshot)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    for old in listSnapshots(path, directory)[:-keep]:
+        os.remove(old)
+    return snapshot
+
+'''--------------------------------------------
+Service taking a snapshot every interval on a
+thread of its own until it is stopped
+--------------------------------------------'''
+class BackupService:
+
+    #interval is in minutes. prepare() is called before each snapshot, e.g.
+    #to write edits that are not in the database file yet into it.
+    #prepare, onSnapshot(path) and onError(exception) are called on the
+    #backup thread.
+    def __init__(self, path, directory, interval=DEFAULT_INTERVAL, keep=DEFAULT_KEEP, onSnapshot=None, onError=None,
+            prepare=None):
+        self.path = path
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.prepare = prepare
+        self.onSnapshot = onSnapshot
+        self.onError = onError
+        self.lastSnapshot = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='backup', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    #Wait for a snapshot in progress to finish and stop. Stopping does not
+    #interrupt a copy, which leaves either a verified snapshot or none.
+    def stop(self):
+        self.stopping.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    #First snapshot after one interval, the database as opened is likely
+    #the same as the newest snapshot already
+    def run(self):
+        while not self.stopping.wait(self.interval * 60):
+            try:
+                if self.prepare is not None:
+                    self.prepare()
+                self.lastSnapshot = takeSnapshot(self.path, self.directory, self.keep)
+                if self.onSnapshot is not None:
+                    self.onSnapshot(self.lastSnapshot)
+            #RuntimeError if prepare needs the database worker and it has
+            #already been shut down at exit
+            except (sqlite3.Error, OSError, BackupError, RuntimeError) as e:
+                if self.onError is not None:
+                    self.onError(e)
+                else:
+                    print('Backup failed: ' + str(e), file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Take a verified snapshot of the database')
+    parser.add_argument('--database', default='dev.db')
+    parser.add_argument('--directory', default='backups')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='snapshots to keep')
+    parser.add_argument('--pages', type=int, default=PAGES_PER_STEP, help='pages copied per step')
+    args = parser.parse_args()
+    try:
+        print(takeSnapshot(args.database, args.directory, args.keep, pages=args.pages))
+    except BackupError as e:
+        sys.exit(str(e))
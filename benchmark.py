@@ -0,0 +1,494 @@
+"""
+    Benchmarks for the net scribe. Each measurement is printed as one
+    line of JSON, tagged with the git revision, so results can be saved
+    and compared across versions.
+    
+    Synthetic databases are created on first use and kept in the data
+    directory, since building the large ones takes a while.
+        
+        python benchmark.py all > results.jsonl
+        python benchmark.py startup --sizes 1000 1000000
+        python benchmark.py keystroke --sizes 10 100000
+        python benchmark.py repaint
+        python benchmark.py memory --sizes 100000
+        python benchmark.py server --clients 12
+        python benchmark.py search --sizes 500000
+        python benchmark.py suggest --sizes 1000000
+    
+    GUI benchmarks run headless under QT_QPA_PLATFORM=offscreen unless
+    another platform is set.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#Unix only; on Windows the peak working set is read through ctypes instead
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+else:
+    import resource
+
+from persist import Persist
+from dataStructures import Station, StationList
+
+DEFAULT_SIZES = [10, 1000, 100000, 1000000]
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'netscribe-bench')
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+#Build a justified callsign (2 char prefix, digit, 3 char suffix) from a
+#number. Different numbers always give different callsigns.
+def syntheticCallsign(n):
+    suffix = ''
+    for i in range(3):
+        suffix = suffix + LETTERS[n % 26]
+        n = n // 26
+    digit = str(n % 10)
+    n = n // 10
+    second = (' ' + LETTERS)[n % 27]
+    n = n // 27
+    first = 'KNW'[n % 3]
+    if second == ' ':
+        prefix = ' ' + first
+    else:
+        prefix = first + second
+    return prefix + digit + suffix
+
+#Create a database with count synthetic stations
+def createDatabase(path, count):
+    #Keep schema messages out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        p = Persist(path)
+    chunkSize = 10000
+    for start in range(0, count, chunkSize):
+        rows = [(syntheticCallsign(n), 'NAME' + str(n), n % 3 == 0, '')
+            for n in range(start, min(start + chunkSize, count))]
+        p.cur.executemany('INSERT INTO stations (callsign, name, ack, note) VALUES (?, ?, ?, ?);', rows)
+        p.con.commit()
+    #Fold the WAL into the database file, which is renamed without it
+    p.close()
+    p.con.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+    p.con.close()
+
+#Number of stations in a database file, or None if it cannot be read
+def stationCount(path):
+    try:
+        con = sqlite3.connect(path)
+        try:
+            return con.execute('SELECT COUNT(*) FROM stations;').fetchone()[0]
+        finally:
+            con.close()
+    except sqlite3.Error:
+        return None
+
+#Get the path of a synthetic database, creating it if needed. Databases
+#that do not hold every station, like the empty ones generated while the
+#WAL file was left behind, are made again rather than measured.
+def databasePath(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'stations-' + str(count) + '.db')
+    if os.path.exists(path) and stationCount(path) != count:
+        removeDatabase(path)
+    if not os.path.exists(path):
+        createDatabase(path + '.tmp', count)
+        os.replace(path + '.tmp', path)
+        if stationCount(path) != count:
+            raise RuntimeError('Synthetic database ' + path + ' does not hold ' + str(count) + ' stations')
+    return path
+
+#Delete a database along with any WAL files left next to it, which would
+#otherwise be picked up by the next database copied to the same path
+def removeDatabase(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+#Peak resident set size of this process in kilobytes
+def peakRss():
+    if sys.platform == 'win32':
+        return peakWorkingSet() // 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+#Peak working set of this process in bytes, from GetProcessMemoryInfo
+def peakWorkingSet():
+    class processMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [(name, ctypes.c_size_t)
+            for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+    counters = processMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.WinDLL('kernel32')
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    if not ctypes.WinDLL('psapi').GetProcessMemoryInfo(wintypes.HANDLE(kernel32.GetCurrentProcess()),
+            ctypes.byref(counters), counters.cb):
+        raise ctypes.WinError()
+    return counters.PeakWorkingSetSize
+
+#Run a benchmark in a fresh interpreter so each one starts cold, and
+#return the JSON lines it prints
+def runChild(name, *args):
+    environment = dict(os.environ)
+    environment.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), name] + [str(arg) for arg in args],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True, env=environment,
+        cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+#Short git revision of the code being measured, if known
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+REVISION = None
+
+def report(result):
+    print(json.dumps(dict(result, revision=REVISION)))
+    sys.stdout.flush()
+
+'''--------------------------------------------
+Startup: open the database and load the
+station list, as the main window does
+--------------------------------------------'''
+def startupChild(path):
+    start = time.perf_counter()
+    p = Persist(path)
+    stations = StationList(p)
+    seconds = time.perf_counter() - start
+    report({'seconds': seconds, 'loaded': len(stations.list), 'peakRssKb': peakRss()})
+
+def benchStartup(sizes, directory):
+    for size in sizes:
+        path = databasePath(directory, size)
+        for result in runChild('startup-child', path):
+            report(dict({'benchmark': 'startup', 'stations': size}, **result))
+
+#Median and 99th percentile of a list of timings, in milliseconds
+def percentiles(timings):
+    ordered = sorted(timings)
+    return {'p50Ms': ordered[len(ordered) // 2] * 1000,
+        'p99Ms': ordered[min(len(ordered) - 1, int(len(ordered) * .99))] * 1000}
+
+'''--------------------------------------------
+Memory: bytes per station held by the Station
+objects alone, and by a fully loaded station
+list with its indexes
+--------------------------------------------'''
+def memoryChild(path):
+    with contextlib.redirect_stdout(sys.stderr):
+        p = Persist(path)
+    rows = p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations ORDER BY callsign;').fetchall()
+    count = max(len(rows), 1)
+    
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    stations = [Station(row[1], row[2], row[3], row[4], row[0]) for row in rows]
+    stationBytes = tracemalloc.get_traced_memory()[0] - before
+    del stations
+    tracemalloc.stop()
+    del rows
+    
+    tracemalloc.start()
+    stations = StationList(p, pageSize=10000)
+    while stations.hasMore:
+        stations.updateListFromDatabase(p)
+    listBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    report({'stationBytesPerStation': stationBytes / count, 'listBytesPerStation': listBytes / count,
+        'loaded': len(stations.list)})
+
+def benchMemory(sizes, directory):
+    for size in sizes:
+        path = databasePath(directory, size)
+        for result in runChild('memory-child', path):
+            report(dict({'benchmark': 'memory', 'stations': size}, **result))
+
+'''--------------------------------------------
+Search: time the full text search for every
+prefix of station names as they are typed
+--------------------------------------------'''
+def benchSearch(sizes, directory, keystrokes):
+    for size in sizes:
+        path = databasePath(directory, size)
+        #Opening may build the search index of an older database
+        with contextlib.redirect_stdout(sys.stderr):
+            p = Persist(path)
+        stations = StationList(p)
+        timings = []
+        found = 0
+        n = 0
+        while len(timings) < keystrokes:
+            name = 'NAME' + str(n * 7919 % size)
+            for length in range(1, len(name) + 1):
+                start = time.perf_counter()
+                found = found + len(stations.textSearch(p, name[:length]))
+                timings.append(time.perf_counter() - start)
+            n = n + 1
+        report(dict({'benchmark': 'search', 'stations': size, 'samples': len(timings),
+            'meanFound': found / len(timings)}, **percentiles(timings)))
+        p.close()
+
+'''--------------------------------------------
+Suggestions: time building the index of known
+callsigns, then suggestions for known callsigns
+with one character changed
+--------------------------------------------'''
+def benchSuggest(sizes, directory, keystrokes):
+    for size in sizes:
+        path = databasePath(directory, size)
+        with contextlib.redirect_stdout(sys.stderr):
+            p = Persist(path)
+        stations = StationList(p)
+        start = time.perf_counter()
+        stations.suggestionIndex(p, wait=True)
+        buildSeconds = time.perf_counter() - start
+        timings = []
+        found = 0
+        for n in range(keystrokes):
+            typed = syntheticCallsign(n * 7919 % size).strip()
+            position = n % len(typed)
+            typed = typed[:position] + LETTERS[n % 26] + typed[position + 1:]
+            start = time.perf_counter()
+            found = found + len(stations.suggest(p, typed))
+            timings.append(time.perf_counter() - start)
+        report(dict({'benchmark': 'suggest', 'stations': size, 'buildSeconds': buildSeconds,
+            'samples': len(timings), 'meanFound': found / len(timings)}, **percentiles(timings)))
+        p.close()
+
+'''--------------------------------------------
+Shared log server: a number of clients on
+localhost type names into stations at once,
+two into each station. Measures the time from
+an edit being sent until every client has its
+delta.
+--------------------------------------------'''
+def benchServer(sizes, directory, clientCount, keystrokes):
+    import asyncio
+    import netServer
+    
+    async def run(path, size):
+        with contextlib.redirect_stdout(sys.stderr):
+            p = Persist(path)
+        server = netServer.NetServer(p)
+        port = await server.start('127.0.0.1', 0)
+        
+        #Time each edit was sent, and how many clients have still to see it
+        sent = {}
+        timings = []
+        
+        def onDelta(delta):
+            key = (delta['id'], delta['field'], delta['value'])
+            if key in sent:
+                start, waiting = sent[key]
+                if waiting == 1:
+                    timings.append(time.perf_counter() - start)
+                    del sent[key]
+                else:
+                    sent[key] = (start, waiting - 1)
+        
+        clients = [netServer.NetClient(onDelta) for i in range(clientCount)]
+        for client in clients:
+            await client.connect('127.0.0.1', port)
+        ids = sorted(clients[0].stations)[:clientCount]
+        
+        async def typeName(number, client):
+            #Clients type in pairs, two into each station
+            stationId = ids[(number // 2) % len(ids)]
+            name = ''
+            for i in range(keystrokes):
+                name = name + chr(ord('A') + (number + i) % 26)
+                sent[(stationId, 'name', name)] = (time.perf_counter(), clientCount)
+                await client.edit(stationId, 'name', name)
+        
+        start = time.perf_counter()
+        await asyncio.gather(*[typeName(number, client) for number, client in enumerate(clients)])
+        while sent and time.perf_counter() - start < 60:
+            await asyncio.sleep(.01)
+        seconds = time.perf_counter() - start
+        conflicts = sum(client.conflicts for client in clients)
+        for client in clients:
+            await client.close()
+        await server.close()
+        
+        result = {'benchmark': 'server', 'stations': size, 'clients': clientCount,
+            'edits': clientCount * keystrokes, 'editsPerSecond': clientCount * keystrokes / seconds,
+            'conflicts': conflicts, 'lost': len(sent)}
+        report(dict(result, **percentiles(timings or [0])))
+    
+    for size in sizes:
+        path = databasePath(directory, size)
+        workPath = path + '.work'
+        shutil.copyfile(path, workPath)
+        try:
+            asyncio.run(run(workPath, size))
+        finally:
+            removeDatabase(workPath)
+
+'''--------------------------------------------
+Repaint: time each keystroke typed into the
+editors until the event loop has painted it,
+and count the paints it caused
+--------------------------------------------'''
+def benchRepaint(keystrokes):
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QKeyEvent
+    from PyQt5.QtCore import Qt, QEvent
+    from customWidgets import callsignEdit, primaryEdit, repaints
+    
+    app = QApplication.instance() or QApplication(sys.argv)
+    keys = [(Qt.Key_A + i % 26, chr(ord('a') + i % 26)) for i in range(keystrokes)]
+    
+    for name, editor, initialText in (('callsignEdit', callsignEdit(), 'KA4ABC'), ('primaryEdit', primaryEdit(), '')):
+        editor.setText(initialText)
+        editor.resize(300, 50)
+        editor.show()
+        editor.select()
+        app.processEvents()
+        timings = []
+        paintsBefore = repaints.totalPaints
+        for key, text in keys:
+            event = QKeyEvent(QEvent.KeyPress, key, Qt.NoModifier, text)
+            repaints.beginInput()
+            start = time.perf_counter()
+            editor.handleInput(event)
+            app.processEvents()
+            timings.append(time.perf_counter() - start)
+            #Keep the name editor's text at a realistic length
+            if len(editor.text()) > 30:
+                editor.setText(initialText)
+                editor.cursorPos = 0
+        result = {'benchmark': 'repaint', 'widget': name, 'keystrokes': keystrokes,
+            'paintsPerKeystroke': (repaints.totalPaints - paintsBefore) / keystrokes}
+        report(dict(result, **percentiles(timings)))
+        editor.hide()
+
+'''--------------------------------------------
+Keystroke to screen: drive the main window with
+scripted key events and time each one until the
+event loop has finished painting it
+--------------------------------------------'''
+def keystrokeChild(path, keystrokes):
+    start = time.perf_counter()
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QKeyEvent
+    from PyQt5.QtCore import Qt, QEvent
+    import sqlite3
+    import main
+    
+    app = QApplication(sys.argv)
+    main.p = Persist(path)
+    window = main.MainFormWidget()
+    window.resize(800, 500)
+    app.processEvents()
+    #The stations are loaded after the first paint; make sure they are in
+    window.loadStations()
+    app.processEvents()
+    report({'operation': 'startup', 'seconds': time.perf_counter() - start})
+    
+    #Send one key and time it until all events it caused are processed
+    def press(key, text=''):
+        event = QKeyEvent(QEvent.KeyPress, key, Qt.NoModifier, text)
+        pressStart = time.perf_counter()
+        window.keyPressEvent(event)
+        app.processEvents()
+        return time.perf_counter() - pressStart
+    
+    def measure(operation, timings):
+        report(dict({'operation': operation, 'samples': len(timings)}, **percentiles(timings)))
+    
+    letters = [(Qt.Key_A + i % 26, chr(ord('a') + i % 26)) for i in range(keystrokes)]
+    
+    #Callsign editor is selected at startup
+    measure('typeCallsign', [press(key, text) for key, text in letters])
+    measure('arrowDown', [press(Qt.Key_Down) for i in range(keystrokes)])
+    measure('arrowUp', [press(Qt.Key_Up) for i in range(keystrokes)])
+    measure('ackToggle', [press(Qt.Key_Space, ' ') for i in range(keystrokes)])
+    press(Qt.Key_Tab)
+    measure('typeName', [press(key, text) for key, text in letters])
+    press(Qt.Key_Backtab)
+    main.p.flush()
+    main.p.wait()
+    
+    #F5 with nothing changed, then with another connection changing a
+    #station before each press
+    measure('refreshUnchanged', [press(Qt.Key_F5) for i in range(keystrokes)])
+    other = sqlite3.connect(path)
+    timings = []
+    for i in range(keystrokes):
+        other.execute('UPDATE stations SET note = ? WHERE rowid = ?;', ('NOTE' + str(i), i % 10 + 1))
+        other.commit()
+        timings.append(press(Qt.Key_F5))
+    measure('refreshChanged', timings)
+    other.close()
+    
+    report({'operation': 'peakRss', 'peakRssKb': peakRss()})
+
+def benchKeystroke(sizes, directory, keystrokes):
+    for size in sizes:
+        path = databasePath(directory, size)
+        #Benchmarks edit the database, so work on a copy
+        workPath = path + '.work'
+        shutil.copyfile(path, workPath)
+        try:
+            for result in runChild('keystroke-child', workPath, '--keystrokes', keystrokes):
+                report(dict({'benchmark': 'keystroke', 'stations': size}, **result))
+        finally:
+            removeDatabase(workPath)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Net scribe benchmarks')
+    parser.add_argument('benchmark', choices=['all', 'startup', 'startup-child', 'repaint',
+        'keystroke', 'keystroke-child', 'memory', 'memory-child', 'server', 'search', 'suggest'])
+    parser.add_argument('path', nargs='?', help='database path, for child processes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='numbers of stations in the synthetic databases')
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY,
+        help='where synthetic databases are kept')
+    parser.add_argument('--keystrokes', type=int, default=200,
+        help='key presses sent for each GUI operation')
+    parser.add_argument('--clients', type=int, default=12,
+        help='clients connected to the shared log server')
+    args = parser.parse_args()
+    
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    REVISION = revision()
+    
+    if args.benchmark == 'all':
+        benchStartup(args.sizes, args.directory)
+        benchKeystroke(args.sizes, args.directory, args.keystrokes)
+        benchRepaint(args.keystrokes)
+        benchMemory(args.sizes, args.directory)
+        benchSearch(args.sizes, args.directory, args.keystrokes)
+        benchSuggest(args.sizes, args.directory, args.keystrokes)
+    elif args.benchmark == 'startup':
+        benchStartup(args.sizes, args.directory)
+    elif args.benchmark == 'startup-child':
+        startupChild(args.path)
+    elif args.benchmark == 'repaint':
+        benchRepaint(args.keystrokes)
+    elif args.benchmark == 'keystroke':
+        benchKeystroke(args.sizes, args.directory, args.keystrokes)
+    elif args.benchmark == 'keystroke-child':
+        keystrokeChild(args.path, args.keystrokes)
+    elif args.benchmark == 'server':
+        benchServer(args.sizes, args.directory, args.clients, args.keystrokes)
+    elif args.benchmark == 'memory':
+        benchMemory(args.sizes, args.directory)
+    elif args.benchmark == 'memory-child':
+        memoryChild(args.path)
+    elif args.benchmark == 'search':
+        benchSearch(args.sizes, args.directory, args.keystrokes)
+    elif args.benchmark == 'suggest':
+        benchSuggest(args.sizes, args.directory, args.keystrokes)
@@ -0,0 +1,464 @@
+"""
+    Callsign structure and country resolution.
+
+    A callsign is a prefix of one to three characters, one numeral and a
+    suffix of one to four letters: W 3 LOR, 4X 4 ABC, 3DA 0 RU. A station
+    operating away from home adds a location prefix or a designator after
+    a stroke: VE3/W3LOR, G4ABC/P.
+
+    The country, or DXCC entity, is that of the longest allocated prefix
+    the callsign starts with, from the table below. It is compiled into a
+    trie once, when the module is imported, so resolving a callsign costs
+    one dictionary lookup per character and can be done on every keystroke.
+
+    In the database and the editor a callsign is justified: the prefix is
+    right-justified to two characters and the suffix left-justified to
+    three, so the numerals of most callsigns line up (' W3LOR', 'KU0L  ').
+    Longer prefixes and suffixes simply widen the layout ('3DA0RU ').
+    Callsigns with a location prefix or designator are kept as written.
+"""
+
+import re
+
+'''--------------------------------------------
+Prefix allocations. Each line is a list of
+prefixes and the entity they belong to. XA-XZ
+stands for every prefix from XA to XZ. The ITU
+series come first; the longer prefixes that
+follow pick out DXCC entities within them.
+--------------------------------------------'''
+ALLOCATIONS = '''
+AA-AL K N W: United States
+AM-AO EA-EH: Spain
+AP-AS 6P-6S: Pakistan
+AT-AW VT-VW 8T-8Y: India
+AX VH-VN VZ: Australia
+AY-AZ LO-LW L2-L9: Argentina
+A2 8O: Botswana
+A3: Tonga
+A4: Oman
+A5: Bhutan
+A6: United Arab Emirates
+A7: Qatar
+A8 D5 EL 5L-5M 6Z: Liberia
+A9: Bahrain
+B: China
+BU-BX: Taiwan
+CA-CE XQ-XR 3G: Chile
+CF-CK CY-CZ VA-VG VO VX-VY XJ-XO: Canada
+CL-CM CO T4: Cuba
+CN 5C-5G: Morocco
+CP: Bolivia
+CQ-CU: Portugal
+CV-CX: Uruguay
+C2: Nauru
+C3: Andorra
+C4 H2 P3 5B: Cyprus
+C5: Gambia
+C6: Bahamas
+C8-C9: Mozambique
+DA-DR Y2-Y9: Germany
+DS-DT D7-D9 HL 6K-6N: South Korea
+DU-DZ 4D-4I: Philippines
+D2-D3: Angola
+D4: Cape Verde
+D6: Comoros
+EI-EJ: Ireland
+EK: Armenia
+EM-EO UR-UZ: Ukraine
+EP-EQ 9B-9D: Iran
+ER: Moldova
+ES: Estonia
+ET 9E-9F: Ethiopia
+EU-EW: Belarus
+EX: Kyrgyzstan
+EY: Tajikistan
+EZ: Turkmenistan
+E2 HS: Thailand
+E3: Eritrea
+E4: Palestine
+E5: Cook Islands
+E6: Niue
+E7: Bosnia and Herzegovina
+F HW-HY TH TK TM TO-TQ TV-TX: France
+G M 2: England
+HA HG: Hungary
+HB HE: Switzerland
+HC-HD: Ecuador
+HF SN-SR 3Z: Poland
+HH 4V: Haiti
+HI: Dominican Republic
+HJ-HK 5J-5K: Colombia
+HM P5-P9: North Korea
+HN YI: Iraq
+HO-HP H3 H8-H9 3E-3F: Panama
+HQ-HR: Honduras
+HT H6-H7 YN: Nicaragua
+HU YS: El Salvador
+HV: Vatican
+HZ 7Z 8Z: Saudi Arabia
+H4: Solomon Islands
+I: Italy
+JA-JS 7J-7N 8J-8N: Japan
+JT-JV: Mongolia
+JW-JX LA-LN 3Y: Norway
+JY: Jordan
+JZ PK-PO YB-YH 7A-7I 8A-8I: Indonesia
+J2: Djibouti
+J3: Grenada
+J4 SV-SZ: Greece
+J5: Guinea-Bissau
+J6: Saint Lucia
+J7: Dominica
+J8: Saint Vincent
+LX: Luxembourg
+LY: Lithuania
+LZ: Bulgaria
+OA-OC 4T: Peru
+OD: Lebanon
+OE: Austria
+OF-OJ: Finland
+OK-OL: Czech Republic
+OM: Slovakia
+ON-OT: Belgium
+OU-OZ 5P-5Q: Denmark
+PA-PI: Netherlands
+PJ: Curacao
+PP-PY ZV-ZZ: Brazil
+PZ: Suriname
+P2: Papua New Guinea
+P4: Aruba
+R UA-UI: European Russia
+SA-SM 7S 8S: Sweden
+SS-SU 6A-6B: Egypt
+ST 6T-6U: Sudan
+S2: Bangladesh
+S5: Slovenia
+S6 9V: Singapore
+S7: Seychelles
+S9: Sao Tome and Principe
+TA-TC YM: Turkey
+TD TG: Guatemala
+TE TI: Costa Rica
+TF: Iceland
+TJ: Cameroon
+TL: Central African Republic
+TN: Republic of the Congo
+TR: Gabon
+TS 3V: Tunisia
+TT: Chad
+TU: Cote d'Ivoire
+TY: Benin
+TZ: Mali
+T2: Tuvalu
+T3: Kiribati
+T5 6O: Somalia
+T6 YA: Afghanistan
+T7: San Marino
+T8: Palau
+UJ-UM: Uzbekistan
+UN-UQ: Kazakhstan
+VP-VQ VS ZB-ZJ ZN-ZO ZQ: United Kingdom
+VR: Hong Kong
+V2: Antigua and Barbuda
+V3: Belize
+V4: Saint Kitts and Nevis
+V5: Namibia
+V6: Micronesia
+V7: Marshall Islands
+V8: Brunei
+XA-XI 4A-4C 6D-6J: Mexico
+XP: Greenland
+XS 3H-3U: China
+XT: Burkina Faso
+XU: Cambodia
+XV 3W: Vietnam
+XW: Laos
+XX: Macao
+XY-XZ: Myanmar
+YJ: Vanuatu
+YK 6C: Syria
+YL: Latvia
+YO-YR: Romania
+YT-YU: Serbia
+YV-YY 4M: Venezuela
+ZA: Albania
+ZK-ZM: New Zealand
+ZP: Paraguay
+ZR-ZU: South Africa
+Z2: Zimbabwe
+Z3: North Macedonia
+Z8: South Sudan
+3A: Monaco
+3B: Mauritius
+3C: Equatorial Guinea
+3DA-3DM: Eswatini
+3DN-3DZ: Fiji
+3X: Guinea
+4J-4K: Azerbaijan
+4L: Georgia
+4O: Montenegro
+4P-4S: Sri Lanka
+4U: United Nations
+4W: Timor-Leste
+4X 4Z: Israel
+5A: Libya
+5H-5I: Tanzania
+5N-5O: Nigeria
+5R-5S 6X: Madagascar
+5T: Mauritania
+5U: Niger
+5V: Togo
+5W: Samoa
+5X: Uganda
+5Y-5Z: Kenya
+6V-6W: Senegal
+6Y: Jamaica
+7O: Yemen
+7P: Lesotho
+7Q: Malawi
+7R 7T-7Y: Algeria
+8P: Barbados
+8Q: Maldives
+8R: Guyana
+9A: Croatia
+9G: Ghana
+9H: Malta
+9I-9J: Zambia
+9K: Kuwait
+9L: Sierra Leone
+9M 9W: Malaysia
+9N: Nepal
+9O-9T: Democratic Republic of the Congo
+9U: Burundi
+9X: Rwanda
+9Y-9Z: Trinidad and Tobago
+KH6 KH7 AH6 AH7 NH6 NH7 WH6 WH7: Hawaii
+KL7 AL7 NL7 WL7: Alaska
+KP4 NP4 WP4: Puerto Rico
+KP2 NP2 WP2: US Virgin Islands
+KH2 AH2 NH2 WH2: Guam
+KH0 AH0 NH0 WH0: Northern Mariana Islands
+KH8 AH8 NH8 WH8: American Samoa
+GM MM 2M: Scotland
+GW MW 2W: Wales
+GI MI 2I: Northern Ireland
+GD MD 2D: Isle of Man
+GJ MJ 2J: Jersey
+GU MU 2U: Guernsey
+VP2E: Anguilla
+VP2M: Montserrat
+VP2V: British Virgin Islands
+VP5: Turks and Caicos Islands
+VP8: Falkland Islands
+VP9: Bermuda
+VQ9: Chagos Islands
+ZB2: Gibraltar
+ZD7: Saint Helena
+ZD8: Ascension Island
+ZF: Cayman Islands
+ZL7: Chatham Islands
+ZL8: Kermadec Islands
+VK9N: Norfolk Island
+VK9X: Christmas Island
+VK0: Heard Island
+VE0 VA0 VO1 VO2 VY0: Canada
+CT3 CQ3: Madeira
+CU: Azores
+EA6: Balearic Islands
+EA8: Canary Islands
+EA9: Ceuta and Melilla
+IS0 IM0: Sardinia
+IT9: Sicily
+JD1: Ogasawara
+OH0: Aland Islands
+OJ0: Market Reef
+OX: Greenland
+OY: Faroe Islands
+SV5: Dodecanese
+SV9: Crete
+TK: Corsica
+UA9 UA0 R8 R9 R0 RA9 RA0 RK9 RK0 RN9 RN0 RU9 RU0 RV9 RV0 RW9 RW0 RX9 RX0 RZ9 RZ0: Asiatic Russia
+UA2 R2 RA2: Kaliningrad
+'''
+
+#Key under which a trie node keeps the entity of the prefix ending there.
+#No callsign character is an empty string, so it cannot clash.
+ENTITY = ''
+
+#Designators that can follow a callsign after a stroke, besides a call
+#area numeral
+DESIGNATORS = ('P', 'M', 'MM', 'AM', 'QRP', 'A')
+
+#Compile the allocation table into a trie of nested dicts, one level per
+#character. Later lines override earlier ones, so the longer DXCC
+#prefixes at the end win over the ITU series they fall in.
+def compileTrie(table):
+    root = {}
+    for line in table.strip().splitlines():
+        prefixes, entity = line.rsplit(':', 1)
+        for prefix in prefixes.split():
+            if '-' in prefix:
+                first, last = prefix.split('-')
+                expanded = [first[:-1] + chr(code) for code in range(ord(first[-1]), ord(last[-1]) + 1)]
+            else:
+                expanded = [prefix]
+            for allocated in expanded:
+                node = root
+                for char in allocated:
+                    node = node.setdefault(char, {})
+                node[ENTITY] = entity.strip()
+    return root
+
+PREFIX_TRIE = compileTrie(ALLOCATIONS)
+
+#Length and entity of the longest allocated prefix the text starts with,
+#or (0, None) if it starts with none
+def resolvePrefix(text):
+    node = PREFIX_TRIE
+    length = 0
+    entity = None
+    for i in range(len(text)):
+        node = node.get(text[i])
+        if node is None:
+            break
+        if ENTITY in node:
+            length = i + 1
+            entity = node[ENTITY]
+    return length, entity
+
+#True if a callsign can begin with the text: it starts with an allocated
+#prefix, or is the start of one
+def canBegin(text):
+    node = PREFIX_TRIE
+    for char in text:
+        if ENTITY in node:
+            return True
+        node = node.get(char)
+        if node is None:
+            return False
+    return True
+
+#True if an allocated prefix begins with the text, i.e. the text is a path
+#in the trie. A numeral typed after a prefix fails this unless the
+#allocation itself contains a digit there.
+def startsPrefix(text):
+    node = PREFIX_TRIE
+    for char in text:
+        node = node.get(char)
+        if node is None:
+            return False
+    return True
+
+#Plain base callsign: last numeral, with only letters after it
+BASE_PATTERN = re.compile(r'([A-Z0-9]*?)(\d)([A-Z]*)$')
+
+'''--------------------------------------------
+A callsign split into its parts. Parts may be
+partial while a callsign is being typed; the
+location and designator are None when absent
+and '' when only their stroke has been typed.
+--------------------------------------------'''
+class Callsign:
+
+    def __init__(self, prefix='', numeral='', suffix='', location=None, designator=None):
+        self.prefix = prefix
+        self.numeral = numeral
+        self.suffix = suffix
+        self.location = location
+        self.designator = designator
+
+    #Entity of the location prefix if there is one, else of the callsign
+    #itself. Maritime and aeronautical mobile stations are in no entity.
+    def entity(self):
+        if self.designator in ('MM', 'AM'):
+            return None
+        if self.location:
+            return resolvePrefix(self.location)[1]
+        return resolvePrefix(self.prefix + self.numeral + self.suffix)[1]
+
+    def isValid(self):
+        if not (1 <= len(self.prefix) <= 3 and re.search('[A-Z]', self.prefix)):
+            return False
+        if len(self.numeral) != 1 or not (1 <= len(self.suffix) <= 4) or not self.suffix.isalpha():
+            return False
+        if resolvePrefix(self.prefix + self.numeral + self.suffix)[0] == 0:
+            return False
+        if self.location is not None and resolvePrefix(self.location)[0] == 0:
+            return False
+        if self.designator is not None and not (self.designator in DESIGNATORS or
+                (len(self.designator) == 1 and self.designator.isdigit())):
+            return False
+        return True
+
+    #The text of the callsign with the part each character belongs to, as
+    #(part, index within the part) for every character. Padding has an
+    #index of None and strokes belong to the part they introduce.
+    def layout(self):
+        cells = []
+        plain = self.location is not None or self.designator is not None
+        if self.location is not None:
+            cells.extend(('location', i) for i in range(len(self.location)))
+            cells.append(('location', None))
+        if not plain:
+            cells.extend(('prefix', None) for i in range(2 - len(self.prefix)))
+        cells.extend(('prefix', i) for i in range(len(self.prefix)))
+        cells.append(('numeral', 0 if self.numeral else None))
+        cells.extend(('suffix', i) for i in range(len(self.suffix)))
+        if not plain:
+            cells.extend(('suffix', None) for i in range(3 - len(self.suffix)))
+        if self.designator is not None:
+            cells.append(('designator', None))
+            cells.extend(('designator', i) for i in range(len(self.designator)))
+        return cells
+
+    def justified(self):
+        text = ''
+        for part, index in self.layout():
+            if index is not None:
+                text = text + getattr(self, part)[index]
+            elif (part == 'location' and text) or part == 'designator':
+                text = text + '/'
+            else:
+                text = text + ' '
+        return text
+
+#Split the base of a callsign, as typed or as justified, into prefix,
+#numeral and suffix. Without a numeral, a gap where the numeral would be
+#separates the prefix from the suffix.
+def parseBase(text):
+    match = BASE_PATTERN.match(text.replace(' ', ''))
+    if match is not None:
+        return match.groups()
+    parts = text.split()
+    if len(parts) == 0:
+        return '', '', ''
+    if len(parts) == 1:
+        return parts[0][:3], '', parts[0][3:]
+    return parts[0], '', ''.join(parts[1:])
+
+#Parse a callsign, e.g. 'W3LOR', ' W3LOR', 'VE3/W3LOR' or 'G4ABC/P'.
+#Anything can be parsed; isValid() says whether it is a complete callsign.
+def parseCallsign(text):
+    pieces = text.upper().split('/')
+    location = None
+    designator = None
+    if len(pieces) >= 3:
+        location = pieces[0].strip()
+        base = pieces[1]
+        designator = pieces[2].strip()
+    elif len(pieces) == 2:
+        first = parseBase(pieces[0])
+        second = parseBase(pieces[1])
+        #The piece that is a whole callsign is the base; a stroke typed
+        #after a prefix and numeral alone starts a location prefix
+        if (second[1] and second[2] and not (first[1] and first[2])) or (first[1] and not first[2]):
+            location = pieces[0].strip()
+            base = pieces[1]
+        else:
+            base = pieces[0]
+            designator = pieces[1].strip()
+    else:
+        base = pieces[0]
+    prefix, numeral, suffix = parseBase(base)
+    return Callsign(prefix, numeral, suffix, location, designator)
@@ -2,9 +2,12 @@
 This module defines custom widgets used in the main program.
 """
 
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import (Qt, pyqtSignal, QObject, QEvent, Qt)
+from PyQt5.QtWidgets import (QWidget, QLineEdit, QTableView, QAbstractItemView, QHeaderView,
+    QStyle, QStyleOption)
+from PyQt5.QtGui import (QPainter, QBrush, QColor, QFontMetricsF, QStaticText, QTransform)
+from PyQt5.QtCore import (Qt, pyqtSignal, QObject, QEvent, QTimer, QAbstractTableModel, QModelIndex, QPointF, QRectF)
+
+from callsigns import Callsign, parseCallsign, resolvePrefix, canBegin, startsPrefix
 
 '''--------------------------------------------
 Some configuration variables
@@ -38,64 +41,267 @@ EDITOR_UNSELECTED_STYLESHEET = '''
     ''' + EDITOR_COMMON_STYLESHEET
 
 
-class stationTable(QTableWidget):
+class stationTableModel(QAbstractTableModel):
+    '''--------------------------------------------
+    Table model backed directly by a StationList.
+    Cells are read from the stations on demand, so
+    nothing is copied up front and an edit only
+    needs to announce the row that changed. Views
+    pull further pages from the database through
+    canFetchMore / fetchMore as they scroll.
+    --------------------------------------------'''
+    
+    #Station attribute shown in each column
+    COLUMNS = ('callsign', 'name', 'ackText', 'note')
+    
+    def __init__(self, stations, p):
+        QAbstractTableModel.__init__(self)
+        self.stations = stations
+        self.p = p
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.stations.list)
+    
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.COLUMNS)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        station = self.stations.list[index.row()]
+        return getattr(station, self.COLUMNS[index.column()])
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.stations.hasMore
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        for row, stations in self.stations.pageRuns(self.stations.fetchPage(self.p)):
+            self.beginInsertRows(QModelIndex(), row, row + len(stations) - 1)
+            self.stations.insertStations(row, stations)
+            self.endInsertRows()
+    
+    #Notify views that a single station was edited
+    def stationChanged(self, row):
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+    
+    #Notify views that the station list was rebuilt
+    def reset(self):
+        self.beginResetModel()
+        self.endResetModel()
+
+class searchResultsModel(QAbstractTableModel):
+    '''--------------------------------------------
+    Table model over the stations found by a text
+    search, shown in place of the station list
+    while searching. Columns are the same.
+    --------------------------------------------'''
+    
+    def __init__(self):
+        QAbstractTableModel.__init__(self)
+        self.results = []
+    
+    def setResults(self, results):
+        self.beginResetModel()
+        self.results = results
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.results)
+    
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(stationTableModel.COLUMNS)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        station = self.results[index.row()]
+        return getattr(station, stationTableModel.COLUMNS[index.column()])
+    
+    def stationChanged(self, row):
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(stationTableModel.COLUMNS) - 1))
+
+class stationTable(QTableView):
     '''--------------------------------------------
-    A table for the data to display, with various
-    helper methods.
+    A view for the station table model, with various
+    helper methods. Rows have a fixed height so the
+    view only ever lays out the visible rows.
     --------------------------------------------'''
     
-    def __init__(self, one, two):
-        QTableWidget.__init__(self, one, two)
+    def __init__(self, model):
+        QTableView.__init__(self)
+        self.setModel(model)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setSelectionMode(QAbstractItemView.SingleSelection)
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setWordWrap(False)
         self.horizontalHeader().setStretchLastSection(True)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 8)
         self.setStyleSheet(TABLE_STYLESHEET)
         self.verticalHeader().hide()
         self.horizontalHeader().hide()
         self.setFocusPolicy(Qt.NoFocus)
     
     '''--------------------------------------------
-    Use the station list to create the items in the
-    table
+    Re-read every station, e.g. after the list
+    itself has been rebuilt
     --------------------------------------------'''
-    def populate(self, stations):
-        for i in range(len(stations.list)):
-            station = stations.list[i]
-            itemToInsert = QTableWidgetItem(station.callsign)
-            self.setItem(i, 0, itemToInsert)
-            itemToInsert = QTableWidgetItem(station.name)
-            self.setItem(i, 1, itemToInsert)
-            itemToInsert = QTableWidgetItem(station.ackText)
-            self.setItem(i, 2, itemToInsert)
-            itemToInsert = QTableWidgetItem(station.note)
-            self.setItem(i, 3, itemToInsert)
+    def refresh(self):
+        self.model().reset()
     
     '''--------------------------------------------
-    Assuming the number of stations hasn't changed,
-    update the data for each
+    Re-read a single station after it was edited
     --------------------------------------------'''
-    def refresh(self, stations):
-        for i in range(len(stations.list)):
-            station = stations.list[i]
-            if self.item(i, 0).text() != station.callsign:
-                self.setItem(i, 0, QTableWidgetItem(station.callsign))
-                
-            if self.item(i, 1).text() != station.name:
-                self.setItem(i, 1, QTableWidgetItem(station.name))
-                
-            if self.item(i, 2).text() != station.ackText:
-                self.setItem(i, 2, QTableWidgetItem(station.ackText))
-                
-            if self.item(i, 3).text() != station.note:
-                self.setItem(i, 3, QTableWidgetItem(station.note))
+    def refreshRow(self, row):
+        self.model().stationChanged(row)
+    
+    '''--------------------------------------------
+    Set the current selection based on a row
+    --------------------------------------------'''
+    def setSelection(self, row):
+        self.selectRow(row)
+    
     '''--------------------------------------------
-    Set the current selection based on a callsign
+    Set the current selection based on a callsign,
+    using the station list's callsign index
     --------------------------------------------'''
-    def setSelection(self, callsign):
-        for i in range(self.rowCount()):
-            if self.item(i, 0).text() == callsign:
-                self.setCurrentItem(self.item(i, 0))
+    def setSelectionByCallsign(self, callsign):
+        row = self.model().stations.rowOf(callsign)
+        if row is not None:
+            self.selectRow(row)
+
+'''--------------------------------------------
+Deferred repaint scheduler. Widgets ask for a
+repaint through schedule(); each widget is then
+updated once when control returns to the event
+loop, however many times it was asked during
+the current input event. It also counts editor
+paints per input event so extra paints show up.
+--------------------------------------------'''
+class repaintScheduler(QObject):
+    
+    def __init__(self):
+        QObject.__init__(self)
+        self.pending = {}
+        self.flushQueued = False
+        #Paint counting
+        self.inputEvents = 0
+        self.totalPaints = 0
+        self.currentPaints = 0
+        self.lastInputPaints = 0
+        self.maxInputPaints = 0
+    
+    #Ask for a widget to be repainted at the end of this event-loop turn
+    def schedule(self, widget):
+        self.pending[widget] = True
+        if not self.flushQueued:
+            self.flushQueued = True
+            QTimer.singleShot(0, self.flush)
+    
+    #Update every pending widget once. update() also merges with any
+    #update Qt queued itself, e.g. from setText.
+    def flush(self):
+        self.flushQueued = False
+        pending = self.pending
+        self.pending = {}
+        for widget in pending:
+            widget.update()
+    
+    #Mark the start of a new input event for the paint counters
+    def beginInput(self):
+        if self.inputEvents > 0:
+            self.lastInputPaints = self.currentPaints
+            self.maxInputPaints = max(self.maxInputPaints, self.currentPaints)
+        self.inputEvents = self.inputEvents + 1
+        self.currentPaints = 0
+    
+    #Called from paintEvent of the widgets being counted
+    def countPaint(self):
+        self.currentPaints = self.currentPaints + 1
+        self.totalPaints = self.totalPaints + 1
+    
+    #Average paints per input event so far
+    def paintsPerInput(self):
+        if self.inputEvents == 0:
+            return 0.0
+        return self.totalPaints / self.inputEvents
+
+#The scheduler shared by all widgets
+repaints = repaintScheduler()
+
+'''--------------------------------------------
+Bridge from futures completed on another thread,
+such as the database worker, to signals handled
+on the UI thread. The signals are emitted from
+the worker, and Qt queues them to this object's
+thread.
+--------------------------------------------'''
+class futureSignals(QObject):
+    
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    
+    #Emit succeeded with the result or failed with the exception once the
+    #future is done. None, e.g. from a flush with nothing to write, is
+    #ignored.
+    def watch(self, future):
+        if future is not None:
+            future.add_done_callback(self.emitResult)
+        return future
+    
+    def emitResult(self, future):
+        exception = future.exception()
+        if exception is None:
+            self.succeeded.emit(future.result())
+        else:
+            self.failed.emit(exception)
+
+'''--------------------------------------------
+Cached layout of an editor's text: the x offset
+of every glyph and a QStaticText to draw. It is
+rebuilt only when the text or font changes, not
+on every paint.
+--------------------------------------------'''
+class textLayout:
+    
+    def __init__(self, text, font):
+        fontMetrics = QFontMetricsF(font)
+        self.text = text
+        #offsets[i] is the left edge of character i, offsets[-1] the end
+        self.offsets = [0.0]
+        for char in text:
+            self.offsets.append(self.offsets[-1] + fontMetrics.horizontalAdvance(char))
+        self.width = self.offsets[-1]
+        self.height = fontMetrics.height()
+        self.ascent = fontMetrics.ascent()
+        self.zeroWidth = fontMetrics.horizontalAdvance('0')
+        self.staticText = QStaticText(text)
+        self.staticText.setTextFormat(Qt.PlainText)
+        self.staticText.prepare(QTransform(), font)
+    
+    #Width of the character at a position, or of a '0' past the end
+    def charWidth(self, position):
+        if position < len(self.text):
+            return self.offsets[position + 1] - self.offsets[position]
+        return self.zeroWidth
+
+#Cursor brush is the same for every editor
+CURSOR_BRUSH = QBrush(QColor(0, 0, 0, 255), Qt.SolidPattern)
+
+#Colour of suggested text in an empty editor
+SUGGESTION_COLOR = QColor(96, 96, 96, 255)
 
 '''--------------------------------------------
 Custom subclass of QLineEdit with validation
@@ -110,81 +316,184 @@ class callsignEdit(QLineEdit):
     
     def __init__(self):
         QLineEdit.__init__(self)
+        self.textLayoutCache = None
+        self.charRectBrush = None
+        self.setStyleSheet(EDITOR_SELECTED_STYLESHEET)
+        self.callsign = None
+        self.callsignText = None
+        self.textChanged.connect(self.invalidateLayout)
     
+    #The stylesheet only changes with the selection state, so it is set
+    #here rather than on every paint
     def select(self):
-        self.selected = True
-        self.repaint()
+        if not self.selected:
+            self.selected = True
+            self.setStyleSheet(EDITOR_SELECTED_STYLESHEET)
+            repaints.schedule(self)
     
     def deselect(self):
-        self.selected = False
-        self.repaint()
+        if self.selected:
+            self.selected = False
+            self.setStyleSheet(EDITOR_UNSELECTED_STYLESHEET)
+            repaints.schedule(self)
+    
+    #Drop the cached text layout, it is rebuilt on the next paint
+    def invalidateLayout(self):
+        self.textLayoutCache = None
+    
+    #Font and palette changes (e.g. from the stylesheet) invalidate the
+    #cached layout and brushes
+    def changeEvent(self, event):
+        if event.type() in (QEvent.FontChange, QEvent.StyleChange, QEvent.PaletteChange):
+            self.textLayoutCache = None
+            self.charRectBrush = None
+        QLineEdit.changeEvent(self, event)
+    
+    #The callsign being edited, split into its parts. Text set from outside
+    #is parsed; while typing, the parts are kept, since a partial callsign
+    #such as a prefix ending in a digit cannot be told apart from its text.
+    def parts(self):
+        if self.callsignText != self.text():
+            self.callsign = parseCallsign(self.text())
+            self.callsignText = self.text()
+        return self.callsign
+    
+    def setParts(self, callsign):
+        self.callsign = callsign
+        self.callsignText = callsign.justified()
+        self.setText(self.callsignText)
     
     def isValidCall(self):
-        import re
-        if re.match(r'[a-zA-Z]{1,2}\d[a-zA-Z]{1,3}', self.text()):
-            return True
-        return False
+        return self.parts().isValid()
     
-    #Handle text inputs
+    #Country of the callsign typed so far, None until its prefix resolves
+    def entity(self):
+        return self.parts().entity()
+    
+    #Part of the callsign and index within it under the cursor, or at the
+    #end of the last part if the cursor is past the end of the text
+    def cursorCell(self, callsign, cells):
+        if self.cursorPos < len(cells):
+            return cells[self.cursorPos]
+        part = cells[-1][0]
+        return (part, len(getattr(callsign, part)))
+    
+    #Put the cursor after the given character of the callsign
+    def cursorAfter(self, callsign, part, index):
+        cells = callsign.layout()
+        self.cursorPos = cells.index((part, index)) + 1 if (part, index) in cells else len(cells)
+    
+    #Handle text inputs. The text is rebuilt from the parts of the callsign
+    #after every key, so the layout follows the prefix as it resolves:
+    #a digit is part of the prefix only while the prefix could continue
+    #with it, and letters that cannot start an allocated prefix are refused.
     def handleInput(self, event):
         if self.selected:
             pressedChar = event.text().upper()
-            #If it's a number, it goes in the number location in the call
-            if pressedChar in '0123456789':
-                self.cursorPos = 3
-                self.setText(self.text()[:2]+pressedChar+self.text()[3:])
-            #If it's a letter:
-            else:
-                #US calls only at the moment, so anything besides K N or W
-                #cannot be the first letter
-                if self.cursorPos == 0 and pressedChar not in 'KNW':
-                    self.cursorPos = 1
-                #If the cursor is in the number location, skip to the next
-                #letter location
-                if self.cursorPos == 2:
-                    self.cursorPos = 3
-                #If the cursor is in the middle of the word, insert the character
-                if self.cursorPos < len(self.text()):
-                    self.setText(self.text()[:self.cursorPos] + pressedChar + self.text()[self.cursorPos+1:])
-                #Otherwise, insert at the end
+            if pressedChar == '':
+                return
+            callsign = self.parts()
+            cells = callsign.layout()
+            part, index = self.cursorCell(callsign, cells)
+            
+            #A stroke after an allocated prefix, with or without a numeral,
+            #makes it a location prefix (F/, VE3/); after a whole callsign
+            #it starts a designator
+            if pressedChar == '/':
+                if callsign.suffix and callsign.designator is None:
+                    callsign.designator = ''
+                    self.setParts(callsign)
+                    self.cursorPos = len(self.text())
+                elif (callsign.numeral or resolvePrefix(callsign.prefix)[0] == len(callsign.prefix) > 0) \
+                        and not callsign.suffix and callsign.location is None:
+                    callsign = Callsign(location=callsign.prefix + callsign.numeral)
+                    self.setParts(callsign)
+                    self.cursorPos = len(self.text())
+            
+            #Location prefixes and designators are typed as they are
+            elif part in ('location', 'designator'):
+                text = getattr(callsign, part)
+                index = len(text) if index is None else index
+                if index < (4 if part == 'location' else 3):
+                    setattr(callsign, part, text[:index] + pressedChar + text[index+1:])
+                    self.setParts(callsign)
+                    self.cursorAfter(callsign, part, index)
+            
+            #A digit continues a prefix that has no entity of its own yet
+            #(3D, E2) if an allocated prefix does, otherwise it is the numeral
+            elif pressedChar in '0123456789':
+                prefix = callsign.prefix
+                if callsign.numeral == '' and len(prefix) < 3 and resolvePrefix(prefix)[0] == 0 \
+                        and startsPrefix(prefix + pressedChar):
+                    callsign.prefix = prefix + pressedChar
+                    self.setParts(callsign)
+                    self.cursorAfter(callsign, 'prefix', len(prefix))
                 else:
-                    self.setText(self.text()[:self.cursorPos] + pressedChar)
-                #After typing letters, advance the cursor
-                self.cursorRight()
-            #Must call repaint manually
-            self.repaint()
+                    callsign.numeral = pressedChar
+                    self.setParts(callsign)
+                    self.cursorAfter(callsign, 'numeral', 0)
+            
+            #A letter in the prefix must still begin an allocated prefix
+            elif part == 'prefix' or (callsign.numeral == '' and not callsign.suffix):
+                prefix = callsign.prefix
+                if part != 'prefix':
+                    index = len(prefix)
+                    prefix = prefix + pressedChar
+                elif index is None:
+                    index = 0
+                    prefix = pressedChar + prefix
+                else:
+                    prefix = prefix[:index] + pressedChar + prefix[index+1:]
+                if len(prefix) <= 3 and canBegin(prefix):
+                    callsign.prefix = prefix
+                    self.setParts(callsign)
+                    self.cursorAfter(callsign, 'prefix', index)
+            
+            #Otherwise it goes in the suffix, skipping over the numeral
+            else:
+                suffix = callsign.suffix
+                if part == 'numeral':
+                    index = 0
+                elif index is None:
+                    index = len(suffix)
+                if index < 4:
+                    callsign.suffix = suffix[:index] + pressedChar + suffix[index+1:]
+                    self.setParts(callsign)
+                    self.cursorAfter(callsign, 'suffix', index)
+            #Must ask for a repaint manually
+            repaints.schedule(self)
     
-    #Handle the delete key
+    #Handle the delete key. Removes the character under the cursor from its
+    #part of the callsign; the layout closes up around it. Deleting a
+    #stroke drops the location prefix or designator it introduced.
     def handleDelete(self):
         if self.selected:
-            #These conditionals make sure the call stays justified at the number
-            #First position, insert a space instead and advance the cursor
-            if self.cursorPos == 0:
-                self.setText(' '+self.text()[1:])
+            callsign = self.parts()
+            cells = callsign.layout()
+            if self.cursorPos >= len(cells):
+                return
+            part, index = cells[self.cursorPos]
+            if index is None and part == 'location':
+                callsign.location = None
+            elif index is None and part == 'designator':
+                callsign.designator = None
+            elif index is None:
+                #Padding or an empty numeral, just move on as before
                 self.cursorRight()
-            #Second position, move the first character over
-            elif self.cursorPos == 1:
-                self.setText(' '+self.text()[0]+self.text()[2:])
-                self.cursorRight()
-            #Number position, just replace the number with a space
-            elif self.cursorPos == 2:
-                self.setText(self.text()[:2] + ' ' + self.text()[3:])
-                self.cursorRight()
-            #Suffix, move everythig left and replace with spaces
+                return
             else:
-                self.setText(self.text()[:3]+self.text()[4:]+' ')
-                self.repaint()
+                text = getattr(callsign, part)
+                setattr(callsign, part, text[:index] + text[index+1:])
+            self.setParts(callsign)
+            #Keep the cursor on the same part where the text closed up
+            if (part, index) in callsign.layout():
+                self.cursorPos = callsign.layout().index((part, index))
+            self.cursorPos = min(self.cursorPos, len(self.text()))
+            repaints.schedule(self)
     
     #Customized paint method
     def paintEvent(self, event):
-    
-        import re
-        
-        #Set the stylesheet based on whether or not it's selected
-        if self.selected:
-            self.setStyleSheet(EDITOR_SELECTED_STYLESHEET)
-        else:
-            self.setStyleSheet(EDITOR_UNSELECTED_STYLESHEET)
+        repaints.countPaint()
         
         #This chunk forces the control to obey the stylesheet
         opt = QStyleOption()
@@ -195,56 +504,51 @@ class callsignEdit(QLineEdit):
         
         #had some code to justify the call, but now the database
         #uses spaces to justify it in the record so just use
-        #the current text
-        callToDisplay = self.text()
-        
-        #get some info about the size of the text
-        fontMetrics = self.fontMetrics()
-        textWidth = fontMetrics.width(callToDisplay)
-        textHeight = fontMetrics.height()
+        #the current text. Glyph positions are cached per text.
+        if self.textLayoutCache is None:
+            self.textLayoutCache = textLayout(self.text(), self.font())
+        layout = self.textLayoutCache
+        textHeight = layout.height
         
         #get position for centering text
-        textLeft = ((self.width() - textWidth) / 2)
+        textLeft = ((self.width() - layout.width) / 2)
         #I don't know how this works, but this looks OK and I don't
         #have time to research it at the moment
         textBottom = int(textHeight * .9)
         
         #Get a brush that's a little bit darker than the current background color
-        charRectBrush = QBrush(Qt.SolidPattern)
-        charRectBrush.setColor(self.palette().color(QWidget.backgroundRole(self)).darker(125))
+        if self.charRectBrush is None:
+            self.charRectBrush = QBrush(self.palette().color(QWidget.backgroundRole(self)).darker(125), Qt.SolidPattern)
         #Loop through the number of characters and print boxes behind them
-        for offset in range(len(callToDisplay)):
-            thisChar = callToDisplay[offset]
-            rectLeft = textLeft + fontMetrics.width(callToDisplay[:(offset)])
-            rectTop = textBottom * .25
-            rectWidth = fontMetrics.width(thisChar) - 2
-            rectHeight = fontMetrics.height() * .8
-            painter.fillRect(rectLeft, rectTop, rectWidth, rectHeight, charRectBrush)
+        rectTop = textBottom * .25
+        rectHeight = textHeight * .8
+        for offset in range(len(layout.text)):
+            rectLeft = textLeft + layout.offsets[offset]
+            rectWidth = layout.charWidth(offset) - 2
+            painter.fillRect(QRectF(rectLeft, rectTop, rectWidth, rectHeight), self.charRectBrush)
         
         #Draw the text
-        painter.drawText(textLeft, textBottom, callToDisplay)
+        painter.drawStaticText(QPointF(textLeft, textBottom - layout.ascent), layout.staticText)
         
         #Only draw the cursor if the control is selected
         if self.selected:
-            cursorLeft = textLeft + fontMetrics.width(callToDisplay[:self.cursorPos])
-            cursorWidth = fontMetrics.width(callToDisplay[self.cursorPos])
-            
-            cursorBrush = QBrush(Qt.SolidPattern)
-            cursorBrush.setColor(QColor(0, 0, 0, 255))
-            painter.fillRect(cursorLeft, textHeight, cursorWidth, 3, cursorBrush)
+            cursorLeft = textLeft + layout.offsets[min(self.cursorPos, len(layout.text))]
+            cursorWidth = layout.charWidth(self.cursorPos)
+            painter.fillRect(QRectF(cursorLeft, textHeight, cursorWidth, 3), CURSOR_BRUSH)
     
     #helper methods for moving the cursor around
+    #The cursor can also sit just past the text, to add to the last part
     def cursorRight(self):
         self.cursorPos = self.cursorPos + 1
-        if self.cursorPos > 5:
+        if self.cursorPos > len(self.text()):
             self.cursorPos = 0
-        self.repaint()
+        repaints.schedule(self)
     
     def cursorLeft(self):
         self.cursorPos = self.cursorPos - 1
         if self.cursorPos < 0:
-            self.cursorPos = 5
-        self.repaint()
+            self.cursorPos = len(self.text())
+        repaints.schedule(self)
 
 '''--------------------------------------------
 Custom subclass of QLineEdit for primary data
@@ -259,14 +563,44 @@ class primaryEdit(QLineEdit):
     
     def __init__(self):
         QLineEdit.__init__(self)
+        self.textLayoutCache = None
+        #Greyed text shown while the editor is empty, e.g. a looked up name
+        self.suggestion = ''
+        self.suggestionLayoutCache = None
+        self.setStyleSheet(EDITOR_UNSELECTED_STYLESHEET)
+        self.textChanged.connect(self.invalidateLayout)
     
+    #The stylesheet only changes with the selection state, so it is set
+    #here rather than on every paint
     def select(self):
-        self.selected = True
-        self.repaint()
+        if not self.selected:
+            self.selected = True
+            self.setStyleSheet(EDITOR_SELECTED_STYLESHEET)
+            repaints.schedule(self)
     
     def deselect(self):
-        self.selected = False
-        self.repaint()
+        if self.selected:
+            self.selected = False
+            self.setStyleSheet(EDITOR_UNSELECTED_STYLESHEET)
+            repaints.schedule(self)
+    
+    #Drop the cached text layout, it is rebuilt on the next paint
+    def invalidateLayout(self):
+        self.textLayoutCache = None
+    
+    #Font changes (e.g. from the stylesheet) invalidate the cached layouts
+    def changeEvent(self, event):
+        if event.type() in (QEvent.FontChange, QEvent.StyleChange):
+            self.textLayoutCache = None
+            self.suggestionLayoutCache = None
+        QLineEdit.changeEvent(self, event)
+    
+    #Set the greyed suggestion, or clear it with ''
+    def setSuggestion(self, suggestion):
+        if suggestion != self.suggestion:
+            self.suggestion = suggestion
+            self.suggestionLayoutCache = None
+            repaints.schedule(self)
     
     #Handle keys input. Insert if cursor not at end.
     def handleInput(self, event):
@@ -282,16 +616,18 @@ class primaryEdit(QLineEdit):
     def handleDelete(self):
         if self.selected:
             self.setText(self.text()[:self.cursorPos]+self.text()[self.cursorPos+1:])
-            self.repaint()
+            repaints.schedule(self)
+    
+    #Handle the backspace key: delete the character before the cursor
+    def handleBackspace(self):
+        if self.selected and self.cursorPos > 0:
+            self.setText(self.text()[:self.cursorPos-1]+self.text()[self.cursorPos:])
+            self.cursorPos = self.cursorPos - 1
+            repaints.schedule(self)
     
     #Custom paint method
     def paintEvent(self, event):
-        
-        #Set the correct stylesheet
-        if self.selected:
-            self.setStyleSheet(EDITOR_SELECTED_STYLESHEET)
-        else:
-            self.setStyleSheet(EDITOR_UNSELECTED_STYLESHEET)
+        repaints.countPaint()
         
         #Force it to use the stylesheet
         opt = QStyleOption()
@@ -300,30 +636,36 @@ class primaryEdit(QLineEdit):
         s = self.style()
         s.drawPrimitive(QStyle.PE_Widget, opt, painter, self)
         
-        #Get some info on the text size
-        fontMetrics = self.fontMetrics()
-        textWidth = fontMetrics.width(self.text())
-        textHeight = fontMetrics.height()
+        #Get some info on the text size, cached per text
+        if self.textLayoutCache is None:
+            self.textLayoutCache = textLayout(self.text(), self.font())
+        layout = self.textLayoutCache
+        textHeight = layout.height
         
         #Calculate the text position. 
-        textLeft = ((self.width() - textWidth) / 2)
+        textLeft = ((self.width() - layout.width) / 2)
         textBottom = int(textHeight * .9)
         
-        #Draw the text
-        painter.drawText(textLeft, textBottom, self.text())
+        #Draw the text, or the suggestion in grey if there is no text
+        if len(layout.text) == 0 and self.suggestion:
+            if self.suggestionLayoutCache is None:
+                self.suggestionLayoutCache = textLayout(self.suggestion, self.font())
+            suggestionLayout = self.suggestionLayoutCache
+            painter.save()
+            painter.setPen(SUGGESTION_COLOR)
+            painter.drawStaticText(QPointF((self.width() - suggestionLayout.width) / 2, textBottom - suggestionLayout.ascent),
+                suggestionLayout.staticText)
+            painter.restore()
+        else:
+            painter.drawStaticText(QPointF(textLeft, textBottom - layout.ascent), layout.staticText)
         
         #Only draw the cursor if selected
         if self.selected:
-            cursorLeft = textLeft + fontMetrics.width(self.text()[:self.cursorPos])
-            if self.cursorPos < len(self.text()):
-                cursorWidth = fontMetrics.width(self.text()[self.cursorPos])
-            else:
-                cursorWidth = fontMetrics.width('0')
-            
-            cursorBrush = QBrush(Qt.SolidPattern)
-            cursorBrush.setColor(QColor(0, 0, 0, 255))
-            cursor = painter.drawRect(cursorLeft, textHeight, cursorWidth, 3)
-            painter.fillRect(cursorLeft, textHeight, cursorWidth, 3, cursorBrush)
+            cursorLeft = textLeft + layout.offsets[min(self.cursorPos, len(layout.text))]
+            cursorWidth = layout.charWidth(self.cursorPos)
+            cursorRect = QRectF(cursorLeft, textHeight, cursorWidth, 3)
+            painter.drawRect(cursorRect)
+            painter.fillRect(cursorRect, CURSOR_BRUSH)
     #Helpers to move the cursor around
     def cursorRight(self):
         self.cursorPos = self.cursorPos + 1
@@ -331,7 +673,7 @@ class primaryEdit(QLineEdit):
             self.cursorPos = 0
         if len(self.text()) == 0:
             self.cursorPos = 0
-        self.repaint()
+        repaints.schedule(self)
     
     def cursorLeft(self):
         self.cursorPos = self.cursorPos - 1
@@ -339,4 +681,73 @@ class primaryEdit(QLineEdit):
             self.cursorPos = len(self.text())
         if len(self.text()) == 0:
             self.cursorPos = 0
-        self.repaint()
\ No newline at end of file
+        repaints.schedule(self)
+
+'''--------------------------------------------
+Net script panel. Every line of the compiled
+script has its own cached text layout, so when
+a value changes only the lines showing it are
+laid out again and repainted.
+--------------------------------------------'''
+SCRIPT_STYLESHEET = '''
+    font-family: "Consolas";
+    font-size: 16px;
+    '''
+
+SCRIPT_BACKGROUND_BRUSH = QBrush(QColor(16, 16, 48, 255), Qt.SolidPattern)
+SCRIPT_TEXT_COLOR = QColor(255, 255, 200, 255)
+SCRIPT_MARGIN = 6
+
+class scriptPanel(QWidget):
+    
+    def __init__(self):
+        QWidget.__init__(self)
+        self.script = None
+        self.lineLayouts = []
+        self.setStyleSheet(SCRIPT_STYLESHEET)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.lineHeight = QFontMetricsF(self.font()).height()
+    
+    #Show a compiled script, or nothing if None
+    def setScript(self, script):
+        self.script = script
+        self.lineLayouts = [None] * (len(script.rendered) if script is not None else 0)
+        self.resizeToLines()
+        self.update()
+    
+    #Lines are not wrapped, so the panel is as tall as all of its lines
+    def resizeToLines(self):
+        self.setMinimumHeight(int(len(self.lineLayouts) * self.lineHeight) + 2 * SCRIPT_MARGIN)
+    
+    #Lay out and repaint only the given lines, e.g. those returned by
+    #CompiledScript.update
+    def updateLines(self, numbers):
+        for number in numbers:
+            self.lineLayouts[number] = None
+            top = SCRIPT_MARGIN + number * self.lineHeight
+            self.update(0, int(top), self.width(), int(self.lineHeight) + 2)
+    
+    #Font changes (e.g. from the stylesheet) invalidate the cached layouts
+    def changeEvent(self, event):
+        if event.type() in (QEvent.FontChange, QEvent.StyleChange):
+            self.lineHeight = QFontMetricsF(self.font()).height()
+            self.lineLayouts = [None] * len(self.lineLayouts)
+            self.resizeToLines()
+        QWidget.changeEvent(self, event)
+    
+    #Only the lines inside the exposed area are drawn, so scrolling through
+    #a long script or updating one line does not touch the others
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        area = event.rect()
+        painter.fillRect(area, SCRIPT_BACKGROUND_BRUSH)
+        if self.script is None:
+            return
+        painter.setPen(SCRIPT_TEXT_COLOR)
+        first = max(0, int((area.top() - SCRIPT_MARGIN) // self.lineHeight))
+        last = min(len(self.lineLayouts), int((area.bottom() - SCRIPT_MARGIN) // self.lineHeight) + 1)
+        for number in range(first, last):
+            if self.lineLayouts[number] is None:
+                self.lineLayouts[number] = textLayout(self.script.rendered[number], self.font())
+            painter.drawStaticText(QPointF(SCRIPT_MARGIN, SCRIPT_MARGIN + number * self.lineHeight),
+                self.lineLayouts[number].staticText)
@@ -1,3 +1,11 @@
+import difflib
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from callsigns import parseCallsign
+
 PHONETIC_ALPHABET = {
     'A': 'ALPHA',
     'B': 'BRAVO',
@@ -35,31 +43,268 @@ PHONETIC_ALPHABET = {
     '7': 'SEVEN',
     '8': 'EIGHT',
     '9': 'NINER', #'NINE'
+    '/': 'STROKE',
     ' ': ''
 }
 
-#Class for a single station
+#Timestamps are stored as text so they sort chronologically
+def currentTimestamp():
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+#Characters that can appear in a callsign, including the space used to
+#justify it
+CALLSIGN_CHARACTERS = ' 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+#Convert a plain callsign such as 'W3LOR' to the justified form used in the
+#database and the editor (' W3LOR', 'KU0L  ', 'G4ABC/P'). Returns None for
+#anything that is not a valid callsign with an allocated prefix.
+def justifyCallsign(callsign):
+    parsed = parseCallsign(callsign.strip())
+    if not parsed.isValid():
+        return None
+    return parsed.justified()
+
+'''--------------------------------------------
+Misheard callsigns. A callsign heard on a noisy
+frequency is usually a known one with a letter
+or two swapped for one that sounds alike. The
+known callsigns suggested for it are those one
+edit away, plus those two substitutions within
+confusable groups away, each with a cost that is
+lower the more alike the characters sound.
+--------------------------------------------'''
+
+#Letters easily confused when spoken: the E-set (B, D, E, P, T, V...),
+#M and N, and a few other common pairs
+CONFUSABLE_GROUPS = ['BCDEGPTVZ', 'MN', 'FSX', 'AJK', 'IY', 'QU']
+
+#Cost of swapping two characters in the same confusable group. Other
+#swaps cost between .5 and 1 depending on how alike their phonetic words
+#are, and an inserted or dropped character costs 1.
+CONFUSABLE_COST = .3
+INSERT_DELETE_COST = 1.0
+
+#Characters each character can be confused with
+confusables = {}
+for group in CONFUSABLE_GROUPS:
+    for char in group:
+        confusables[char] = confusables.get(char, '') + group.replace(char, '')
+
+#Replaces every letter with the first of its confusable group, so callsigns
+#that differ only by confusable letters have the same sound key
+SOUND_KEYS = str.maketrans({char: group[0] for group in CONFUSABLE_GROUPS for char in group})
+
+#Filled in on first use
+substitutionCosts = {}
+
+def substitutionCost(char, other):
+    cost = substitutionCosts.get((char, other))
+    if cost is None:
+        if other in confusables.get(char, ''):
+            cost = CONFUSABLE_COST
+        else:
+            similarity = difflib.SequenceMatcher(None, PHONETIC_ALPHABET.get(char, char), PHONETIC_ALPHABET.get(other, other)).ratio()
+            cost = .5 + .5 * (1 - similarity)
+        substitutionCosts[(char, other)] = substitutionCosts[(other, char)] = cost
+    return cost
+
+#Keys a callsign without its justifying spaces is filed under in a
+#CallsignSuggestionIndex: itself, every string made by dropping one of its
+#characters, and its sound key. Sound keys are marked with a character no
+#callsign has so they cannot meet the others.
+def suggestionKeys(callsign):
+    keys = {callsign, '~' + callsign.translate(SOUND_KEYS)}
+    for i in range(len(callsign)):
+        keys.add(callsign[:i] + callsign[i + 1:])
+    return keys
+
+#Callsigns made by swapping two letters of a callsign for confusable ones,
+#and how many of them there are
+def confusableSwaps(callsign):
+    for i, char in enumerate(callsign):
+        for other in confusables.get(char, ''):
+            swapped = callsign[:i] + other
+            for j in range(i + 1, len(callsign)):
+                for second in confusables.get(callsign[j], ''):
+                    yield swapped + callsign[i + 1:j] + second + callsign[j + 1:]
+
+def confusableSwapCount(callsign):
+    counts = [len(confusables.get(char, '')) for char in callsign]
+    return (sum(counts) ** 2 - sum(count * count for count in counts)) // 2
+
+#Index of known callsigns for finding the ones a callsign may have been
+#misheard for (a symmetric deletion index). A known callsign one edit from
+#the one typed shares a key with it: the one made by dropping the character
+#substituted, or the shorter of the two. One two confusable swaps away has
+#the same sound key. So a search is a few dictionary probes however many
+#callsigns are known, and how a candidate was found gives its cost without
+#working out an edit distance. Callsigns are kept without their justifying
+#spaces.
+#
+#Known callsigns are those of the stations table, kept per station id so a
+#rename or delete read from the change log drops the old callsign, and those
+#of earlier check-ins, which stay known.
+class CallsignSuggestionIndex:
+    
+    def __init__(self):
+        #key -> the callsign filed under it, or a list of them if several are
+        self.keys = {}
+        #Callsign -> number of stations and check-ins holding it
+        self.counts = {}
+        self.stationCallsigns = {}
+    
+    #Build an index of the callsigns in a database. It reads through its
+    #own connection, so it can be built on another thread. The substitution
+    #costs are worked out here too rather than by the first searches.
+    @staticmethod
+    def fromDatabase(path):
+        for char in PHONETIC_ALPHABET:
+            for other in PHONETIC_ALPHABET:
+                if other != char:
+                    substitutionCost(char, other)
+        index = CallsignSuggestionIndex()
+        con = sqlite3.connect(path)
+        try:
+            for stationId, callsign in con.execute('SELECT rowid, callsign FROM stations;'):
+                index.setStation(stationId, callsign)
+            for row in con.execute('SELECT DISTINCT callsign FROM checkins;'):
+                index.add(row[0])
+        finally:
+            con.close()
+        return index
+    
+    #Record the callsign a station now has, or None if it was deleted.
+    #Recording the same callsign again changes nothing.
+    def setStation(self, stationId, callsign):
+        old = self.stationCallsigns.get(stationId)
+        if old == callsign:
+            return
+        if old is not None:
+            self.remove(old)
+        if callsign is None:
+            del self.stationCallsigns[stationId]
+        else:
+            self.stationCallsigns[stationId] = callsign
+            self.add(callsign)
+    
+    def add(self, callsign):
+        callsign = callsign.strip()
+        if callsign == '':
+            return
+        count = self.counts.get(callsign, 0)
+        self.counts[callsign] = count + 1
+        if count > 0:
+            return
+        for key in suggestionKeys(callsign):
+            filed = self.keys.get(key)
+            if filed is None:
+                self.keys[key] = callsign
+            elif isinstance(filed, list):
+                filed.append(callsign)
+            else:
+                self.keys[key] = [filed, callsign]
+    
+    def remove(self, callsign):
+        callsign = callsign.strip()
+        if callsign == '':
+            return
+        count = self.counts.pop(callsign)
+        if count > 1:
+            self.counts[callsign] = count - 1
+            return
+        for key in suggestionKeys(callsign):
+            filed = self.keys[key]
+            if isinstance(filed, list):
+                filed.remove(callsign)
+                if len(filed) == 1:
+                    self.keys[key] = filed[0]
+            else:
+                del self.keys[key]
+    
+    #Callsigns filed under a key
+    def filedUnder(self, key):
+        filed = self.keys.get(key)
+        if filed is None:
+            return ()
+        if isinstance(filed, list):
+            return filed
+        return (filed,)
+    
+    #Known callsigns the one given may have been misheard for, best first
+    def search(self, callsign, limit):
+        typed = callsign.strip()
+        costs = {}
+        #A character inserted
+        for known in self.filedUnder(typed):
+            if len(known) > len(typed):
+                costs[known] = INSERT_DELETE_COST
+        #The character at i substituted or dropped. Callsigns of the same
+        #length filed under this key for another position differ in two.
+        for i in range(len(typed)):
+            key = typed[:i] + typed[i + 1:]
+            for known in self.filedUnder(key):
+                if len(known) < len(typed):
+                    costs[known] = INSERT_DELETE_COST
+                elif len(known) == len(typed) and known != typed and known[:i] + known[i + 1:] == key:
+                    costs[known] = substitutionCost(typed[i], known[i])
+        #Two confusable swaps all cost the same, so only as many are looked
+        #for as are needed to fill the limit after the cheaper single edits.
+        #Callsigns with the same sound key differ only in confusable letters,
+        #but in a dense range of callsigns there can be thousands of them, so
+        #when there are fewer swaps of the callsign typed those are looked
+        #up instead. Either way the work is bounded by the number of swaps.
+        needed = limit - sum(1 for cost in costs.values() if cost < 2 * CONFUSABLE_COST)
+        if needed > 0:
+            sameSound = self.filedUnder('~' + typed.translate(SOUND_KEYS))
+            if len(sameSound) <= confusableSwapCount(typed):
+                swaps = (known for known in sameSound if sum(map(str.__ne__, known, typed)) == 2)
+            else:
+                swaps = (swapped for swapped in confusableSwaps(typed) if swapped in self.counts)
+            for known in swaps:
+                costs[known] = 2 * CONFUSABLE_COST
+                needed = needed - 1
+                if needed == 0:
+                    break
+        return sorted(costs, key=lambda known: (costs[known], known))[:limit]
+
+#Class for a single station. Lists can hold hundreds of thousands of
+#these, so they have fixed slots instead of a per-instance dict, and
+#ackText is worked out from ack rather than stored. sortKey belongs to the
+#StationList holding the station, see there.
 class Station:
     
-    #Constructor
+    __slots__ = ('callsign', 'name', 'ack', 'note', 'id', 'sortKey')
+    
+    #Table the edit journal records this class's fields for
+    JOURNAL_TABLE = 'stations'
+    
+    #Constructor. Callsigns from the database are already upper case, so
+    #they are only copied when they need converting.
     def __init__(self, callsign='', name='', ack=False, note='', id = None):
-        self.callsign = callsign.upper()
+        if not callsign.isupper():
+            callsign = callsign.upper()
+        self.callsign = callsign
         self.name = name
         self.ack = ack
         self.note = note
         self.id = id
-        if ack:
-            self.ackText = 'Yes'
-        else:
-            self.ackText = ''
+        self.sortKey = None
+    
+    #Text shown in the acknowledged column
+    @property
+    def ackText(self):
+        if self.ack:
+            return 'Yes'
+        return ''
     
-    #Test a station for a callsign match
+    #Test a station for a callsign match. '?' in the pattern matches any
+    #character; '/' is a real one, as in G4ABC/P. To search a whole list use
+    #StationList.search instead.
     def match(self, pattern):
-        match = True
-        for i in range(len(self.callsign)):
-            if pattern[i] != '/' and pattern[i] != self.callsign[i]:
-                match = False
-        return match
+        for i in range(min(len(self.callsign), len(pattern))):
+            if pattern[i] != '?' and pattern[i] != self.callsign[i]:
+                return False
+        return True
     
     #Load from database, given an ID
     def loadFromDatabase(self, p):
@@ -73,26 +318,32 @@ class Station:
         else:
             raise RuntimeError
     
-    #Save to database, either update or insert
-    def saveToDatabase(self, p):
+    #Write to database without committing, either update or insert
+    def writeToDatabase(self, p):
         if self.id is not None:
             p.cur.execute('UPDATE stations SET callsign = ?, name = ?, ack = ?, note = ? WHERE rowid = ?;', 
                 (self.callsign, self.name, self.ack, self.note, self.id))
-            p.con.commit()
         else:
             p.cur.execute('INSERT INTO stations (callsign, name, ack, note) VALUES (?, ?, ?, ?);',
                 (self.callsign, self.name, self.ack, self.note))
-            p.con.commit()
             self.id = p.cur.lastrowid
     
+    #Save to database immediately, either update or insert
+    def saveToDatabase(self, p):
+        self.writeToDatabase(p)
+        p.con.commit()
+    
+    #Fields recorded by the edit journal, by column
+    def journalFields(self):
+        return {'callsign': self.callsign, 'name': self.name, 'ack': bool(self.ack), 'note': self.note}
+    
+    #Set the station's acknowledge status
+    def setAck(self, ack):
+        self.ack = ack
+    
     #Change the station's acknowledge status
     def toggleAck(self):
-        if self.ack:
-            self.ack = False
-            self.ackText = ''
-        else:   
-            self.ack = True
-            self.ackText = 'Yes'
+        self.ack = not self.ack
     
     #Get an array of phonetic words from the callsign
     def getPhoneticArray(self):
@@ -109,6 +360,26 @@ class Script:
         self.name = name
         self.contents = contents
         self.id = id
+        self.compiledScript = None
+    
+    #Load the script with a given name, or the first one by name if no name
+    #is given. Returns None if there is no such script.
+    @staticmethod
+    def loadByName(p, name=None):
+        if name is None:
+            row = p.cur.execute('SELECT rowid, name, contents FROM scripts ORDER BY name LIMIT 1;').fetchone()
+        else:
+            row = p.cur.execute('SELECT rowid, name, contents FROM scripts WHERE name = ?;', (name,)).fetchone()
+        if row is None:
+            return None
+        return Script(row[1], row[2], row[0])
+    
+    #The contents compiled for rendering. Compiled on first use and again
+    #only if the contents have been changed since.
+    def compiled(self):
+        if self.compiledScript is None or self.compiledScript.contents != self.contents:
+            self.compiledScript = CompiledScript(self.contents)
+        return self.compiledScript
     
     #Load from database, given an ID
     def loadFromDatabase(self, p):
@@ -120,39 +391,790 @@ class Script:
         else:
             raise RuntimeError
     
-    #Save to database, either update or insert
-    def saveToDatabase(self, p):
+    #Write to database without committing, either update or insert
+    def writeToDatabase(self, p):
         if self.id is not None:
             p.cur.execute('UPDATE scripts SET name = ?, contents = ? WHERE rowid = ?;', (self.name, self.contents, self.id))
-            p.con.commit()
         else:
             p.cur.execute('INSERT INTO scripts (name, contents) VALUES (?, ?);', (self.name, self.contents))
-            p.con.commit()
             self.id = p.cur.lastrowid
+    
+    #Save to database immediately, either update or insert
+    def saveToDatabase(self, p):
+        self.writeToDatabase(p)
+        p.con.commit()
 
-#A class to handle the list of stations
+#Words of a full text search, as the FTS5 tokenizer splits them
+SEARCH_WORD = re.compile(r'\w+')
+
+#Whether each searched word starts a word of one of the fields
+def matchesWords(words, *fields):
+    fieldWords = SEARCH_WORD.findall(' '.join(field or '' for field in fields).lower())
+    return all(any(fieldWord.startswith(word) for fieldWord in fieldWords) for word in words)
+
+#Placeholders a net script can use, e.g. 'We have {checkins} check-ins'.
+#Anything else in braces is left as it is, and doubled braces stand for
+#single ones.
+SCRIPT_PLACEHOLDERS = ('checkins', 'firsttime', 'unacked', 'callsign', 'phonetics', 'net')
+SCRIPT_TOKEN = re.compile(r'\{\{|\}\}|\{(' + '|'.join(SCRIPT_PLACEHOLDERS) + r')\}')
+
+#A net script parsed into lines of literal text and placeholders. Each line
+#is a fragment that is rendered again only when a placeholder in it gets a
+#new value, so updating the check-in count of a long script re-renders the
+#one line that shows it. Lines without placeholders are rendered once.
+class CompiledScript:
+    
+    def __init__(self, contents):
+        self.contents = contents
+        #Each line is a list of (literal text, placeholder or None) parts
+        self.lines = []
+        #Line numbers by the placeholder they use
+        self.linesUsing = {}
+        self.values = {}
+        self.rendered = []
+        for number, line in enumerate(contents.split('\n')):
+            parts = []
+            literal = ''
+            position = 0
+            for match in SCRIPT_TOKEN.finditer(line):
+                literal = literal + line[position:match.start()]
+                position = match.end()
+                if match.group(1) is None:
+                    literal = literal + match.group(0)[0]
+                else:
+                    parts.append((literal, match.group(1)))
+                    self.linesUsing.setdefault(match.group(1), []).append(number)
+                    literal = ''
+            parts.append((literal + line[position:], None))
+            self.lines.append(parts)
+            self.rendered.append(self.renderLine(parts))
+        for name in self.linesUsing:
+            self.linesUsing[name] = sorted(set(self.linesUsing[name]))
+    
+    #Placeholders used anywhere in the script
+    def placeholders(self):
+        return self.linesUsing.keys()
+    
+    def renderLine(self, parts):
+        return ''.join(literal + ('' if name is None else str(self.values.get(name, '')))
+            for literal, name in parts)
+    
+    #Take new values for some placeholders and re-render the lines showing
+    #any that changed. Returns the numbers of the lines re-rendered.
+    def update(self, values):
+        changedLines = set()
+        for name, value in values.items():
+            if name in self.linesUsing and self.values.get(name) != value:
+                self.values[name] = value
+                changedLines.update(self.linesUsing[name])
+        for number in changedLines:
+            self.rendered[number] = self.renderLine(self.lines[number])
+        return sorted(changedLines)
+
+#Index of callsigns by character position, used to answer wildcard pattern
+#searches without testing every station. Each station gets a slot number and
+#for every position and character there is a bitset (a Python int) of the
+#slots whose callsign has that character there. A search ANDs one bitset per
+#fixed character of the pattern, so it costs a handful of big-int operations
+#however many stations are indexed. Slots freed by removed stations are given
+#to the next ones added, so the bitsets do not grow with churn.
+class CallsignPatternIndex:
+    
+    #Finds the non-zero bytes of a bitset when decoding search results
+    NONZERO_BYTE = re.compile(b'[^\\x00]')
+    
+    def __init__(self):
+        self.slots = []
+        self.slotOf = {}
+        #Slots of removed stations, reused before new ones are made
+        self.freeSlots = []
+        self.allBits = 0
+        #position -> {character: bitset}
+        self.positionBits = []
+        #position -> bitset of slots whose callsign ends before that position
+        self.shortBits = []
+    
+    def add(self, station):
+        if self.freeSlots:
+            slot = self.freeSlots.pop()
+            self.slots[slot] = station
+        else:
+            slot = len(self.slots)
+            self.slots.append(station)
+        self.slotOf[station] = slot
+        self.setBits(slot, station.callsign)
+    
+    #Add many stations at once. Setting bits one station at a time costs a
+    #full copy of each bitset, so for bulk loads the bits are collected in
+    #byte arrays first and converted to ints once per position/character.
+    #Free slots are filled one at a time first.
+    def addMany(self, stations):
+        reused = min(len(self.freeSlots), len(stations))
+        for station in stations[:reused]:
+            self.add(station)
+        stations = stations[reused:]
+        first = len(self.slots)
+        size = (first + len(stations) + 7) // 8
+        positionArrays = []
+        for station in stations:
+            slot = len(self.slots)
+            self.slots.append(station)
+            self.slotOf[station] = slot
+            byteIndex = slot >> 3
+            bit = 1 << (slot & 7)
+            callsign = station.callsign
+            while len(positionArrays) < len(callsign):
+                positionArrays.append({})
+            for i in range(len(callsign)):
+                arrays = positionArrays[i]
+                array = arrays.get(callsign[i])
+                if array is None:
+                    array = arrays[callsign[i]] = bytearray(size)
+                array[byteIndex] = array[byteIndex] | bit
+        
+        newBits = ((1 << len(stations)) - 1) << first
+        while len(self.positionBits) < len(positionArrays):
+            self.positionBits.append({})
+            self.shortBits.append(self.allBits)
+        for i in range(len(self.positionBits)):
+            reached = 0
+            if i < len(positionArrays):
+                for char, array in positionArrays[i].items():
+                    bits = int.from_bytes(array, 'little')
+                    self.positionBits[i][char] = self.positionBits[i].get(char, 0) | bits
+                    reached = reached | bits
+            #New stations without a character at this position are short
+            self.shortBits[i] = self.shortBits[i] | (newBits & ~reached)
+        self.allBits = self.allBits | newBits
+    
+    def remove(self, station):
+        slot = self.slotOf.pop(station)
+        self.clearBits(slot, station.callsign)
+        self.slots[slot] = None
+        self.freeSlots.append(slot)
+    
+    #Re-index a station after its callsign changed
+    def update(self, station, oldCallsign):
+        slot = self.slotOf[station]
+        self.clearBits(slot, oldCallsign)
+        self.setBits(slot, station.callsign)
+    
+    def setBits(self, slot, callsign):
+        bit = 1 << slot
+        #Positions nobody had reached before start out with every existing
+        #station counted as too short for them
+        while len(self.positionBits) < len(callsign):
+            self.positionBits.append({})
+            self.shortBits.append(self.allBits)
+        for i in range(len(callsign)):
+            charBits = self.positionBits[i]
+            charBits[callsign[i]] = charBits.get(callsign[i], 0) | bit
+        for i in range(len(callsign), len(self.shortBits)):
+            self.shortBits[i] = self.shortBits[i] | bit
+        self.allBits = self.allBits | bit
+    
+    def clearBits(self, slot, callsign):
+        mask = ~(1 << slot)
+        for i in range(len(callsign)):
+            self.positionBits[i][callsign[i]] = self.positionBits[i][callsign[i]] & mask
+        for i in range(len(callsign), len(self.shortBits)):
+            self.shortBits[i] = self.shortBits[i] & mask
+        self.allBits = self.allBits & mask
+    
+    #Get the stations matching a pattern with '?' wildcards, using the same
+    #rules as Station.match. At most limit stations are returned if given.
+    def search(self, pattern, limit=None):
+        bits = self.allBits
+        for i in range(min(len(pattern), len(self.positionBits))):
+            if pattern[i] != '?':
+                bits = bits & (self.positionBits[i].get(pattern[i], 0) | self.shortBits[i])
+                if not bits:
+                    return []
+        
+        #Decode the set bits, letting the regex skip runs of empty bytes
+        result = []
+        data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        for found in self.NONZERO_BYTE.finditer(data):
+            byteIndex = found.start()
+            byte = data[byteIndex]
+            for bitIndex in range(8):
+                if byte & (1 << bitIndex):
+                    result.append(self.slots[byteIndex * 8 + bitIndex])
+                    if limit is not None and len(result) >= limit:
+                        return result
+        return result
+
+#Class for a single net, i.e. one session of check-ins
+class Net:
+    
+    #Constructor
+    def __init__(self, name='', started=None, id = None):
+        self.name = name
+        if started is None:
+            started = currentTimestamp()
+        self.started = started
+        self.id = id
+    
+    #Write to database without committing, either update or insert
+    def writeToDatabase(self, p):
+        if self.id is not None:
+            p.cur.execute('UPDATE nets SET name = ?, started = ? WHERE id = ?;', (self.name, self.started, self.id))
+        else:
+            p.cur.execute('INSERT INTO nets (name, started) VALUES (?, ?);', (self.name, self.started))
+            self.id = p.cur.lastrowid
+    
+    #Save to database immediately, either update or insert
+    def saveToDatabase(self, p):
+        self.writeToDatabase(p)
+        p.con.commit()
+
+#Class for one station's check-in to a net. The station's callsign and name
+#are read when it is written, so edits made after checking in are kept. A
+#check-in that is no longer active is deleted when written. The net must
+#already be saved, or be written earlier in the same flush.
+class CheckIn:
+    
+    #Constructor
+    def __init__(self, net, station, checkedIn=None, id = None):
+        self.net = net
+        self.station = station
+        if checkedIn is None:
+            checkedIn = currentTimestamp()
+        self.checkedIn = checkedIn
+        self.active = True
+        self.id = id
+    
+    #Write to database without committing: insert, update or delete
+    def writeToDatabase(self, p):
+        if not self.active:
+            if self.id is not None:
+                p.cur.execute('DELETE FROM checkins WHERE id = ?;', (self.id,))
+                self.id = None
+        elif self.id is not None:
+            p.cur.execute('UPDATE checkins SET callsign = ?, name = ? WHERE id = ?;',
+                (self.station.callsign, self.station.name, self.id))
+        else:
+            p.cur.execute('INSERT INTO checkins (netId, callsign, name, checkedIn) VALUES (?, ?, ?, ?);',
+                (self.net.id, self.station.callsign, self.station.name, self.checkedIn))
+            self.id = p.cur.lastrowid
+    
+    #Save to database immediately
+    def saveToDatabase(self, p):
+        self.writeToDatabase(p)
+        p.con.commit()
+
+#A class to handle the list of stations. Besides the ordered list, a hash
+#index from callsign to station is kept so lookups and selection by callsign
+#do not have to scan the list. Stations should be added, removed and have
+#their callsign changed through the methods below so the index stays correct.
+#
+#Rows are kept in order of each station's sortKey, the callsign it had when
+#it was placed in the list. Editing a callsign does not move its row, so a
+#station stays put while its callsign is typed, and the row of a station is
+#found by a binary search on sortKey. The index only changes for the
+#stations inserted, removed or edited, never for the rows around them.
+#
+#The list is loaded lazily in pages ordered by callsign. Each page continues
+#from the last callsign loaded (keyset pagination), so fetching a page costs
+#the same however deep into the table it is, and only the pages actually
+#shown are ever turned into Station objects.
+#
+#Changes made by other connections are picked up by refreshFromDatabase,
+#which reads only the rows logged in stationChanges since the last refresh.
+#The same rows keep the index of known callsigns used for suggestions up to
+#date.
 class StationList:
     
     currentStation = Station()
     currentStationIndex = 0
     
-    def __init__(self, p):
+    def __init__(self, p, pageSize=100):
         self.list = []
+        self.callsignIndex = {}
+        #Callsign -> the other loaded stations holding it, see setCallsign
+        self.sharedCallsigns = {}
+        self.idIndex = {}
+        self.patternIndex = CallsignPatternIndex()
+        #Built on first use, see suggestionIndex
+        self.suggestions = None
+        self.suggestionBuild = None
+        self.suggestionChanges = []
+        self.pageSize = pageSize
+        self.lastCallsign = None
+        #Optional NetStatistics told about every change made through the list
+        self.stats = None
+        self.hasMore = True
+        self.unackedCount = 0
+        self.dataVersion = p.dataVersion()
+        self.changeWatermark = p.latestChange()
         self.updateListFromDatabase(p)
         self.currentStationIndex = 0
-        self.currentStation = self.list[self.currentStationIndex]
+        if len(self.list) > 0:
+            self.currentStation = self.list[self.currentStationIndex]
+        else:
+            self.currentStation = Station()
     
+    #Read the next page of stations from the database without adding them
+    #to the list. Rows already in the list, e.g. because their callsign was
+    #edited past the current page or the edit is still in the journal, are
+    #skipped.
+    def fetchPage(self, p):
+        if not self.hasMore:
+            return []
+        if self.lastCallsign is None:
+            rows = p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations ORDER BY callsign LIMIT ?;',
+                (self.pageSize,)).fetchall()
+        else:
+            rows = p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations WHERE callsign > ? ORDER BY callsign LIMIT ?;',
+                (self.lastCallsign, self.pageSize)).fetchall()
+        if len(rows) < self.pageSize:
+            self.hasMore = False
+        if len(rows) > 0:
+            self.lastCallsign = rows[-1][1]
+        return [Station(row[1], row[2], row[3], row[4], row[0]) for row in rows
+            if row[1] not in self.callsignIndex and row[0] not in self.idIndex]
+    
+    #Split a page read by fetchPage into runs of stations that go into the
+    #list together, as (row, stations) in the order they are to be added.
+    #A page usually goes on the end in one run. Stations placed past the
+    #loaded pages, e.g. by selectFound, are already at the end, and the new
+    #stations are merged in around them.
+    def pageRuns(self, stations):
+        runs = []
+        added = 0
+        start = 0
+        while start < len(stations):
+            row = self.sortedRow(stations[start].callsign)
+            end = len(stations)
+            if row < len(self.list):
+                end = start + 1
+                while end < len(stations) and stations[end].callsign <= self.list[row].sortKey:
+                    end = end + 1
+            runs.append((row + added, stations[start:end]))
+            added = added + end - start
+            start = end
+        return runs
+    
+    #Add a run of sorted stations at a row given by pageRuns
+    def insertStations(self, row, stations):
+        if row <= self.currentStationIndex and len(self.list) > 0:
+            self.currentStationIndex = self.currentStationIndex + len(stations)
+        self.list[row:row] = stations
+        self.patternIndex.addMany(stations)
+        for station in stations:
+            station.sortKey = station.callsign
+            self.indexStation(station)
+            self.idIndex[station.id] = station
+            if not station.ack:
+                self.unackedCount = self.unackedCount + 1
+    
+    #Add stations read by fetchPage to the list
+    def appendStations(self, stations):
+        for row, run in self.pageRuns(stations):
+            self.insertStations(row, run)
+    
+    #Load the next page of stations into the list
     def updateListFromDatabase(self, p):
-        for row in p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations ORDER BY callsign;'):
-            self.list.append(Station(row[1], row[2], row[3], row[4], row[0]))
+        self.appendStations(self.fetchPage(p))
+    
+    #Drop everything loaded and start again from the first page, keeping
+    #the same station selected if it is still there
+    def reload(self, p):
+        callsign = self.currentStation.callsign
+        for station in self.list:
+            station.sortKey = None
+        self.list = []
+        self.callsignIndex = {}
+        self.sharedCallsigns = {}
+        self.idIndex = {}
+        self.patternIndex = CallsignPatternIndex()
+        #What changed is not known, so the suggestion index is built again
+        self.suggestions = None
+        self.suggestionBuild = None
+        self.suggestionChanges = []
+        self.lastCallsign = None
+        self.hasMore = True
+        self.unackedCount = 0
+        self.dataVersion = p.dataVersion()
+        self.changeWatermark = p.latestChange()
+        self.updateListFromDatabase(p)
+        self.currentStationIndex = 0
+        if len(self.list) > 0:
+            self.currentStation = self.list[0]
+            self.selectCallsign(callsign)
+        else:
+            self.currentStation = Station()
+    
+    #Patch in stations changed by other connections since the last refresh.
+    #Stations with unflushed local edits are left alone. Returns the rows
+    #that changed and whether rows were added or removed, or None if a full
+    #reload was needed. With nothing changed this costs one pragma read.
+    def refreshFromDatabase(self, p):
+        version = p.dataVersion()
+        if version == self.dataVersion:
+            return [], False
+        self.dataVersion = version
+        
+        changes = p.cur.execute('SELECT MIN(seq), MAX(seq) FROM stationChanges;').fetchone()
+        if changes[1] is None or changes[1] <= self.changeWatermark:
+            return [], False
+        #Some of the log was pruned before this list saw it
+        if changes[0] > self.changeWatermark + 1:
+            self.reload(p)
+            return None
+        
+        changedIds = [row[0] for row in p.cur.execute(
+            'SELECT DISTINCT stationId FROM stationChanges WHERE seq > ? AND seq <= ?;',
+            (self.changeWatermark, changes[1]))]
+        self.changeWatermark = changes[1]
+        
+        rows = {}
+        for start in range(0, len(changedIds), 500):
+            chunk = changedIds[start:start + 500]
+            for row in p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations WHERE rowid IN (' +
+                    ','.join('?' * len(chunk)) + ');', chunk):
+                rows[row[0]] = row
+        
+        changedStations = []
+        restructured = False
+        for stationId in changedIds:
+            row = rows.get(stationId)
+            self.suggestionChanged(stationId, None if row is None else row[1])
+            station = self.idIndex.get(stationId)
+            if station is None and row is not None:
+                #Stations inserted locally only learn their id when flushed
+                station = self.find(row[1])
+                if station is not None:
+                    self.idIndex[stationId] = station
+            if station is not None and p.isDirty(station):
+                continue
+            
+            if row is None:
+                #Deleted
+                if station is not None:
+                    del self.idIndex[stationId]
+                    self.removeStation(self.rowOfStation(station))
+                    if self.stats is not None:
+                        self.stats.stationRemoved(station)
+                    restructured = True
+            elif station is not None:
+                #Updated
+                if station.callsign != row[1]:
+                    self.setCallsign(station, row[1])
+                station.name = row[2]
+                self.setAck(station, row[3])
+                self.setNote(station, row[4])
+                changedStations.append(station)
+            elif not self.hasMore or row[1] <= self.lastCallsign:
+                #Inserted within the loaded range. Rows past it will be
+                #read by the page that reaches them.
+                station = Station(row[1], row[2], row[3], row[4], row[0])
+                self.insertStation(station)
+                self.idIndex[stationId] = station
+                if self.stats is not None:
+                    self.stats.stationAdded(station)
+                restructured = True
+        
+        changedRows = [self.rowOfStation(station) for station in changedStations]
+        return [row for row in changedRows if row is not None], restructured
+    
+    #Row a station with this sortKey would be inserted at to keep the list
+    #in order
+    def sortedRow(self, key):
+        low = 0
+        high = len(self.list)
+        while low < high:
+            middle = (low + high) // 2
+            if self.list[middle].sortKey < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    #True if a station is in this list
+    def isLoaded(self, station):
+        return station.sortKey is not None
+    
+    #Get the row of a station, or None if it is not in the list. Stations
+    #placed with the same callsign sit next to each other.
+    def rowOfStation(self, station):
+        if station.sortKey is None:
+            return None
+        row = self.sortedRow(station.sortKey)
+        while row < len(self.list) and self.list[row].sortKey == station.sortKey:
+            if self.list[row] is station:
+                return row
+            row = row + 1
+        return None
+    
+    #Get the row of a callsign, or None if it is not in the list
+    def rowOf(self, callsign):
+        station = self.callsignIndex.get(callsign)
+        if station is None:
+            return None
+        return self.rowOfStation(station)
+    
+    #Get the station with a callsign, or None if it is not in the list
+    def find(self, callsign):
+        return self.callsignIndex.get(callsign)
     
+    #Change a station's callsign and keep the index pointing at it. Its row
+    #does not move. A station not in the list yet, e.g. the blank one
+    #selected while the list is empty, is added to it.
+    def setCallsign(self, station, callsign):
+        callsign = callsign.upper()
+        if not self.isLoaded(station):
+            station.callsign = callsign
+            self.insertStation(station)
+            if self.stats is not None:
+                self.stats.stationAdded(station)
+            return
+        oldCallsign = station.callsign
+        self.unindexStation(station, oldCallsign)
+        station.callsign = callsign
+        self.indexStation(station)
+        self.patternIndex.update(station, oldCallsign)
+    
+    #Two stations can share a callsign for a while, e.g. while one is typed
+    #over the other's. The index then stays on the station it had, and the
+    #others are remembered in sharedCallsigns so the index moves to one of
+    #them once the station it points at changes callsign or is removed.
+    def indexStation(self, station):
+        owner = self.callsignIndex.get(station.callsign)
+        if owner is None:
+            self.callsignIndex[station.callsign] = station
+        elif owner is not station:
+            self.sharedCallsigns.setdefault(station.callsign, []).append(station)
+    
+    #Take a station out of the index under the callsign it had
+    def unindexStation(self, station, callsign):
+        others = self.sharedCallsigns.get(callsign)
+        if self.callsignIndex.get(callsign) is station:
+            if others:
+                self.callsignIndex[callsign] = others.pop(0)
+            else:
+                del self.callsignIndex[callsign]
+        elif others is not None:
+            others[:] = [other for other in others if other is not station]
+        if others is not None and len(others) == 0:
+            del self.sharedCallsigns[callsign]
+    
+    #Set the ack flag of a station, keeping count of the loaded stations
+    #that are not acknowledged
+    def setAck(self, station, ack):
+        ack = bool(ack)
+        if ack != bool(station.ack):
+            if self.isLoaded(station):
+                if ack:
+                    self.unackedCount = self.unackedCount - 1
+                else:
+                    self.unackedCount = self.unackedCount + 1
+            if self.stats is not None:
+                self.stats.ackChanged(station, ack)
+        station.setAck(ack)
+    
+    #Set the note of a station, keeping the statistics up to date
+    def setNote(self, station, note):
+        if self.stats is not None:
+            self.stats.noteChanged(station, note)
+        station.note = note
+    
+    #Insert a station at the row its callsign sorts to, and return the row
+    def insertStation(self, station):
+        station.sortKey = station.callsign
+        row = self.sortedRow(station.sortKey)
+        self.list.insert(row, station)
+        self.indexStation(station)
+        self.patternIndex.add(station)
+        if not station.ack:
+            self.unackedCount = self.unackedCount + 1
+        if len(self.list) == 1:
+            self.currentStationIndex = 0
+            self.currentStation = station
+        elif row <= self.currentStationIndex:
+            self.currentStationIndex = self.currentStationIndex + 1
+        return row
+    
+    #Remove the station at a row. The selection stays on the same station
+    #unless that is the one removed, in which case the next one is selected.
+    def removeStation(self, row):
+        station = self.list.pop(row)
+        station.sortKey = None
+        self.unindexStation(station, station.callsign)
+        self.patternIndex.remove(station)
+        if not station.ack:
+            self.unackedCount = self.unackedCount - 1
+        if row < self.currentStationIndex:
+            self.currentStationIndex = self.currentStationIndex - 1
+        if self.currentStationIndex >= len(self.list):
+            self.currentStationIndex = 0
+        if len(self.list) > 0:
+            self.currentStation = self.list[self.currentStationIndex]
+        else:
+            self.currentStation = Station()
+        return station
+    
+    #Get the stations matching a partial callsign, with '?' for each
+    #unknown character, sorted by callsign. Loaded stations come from the
+    #pattern index; if a connection is given, stations past the last loaded
+    #page are looked up in the database as well.
+    def search(self, pattern, limit=None, p=None):
+        pattern = pattern.upper()
+        found = self.patternIndex.search(pattern, limit)
+        if p is not None and self.hasMore and (limit is None or len(found) < limit):
+            globPattern = ''.join('[' + char + ']' if char in '*[' else char
+                for char in pattern) + '*'
+            #GLOB can only use the callsign index up to its first wildcard,
+            #so an unknown first character is expanded into one indexed
+            #probe per possible character instead of a full scan
+            if globPattern.startswith('?'):
+                globPatterns = [char + globPattern[1:] for char in CALLSIGN_CHARACTERS]
+            else:
+                globPatterns = [globPattern]
+            query = 'SELECT rowid, callsign, name, ack, note FROM stations WHERE callsign > ? AND callsign GLOB ? ORDER BY callsign LIMIT ?;'
+            for globPattern in globPatterns:
+                if limit is None:
+                    remaining = -1
+                elif len(found) >= limit:
+                    break
+                else:
+                    remaining = limit - len(found)
+                for row in p.cur.execute(query, (self.lastCallsign, globPattern, remaining)):
+                    if row[1] not in self.callsignIndex:
+                        found.append(Station(row[1], row[2], row[3], row[4], row[0]))
+        found.sort(key=lambda station: station.callsign)
+        return found
+    
+    #Stations with a word in their callsign, name or note starting with each
+    #word of the text, e.g. 'flood main'. The full text index answers for the
+    #database; loaded stations with edits not written yet are matched in
+    #memory instead, since the index only knows what has been written.
+    #Without FTS5 the table is scanned with LIKE and each row checked the
+    #same way. Results are sorted by callsign; stations not loaded are new
+    #objects.
+    def textSearch(self, p, text, limit=200):
+        words = SEARCH_WORD.findall(text.lower())
+        if not words:
+            return []
+        pending = p.pendingObjects()
+        found = []
+        for row in self.textSearchRows(p, words, limit):
+            station = self.idIndex.get(row[0])
+            if station is None:
+                station = self.find(row[1])
+            if station is None:
+                found.append(Station(row[1], row[2], row[3], row[4], row[0]))
+            elif station not in pending:
+                found.append(station)
+        for station in pending:
+            if isinstance(station, Station) and len(found) < limit and self.isLoaded(station):
+                if matchesWords(words, station.callsign, station.name, station.note):
+                    found.append(station)
+        found.sort(key=lambda station: station.callsign)
+        return found
+    
+    #Rows of (rowid, callsign, name, ack, note) written to the database
+    #that match the words of a text search
+    def textSearchRows(self, p, words, limit):
+        if p.fullTextSearch:
+            query = ' '.join('"' + word + '"*' for word in words)
+            return p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations WHERE rowid IN '
+                '(SELECT rowid FROM stationSearch WHERE stationSearch MATCH ? LIMIT ?);', (query, limit)).fetchall()
+        #LIKE also matches inside words, so it only narrows the rows down
+        condition = ' AND '.join(["(coalesce(callsign, '') || ' ' || coalesce(name, '') || ' ' || "
+            "coalesce(note, '')) LIKE ? ESCAPE '\\'"] * len(words))
+        #Words hold letters, digits and '_', the only one LIKE treats specially
+        patterns = ['%' + word.replace('_', '\\_') + '%' for word in words]
+        rows = []
+        for row in p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations WHERE ' + condition + ';',
+                patterns):
+            if matchesWords(words, row[1], row[2], row[4]):
+                rows.append(row)
+                if len(rows) >= limit:
+                    break
+        return rows
+    
+    #Select a station found by a search. One that is not loaded yet is added
+    #to the list past the loaded pages; the page that reaches it later skips
+    #it.
+    def selectFound(self, station):
+        row = self.rowOfStation(station)
+        if row is None:
+            row = self.insertStation(station)
+            self.idIndex[station.id] = station
+        self.selectStation(row)
+    
+    #Check-in history. These are answered from the checkins_callsign index,
+    #so they cost an index probe however many nets have been logged. A net
+    #id can be given to leave out check-ins to that net, e.g. the current one.
+    
+    #Has a callsign checked in before?
+    def hasCheckedInBefore(self, p, callsign, excludeNetId=None):
+        return p.cur.execute('SELECT 1 FROM checkins WHERE callsign = ? AND netId IS NOT ? LIMIT 1;',
+            (callsign, excludeNetId)).fetchone() is not None
+    
+    #How many times has a callsign checked in?
+    def checkInCount(self, p, callsign, excludeNetId=None):
+        return p.cur.execute('SELECT COUNT(*) FROM checkins WHERE callsign = ? AND netId IS NOT ?;',
+            (callsign, excludeNetId)).fetchone()[0]
+    
+    #Name given at a callsign's latest check-in, or None if it never has
+    def lastCheckInName(self, p, callsign, excludeNetId=None):
+        row = p.cur.execute('SELECT name FROM checkins WHERE callsign = ? AND netId IS NOT ? ORDER BY checkedIn DESC LIMIT 1;',
+            (callsign, excludeNetId)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+    
+    #Known callsigns that the given one may have been misheard for, best
+    #first and without their justifying spaces, from the suggestion index. Nothing is suggested for a callsign
+    #that is not complete, or until the index is built.
+    def suggest(self, p, callsign, limit=5):
+        index = self.suggestionIndex(p)
+        if index is None or justifyCallsign(callsign) is None:
+            return []
+        return index.search(callsign, limit)
+    
+    #The suggestion index, or None while it is being built. The first call
+    #starts building it on a thread of its own, so a large history never
+    #holds up a keystroke; wait blocks until it is built instead. Changes
+    #read from the change log while it is being built are applied once it
+    #is ready. Applying one the build already saw changes nothing.
+    def suggestionIndex(self, p, wait=False):
+        if self.suggestions is None:
+            if self.suggestionBuild is None:
+                builder = ThreadPoolExecutor(max_workers=1)
+                self.suggestionBuild = builder.submit(CallsignSuggestionIndex.fromDatabase, p.path)
+                builder.shutdown(wait=False)
+            if not wait and not self.suggestionBuild.done():
+                return None
+            build = self.suggestionBuild
+            self.suggestionBuild = None
+            self.suggestions = build.result()
+            for stationId, callsign in self.suggestionChanges:
+                self.suggestions.setStation(stationId, callsign)
+            self.suggestionChanges = []
+        return self.suggestions
+    
+    #Record a callsign read from the change log in the suggestion index
+    def suggestionChanged(self, stationId, callsign):
+        if self.suggestions is not None:
+            self.suggestions.setStation(stationId, callsign)
+        elif self.suggestionBuild is not None:
+            self.suggestionChanges.append((stationId, callsign))
+    
+    #Moving the selection in an empty list keeps the blank station selected
     def selectNext(self):
+        if len(self.list) == 0:
+            return
         self.currentStationIndex = self.currentStationIndex + 1
         if self.currentStationIndex >= len(self.list):
             self.currentStationIndex = 0
         self.currentStation = self.list[self.currentStationIndex]
     
     def selectPrevious(self):
+        if len(self.list) == 0:
+            return
         self.currentStationIndex = self.currentStationIndex - 1
         if self.currentStationIndex < 0:
             self.currentStationIndex = len(self.list) - 1
@@ -161,4 +1183,12 @@ class StationList:
     def selectStation(self, index):
         if index >= 0 and index < len(self.list):
             self.currentStationIndex = index
-            self.currentStation = self.list[self.currentStationIndex]
\ No newline at end of file
+            self.currentStation = self.list[self.currentStationIndex]
+    
+    #Select a station by callsign. Returns False if it is not in the list.
+    def selectCallsign(self, callsign):
+        row = self.rowOf(callsign)
+        if row is None:
+            return False
+        self.selectStation(row)
+        return True
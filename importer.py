@@ -0,0 +1,209 @@
+"""
+    Streaming import of external callsign databases into the callbook
+    table, which holds the names used to fill in stations as they check in.
+
+    Supported inputs are the FCC ULS amateur dump (EN.dat from l_amat.zip),
+    CSV rosters with callsign and name columns, and ADIF logs. Files are
+    parsed lazily, one record at a time, and written in chunks, each in a
+    single transaction together with the file offset reached. An
+    interrupted import picks up from the last committed chunk when run
+    again on the same, unchanged file.
+
+        python importer.py fcc EN.dat
+        python importer.py csv roster.csv --database dev.db
+
+    The offline name lookup file is rebuilt after each import.
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+from persist import Persist
+from dataStructures import justifyCallsign
+from nameLookup import buildLookup, DEFAULT_PATH
+
+'''--------------------------------------------
+Parsers. Each takes a binary file positioned at
+the first record to read and yields
+(callsign, name, offset after the record).
+--------------------------------------------'''
+
+#FCC ULS entity records: pipe separated, with the callsign in field 4,
+#the entity name in field 7 and the first name in field 8
+def parseFcc(f, offset):
+    for line in f:
+        offset = offset + len(line)
+        fields = line.decode('latin-1').rstrip('\r\n').split('|')
+        if len(fields) < 9 or fields[0] != 'EN':
+            continue
+        name = fields[8].strip() or fields[7].strip()
+        yield fields[4], name, offset
+
+#CSV with a header row. The callsign column is 'callsign' or 'call' and the
+#name column 'name' or 'first_name', in any case. Records are read a line at
+#a time, so quoted fields cannot span lines.
+def parseCsv(f, offset, header):
+    columns = [column.strip().lower() for column in header]
+    callColumn = findColumn(columns, ('callsign', 'call'))
+    nameColumn = findColumn(columns, ('name', 'first_name', 'firstname'))
+    for line in f:
+        offset = offset + len(line)
+        for fields in csv.reader([line.decode('utf-8', 'replace')]):
+            if len(fields) > max(callColumn, nameColumn):
+                yield fields[callColumn], fields[nameColumn], offset
+
+def findColumn(columns, names):
+    for name in names:
+        if name in columns:
+            return columns.index(name)
+    raise ValueError('No column named any of: ' + ', '.join(names))
+
+#Read the header row of a CSV file, returning it and the offset after it
+def readCsvHeader(f):
+    line = f.readline()
+    return next(csv.reader([line.decode('utf-8-sig', 'replace')])), len(line)
+
+#ADIF fields look like <CALL:5>K4ABC and records end with <EOR>. The file
+#is read in blocks and only the unparsed tail of a block is kept.
+ADIF_FIELD = re.compile(rb'<([A-Za-z_]+)(?::(\d+))?(?::[A-Za-z])?>')
+ADIF_BLOCK_SIZE = 65536
+
+def parseAdif(f, offset):
+    buffer = b''
+    bufferStart = offset
+    record = {}
+    while True:
+        block = f.read(ADIF_BLOCK_SIZE)
+        buffer = buffer + block
+        position = 0
+        while True:
+            match = ADIF_FIELD.search(buffer, position)
+            if match is None:
+                break
+            tag = match.group(1).upper()
+            length = int(match.group(2) or 0)
+            valueEnd = match.end() + length
+            #Field value not fully read yet
+            if valueEnd > len(buffer) and block:
+                break
+            position = valueEnd
+            if tag == b'EOH':
+                record = {}
+            elif tag == b'EOR':
+                if b'CALL' in record:
+                    yield (record[b'CALL'].decode('latin-1'), record.get(b'NAME', b'').decode('latin-1'),
+                        bufferStart + position)
+                record = {}
+            else:
+                record[tag] = buffer[match.end():valueEnd]
+        if not block:
+            return
+        #Keep from the first unparsed field on
+        nextField = buffer.find(b'<', position)
+        if nextField < 0:
+            nextField = len(buffer)
+        bufferStart = bufferStart + nextField
+        buffer = buffer[nextField:]
+
+'''--------------------------------------------
+Importer
+--------------------------------------------'''
+
+#Print progress to stderr, at most a few times a second
+class progressPrinter:
+
+    def __init__(self):
+        self.lastPrint = 0
+
+    def __call__(self, rows, done, total, rowsPerSecond, finished=False):
+        now = time.monotonic()
+        if finished or now - self.lastPrint > .5:
+            self.lastPrint = now
+            percent = 100.0 * done / total if total else 100.0
+            sys.stderr.write('\r{:,} rows  {:5.1f}%  {:,.0f} rows/s'.format(rows, percent, rowsPerSecond))
+            if finished:
+                sys.stderr.write('\n')
+            sys.stderr.flush()
+
+#Import a file into the callbook. Returns the number of rows written by
+#this run. progress, if given, is called after each chunk with
+#(rows, bytes done, total bytes, rows per second).
+def importFile(p, kind, path, chunkSize=5000, restart=False, progress=None):
+    source = kind + ':' + os.path.abspath(path)
+    size = os.path.getsize(path)
+    modified = os.path.getmtime(path)
+
+    offset = 0
+    rows = 0
+    state = p.cur.execute('SELECT size, modified, offset, rows, finished FROM imports WHERE source = ?;',
+        (source,)).fetchone()
+    if state is not None and not restart and state[0] == size and state[1] == modified:
+        if state[4]:
+            return 0
+        offset = state[2]
+        rows = state[3]
+
+    startRows = rows
+    startTime = time.monotonic()
+    with open(path, 'rb') as f:
+        if kind == 'csv':
+            header, headerEnd = readCsvHeader(f)
+            offset = max(offset, headerEnd)
+        f.seek(offset)
+        if kind == 'fcc':
+            records = parseFcc(f, offset)
+        elif kind == 'csv':
+            records = parseCsv(f, offset, header)
+        elif kind == 'adif':
+            records = parseAdif(f, offset)
+        else:
+            raise ValueError('Unknown import format: ' + kind)
+
+        chunk = []
+        for callsign, name, recordEnd in records:
+            callsign = justifyCallsign(callsign)
+            if callsign is not None:
+                chunk.append((callsign, name.strip().upper(), kind))
+            offset = recordEnd
+            if len(chunk) >= chunkSize:
+                rows = rows + writeChunk(p, chunk, source, size, modified, offset, rows, False)
+                chunk = []
+                if progress is not None:
+                    progress(rows, offset, size, (rows - startRows) / max(time.monotonic() - startTime, 1e-9))
+        rows = rows + writeChunk(p, chunk, source, size, modified, offset, rows, True)
+
+    if progress is not None:
+        progress(rows, size, size, (rows - startRows) / max(time.monotonic() - startTime, 1e-9), True)
+    return rows - startRows
+
+#Write one chunk and the offset reached in a single transaction, so the
+#offset never gets ahead of the rows actually stored
+def writeChunk(p, chunk, source, size, modified, offset, rows, finished):
+    try:
+        p.cur.executemany('INSERT INTO callbook (callsign, name, source) VALUES (?, ?, ?) '
+            'ON CONFLICT (callsign) DO UPDATE SET name = excluded.name, source = excluded.source;', chunk)
+        p.cur.execute('INSERT OR REPLACE INTO imports (source, size, modified, offset, rows, finished) VALUES (?, ?, ?, ?, ?, ?);',
+            (source, size, modified, offset, rows + len(chunk), finished))
+        p.con.commit()
+    except Exception:
+        p.con.rollback()
+        raise
+    return len(chunk)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import names from an external callsign database')
+    parser.add_argument('format', choices=['fcc', 'csv', 'adif'])
+    parser.add_argument('path', help='file to import, e.g. EN.dat from the FCC amateur dump')
+    parser.add_argument('--database', default='dev.db')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='rows written per transaction')
+    parser.add_argument('--restart', action='store_true', help='start again from the beginning of the file')
+    parser.add_argument('--lookup', default=DEFAULT_PATH, help='name lookup file to rebuild afterwards')
+    args = parser.parse_args()
+
+    p = Persist(args.database)
+    importFile(p, args.format, args.path, args.chunk_size, args.restart, progressPrinter())
+    buildLookup(p, args.lookup)
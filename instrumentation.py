@@ -0,0 +1,191 @@
+"""
+This module provides opt-in timing of the hot paths: every SQL statement
+Persist runs, the signal handlers wired up by the main window and the
+paint events of the custom widgets. Timings are collected into
+histograms that can be dumped to a JSON file or shown in a debug overlay.
+
+Nothing is wrapped unless enable() is called before the objects are set
+up, so when instrumentation is off the hot paths run the original code
+with no extra calls at all.
+"""
+
+import json
+import time
+
+enabled = False
+
+#Histograms by name, e.g. 'sql: SELECT ...', 'handler: MainFormWidget.selectNext'
+histograms = {}
+
+'''--------------------------------------------
+Histogram with power of two buckets, in
+microseconds. Bucket b holds durations below
+2**b microseconds.
+--------------------------------------------'''
+class Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+    
+    def add(self, seconds):
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1000000).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+    
+    #Upper bound of the bucket holding a percentile, in seconds
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen = seen + self.buckets[bucket]
+            if seen >= target:
+                return min(2 ** bucket / 1000000, self.max)
+        return self.max
+    
+    def summary(self):
+        return {
+            'count': self.count,
+            'totalMs': self.total * 1000,
+            'meanMs': self.total * 1000 / max(self.count, 1),
+            'p50Ms': self.percentile(.5) * 1000,
+            'p99Ms': self.percentile(.99) * 1000,
+            'maxMs': self.max * 1000,
+            'buckets': {str(2 ** bucket) + 'us': count for bucket, count in sorted(self.buckets.items())},
+        }
+
+def record(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(seconds)
+
+#Turn instrumentation on. Must be called before the objects to be timed
+#are created and wired up.
+def enable():
+    global enabled
+    enabled = True
+
+#Wrap a callable so its run time is recorded. Returns the callable itself
+#when instrumentation is off.
+def timed(function, name=None):
+    if not enabled:
+        return function
+    if name is None:
+        name = 'handler: ' + getattr(function, '__qualname__', repr(function))
+    
+    def timedFunction(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            record(name, time.perf_counter() - start)
+    return timedFunction
+
+'''--------------------------------------------
+Proxies for the sqlite3 cursor and connection
+that time statements and commits and pass
+everything else through
+--------------------------------------------'''
+class timedCursor:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+    
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(sql, parameters)
+        finally:
+            record('sql: ' + ' '.join(sql.split()), time.perf_counter() - start)
+    
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return self.cursor.executemany(sql, parameters)
+        finally:
+            record('sql: ' + ' '.join(sql.split()), time.perf_counter() - start)
+    
+    def __iter__(self):
+        return iter(self.cursor)
+    
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class timedConnection:
+
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return self.connection.commit()
+        finally:
+            record('sql: COMMIT', time.perf_counter() - start)
+    
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+#Time every statement and commit made through a Persist object, on the
+#read connection and on the database worker's connection
+def instrumentPersist(p):
+    if enabled:
+        p.cur = timedCursor(p.cur)
+        p.con = timedConnection(p.con)
+        p.submit(instrumentWriter)
+
+#Runs on the database worker. Its timings go into the same histograms; a
+#sample can occasionally be lost to a race with the UI thread, which is
+#fine for profiling.
+def instrumentWriter(writer):
+    writer.cur = timedCursor(writer.cur)
+    writer.con = timedConnection(writer.con)
+
+#Time a method for every instance of a class, e.g. a Qt event handler
+def instrumentMethod(objectClass, methodName, name=None):
+    if not enabled:
+        return
+    original = getattr(objectClass, methodName)
+    if name is None:
+        name = 'method: ' + objectClass.__name__ + '.' + methodName
+    
+    def timedMethod(self, *args):
+        start = time.perf_counter()
+        try:
+            return original(self, *args)
+        finally:
+            record(name, time.perf_counter() - start)
+    setattr(objectClass, methodName, timedMethod)
+
+#Time the paintEvent of every instance of some widget classes
+def instrumentPaint(*classes):
+    for widgetClass in classes:
+        instrumentMethod(widgetClass, 'paintEvent', 'paint: ' + widgetClass.__name__)
+
+'''--------------------------------------------
+Output
+--------------------------------------------'''
+def summaries():
+    return {name: histogram.summary() for name, histogram in histograms.items()}
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(summaries(), f, indent=2, sort_keys=True)
+
+#Short text report of the histograms with the most total time, for the
+#debug overlay
+def report(limit=15):
+    lines = ['{:>7} {:>9} {:>8} {:>8}  {}'.format('count', 'total ms', 'p50 ms', 'p99 ms', 'name')]
+    ranked = sorted(histograms.items(), key=lambda item: item[1].total, reverse=True)
+    for name, histogram in ranked[:limit]:
+        lines.append('{:>7} {:>9.1f} {:>8.3f} {:>8.3f}  {}'.format(histogram.count, histogram.total * 1000,
+            histogram.percentile(.5) * 1000, histogram.percentile(.99) * 1000, name[:70]))
+    return '\n'.join(lines)
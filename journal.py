@@ -0,0 +1,84 @@
+"""
+    Append-only journal of field edits. Each flush of edited stations is
+    appended as one record and synced to disk, so an edit costs a short
+    sequential write instead of a random-access UPDATE. The database is
+    the snapshot; the current state is the database with the journal's
+    records applied on top. Compaction folds the journal into the database
+    and empties it, which keeps it bounded.
+
+    Record layout, integers little endian:
+
+        length       4 bytes   length of the payload
+        crc          4 bytes   CRC-32 of the payload
+        payload      JSON list of [table, rowid, {field: value}] entries
+
+    A record cut short by a crash, or damaged, fails its CRC check; reading
+    stops there, so only that last record is lost. Opening the journal cuts
+    it back to the last good record, so new records are never appended
+    after bytes that reading would stop at.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+RECORD_HEADER = struct.Struct('<II')
+
+class EditJournal:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.size = 0
+        for payload, end in self.scan():
+            self.size = end
+        if self.file.tell() > self.size:
+            self.file.truncate(self.size)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    #Append one batch of entries and wait until it is on disk
+    def append(self, entries):
+        payload = json.dumps(entries, separators=(',', ':')).encode('utf-8')
+        self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size = self.size + RECORD_HEADER.size + len(payload)
+
+    #Generate the batches in the journal, oldest first, stopping at the
+    #first record that is incomplete or fails its CRC check
+    def records(self):
+        for payload, end in self.scan():
+            yield json.loads(payload.decode('utf-8'))
+
+    #Generate the payload of each good record and the offset it ends at
+    def scan(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                yield payload, f.tell()
+
+    #Latest value of every journaled field, by (table, rowid)
+    def latestValues(self):
+        latest = {}
+        for entries in self.records():
+            for table, rowid, fields in entries:
+                latest.setdefault((table, rowid), {}).update(fields)
+        return latest
+
+    #Empty the journal once its contents are safely in the database
+    def reset(self):
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size = 0
+
+    def close(self):
+        self.file.close()
@@ -14,15 +14,30 @@
     or to contribute.
 """
 
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import *
-from PyQt5.QtCore import (Qt, pyqtSignal, QObject, QEvent)
+import os
+import sys
+import time
 
-from persist import Persist
-from dataStructures import Station, Script, StationList
-from customWidgets import *
+import startupProfile
 
-p = Persist()
+from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, QGridLayout, QHBoxLayout,
+    QScrollArea)
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import (Qt, pyqtSignal, QObject, QEvent, QTimer)
+
+import instrumentation
+from instrumentation import timed
+from dataStructures import Station, Script, StationList, Net, CheckIn, justifyCallsign
+from customWidgets import (callsignEdit, primaryEdit, stationTableModel, searchResultsModel,
+    stationTable, scriptPanel, repaints, futureSignals)
+
+startupProfile.mark('imports done')
+
+#The database connection, opened once the window is showing
+p = None
+
+#Offline callsign to name lookup, if the lookup file has been built
+names = None
 
 
 PHONETIC_STYLESHEET = '''
@@ -34,6 +49,34 @@ PHONETIC_STYLESHEET = '''
     qproperty-alignment: AlignCenter;
     '''
 
+MATCH_STYLESHEET = '''
+    font-family: "Consolas";
+    font-size: 18px;
+    '''
+
+DEBUG_OVERLAY_STYLESHEET = '''
+    background-color: rgba(0, 0, 0, 200);
+    color: rgb(0, 255, 0);
+    font-family: "Consolas";
+    font-size: 12px;
+    padding: 6px;
+    '''
+
+#Most matching callsigns listed under the phonetics
+MATCH_DISPLAY_LIMIT = 10
+
+#Most "did you mean" callsigns listed
+SUGGESTION_DISPLAY_LIMIT = 5
+
+#How often to check for stations changed by other programs
+REFRESH_INTERVAL_MS = 1000
+
+#Tallest the net script panel gets before it scrolls
+SCRIPT_PANEL_HEIGHT = 160
+
+#Most stations listed by a text search
+SEARCH_RESULT_LIMIT = 200
+
 class MainFormWidget(QWidget):
     
     """
@@ -62,17 +105,30 @@ class MainFormWidget(QWidget):
         delays due to trying to move around fields.
         """
         
+        #Keys pressed before the stations are loaded have nothing to act on
+        if self.stations is None:
+            return
+        
+        repaints.beginInput()
+        
+        #While searching, keys go to the search box and the results
+        if self.searching:
+            self.searchKeyPress(event)
+            return
+        
         isLetter = event.key() >= Qt.Key_A and event.key() <= Qt.Key_Z
         isNumber = event.key() >= Qt.Key_0 and event.key() <= Qt.Key_9
         isSpace = event.key() == Qt.Key_Space
+        isSlash = event.key() == Qt.Key_Slash
         
         #Letters, numbers, and spaces are handled by edit boxes.
         #Spaces are not valid for callsigns, and toggle acknowledgement
-        #when the callsign box is selected.
-        if (isLetter or isNumber) and self.callsignBox.selected:
+        #when the callsign box is selected. A slash starts a location
+        #prefix or designator in a callsign.
+        if (isLetter or isNumber or isSlash) and self.callsignBox.selected:
             self.callsignBox.handleInput(event)
             self.saveCallsign()
-        elif isLetter or isNumber or isSpace:
+        elif (isLetter or isNumber or isSpace) and not self.callsignBox.selected:
             if self.nameBox.selected:
                 self.nameBox.handleInput(event)
                 self.saveName()
@@ -94,6 +150,10 @@ class MainFormWidget(QWidget):
                 Qt.Key_Up: self.selectPreviousSignal.emit,
                 Qt.Key_Down: self.selectNextSignal.emit,
                 Qt.Key_Delete: self.deleteSignal.emit,
+                Qt.Key_F12: self.toggleDebugOverlay,
+                Qt.Key_F3: self.startSearch,
+                Qt.Key_Return: self.acceptNameSuggestion,
+                Qt.Key_Enter: self.acceptNameSuggestion,
                 }
                 
             keyMap = unmodifiedKeyMap
@@ -107,32 +167,295 @@ class MainFormWidget(QWidget):
     --------------------------------------------'''
     
     #Function to update the phonetic boxes when the call changes
+    #Longer callsigns, e.g. with a designator, get more boxes as needed.
     def updatePhonetics(self):
         phoneticArray = self.stations.currentStation.getPhoneticArray()
-        for i in range(6):
-            self.phoneticLabels[i].setText(phoneticArray[i])
+        while len(self.phoneticLabels) < len(phoneticArray):
+            self.addPhoneticLabel()
+        for i in range(len(self.phoneticLabels)):
+            self.phoneticLabels[i].setText(phoneticArray[i] if i < len(phoneticArray) else '')
+            self.phoneticLabels[i].setVisible(i < max(len(phoneticArray), 6))
+    
+    def addPhoneticLabel(self):
+        label = QLabel('')
+        label.setStyleSheet(PHONETIC_STYLESHEET)
+        self.phoneticLabels.append(label)
+        self.phoneticLayout.addWidget(label)
+    
+    #Show the country the callsign resolves to above the editor
+    def updateEntity(self):
+        entity = self.callsignBox.entity()
+        self.callsignLabel.setText('Callsign: ' + entity if entity else 'Callsign')
+    
+    #Queue the current station for saving. Edits are written behind and
+    #coalesced; the flush timer restarts on every edit so the write happens
+    #once typing goes idle.
+    def queueSave(self):
+        station = self.stations.currentStation
+        p.markDirty(station)
+        #Keep the check-in record in step with the station's call and name
+        checkIn = self.checkIns.get(station)
+        if checkIn is not None:
+            p.markDirty(checkIn)
+        self.flushTimer.start()
+    
+    #List other known stations matching the callsign typed so far. Blank
+    #positions in the callsign editor are treated as unknown characters.
+    def updateMatches(self):
+        pattern = self.callsignBox.text().replace(' ', '?')
+        if pattern.strip('?') == '':
+            self.matchLabel.setText('')
+            return
+        current = self.stations.currentStation
+        matches = [station.callsign.strip() for station in
+            self.stations.search(pattern, MATCH_DISPLAY_LIMIT + 1, p) if station is not current]
+        if len(matches) > 0:
+            self.matchLabel.setText('Matches: ' + '  '.join(matches[:MATCH_DISPLAY_LIMIT]))
+        else:
+            self.matchLabel.setText('')
+    
+    #List known callsigns the one typed may have been misheard for, so a
+    #misheard call does not turn into a duplicate station. This runs as the
+    #callsign is typed; moving to another station only clears the list.
+    def updateSuggestions(self):
+        current = self.stations.currentStation
+        suggestions = self.stations.suggest(p, current.callsign, SUGGESTION_DISPLAY_LIMIT)
+        if len(suggestions) > 0:
+            self.suggestionLabel.setText('Did you mean: ' + '  '.join(suggestions))
+        else:
+            self.suggestionLabel.setText('')
+    
+    #Show whether the current callsign has checked in to earlier nets
+    def updateHistory(self):
+        callsign = self.stations.currentStation.callsign
+        count = self.stations.checkInCount(p, callsign, self.net.id)
+        if count == 0:
+            self.historyLabel.setText('First check-in')
+        else:
+            #Check-ins can have been saved before a name was typed
+            lastName = self.stations.lastCheckInName(p, callsign, self.net.id) or ''
+            times = ' time' if count == 1 else ' times'
+            text = 'Checked in ' + str(count) + times + ' before'
+            if lastName:
+                text = text + ', last as ' + lastName
+            self.historyLabel.setText(text)
+    
+    #Suggest a name from the offline lookup while the current station has
+    #none and its callsign is complete
+    def updateNameSuggestion(self):
+        suggestion = None
+        station = self.stations.currentStation
+        if names is not None and station.name == '':
+            callsign = justifyCallsign(self.callsignBox.text())
+            if callsign is not None:
+                suggestion = names.lookup(callsign)
+        self.nameBox.setSuggestion(suggestion or '')
+    
+    #Return takes the suggested name as the station's name
+    def acceptNameSuggestion(self):
+        suggestion = self.nameBox.suggestion
+        if suggestion and self.stations.currentStation.name == '':
+            self.stations.currentStation.name = suggestion
+            self.nameBox.setText(suggestion)
+            self.nameBox.setSuggestion('')
+            self.queueSave()
+            self.stationTable.refreshRow(self.stations.currentStationIndex)
     
     #Next 3 take care of updating the current station and saving it, then
     #refreshing other widgets that may need to be refreshed.
     def saveCallsign(self):
         if self.callsignBox.selected:
-            print('saving callsign')
-            self.stations.currentStation.callsign = self.callsignBox.text()
-            self.stations.currentStation.saveToDatabase(p)
-            self.stationTable.refresh(self.stations)
+            #The first callsign typed into an empty list adds its station
+            rows = len(self.stations.list)
+            self.stations.setCallsign(self.stations.currentStation, self.callsignBox.text())
+            self.queueSave()
+            if len(self.stations.list) != rows:
+                self.stationModel.reset()
+                self.stationTable.setSelection(self.stations.currentStationIndex)
+            else:
+                self.stationTable.refreshRow(self.stations.currentStationIndex)
             self.updatePhonetics()
+            self.updateEntity()
+            self.updateScript('callsign', 'phonetics')
+            self.updateMatches()
+            self.updateSuggestions()
+            self.updateHistory()
+            self.updateNameSuggestion()
     
     def saveName(self):
         if self.nameBox.selected:
             self.stations.currentStation.name = self.nameBox.text()
-            self.stations.currentStation.saveToDatabase(p)
-            self.stationTable.refresh(self.stations)
+            self.queueSave()
+            self.stationTable.refreshRow(self.stations.currentStationIndex)
+            self.updateNameSuggestion()
     
     def saveNote(self):
         if self.noteBox.selected:
-            self.stations.currentStation.note = self.noteBox.text()
-            self.stations.currentStation.saveToDatabase(p)
-            self.stationTable.refresh(self.stations)
+            self.stations.setNote(self.stations.currentStation, self.noteBox.text())
+            self.queueSave()
+            self.stationTable.refreshRow(self.stations.currentStationIndex)
+    
+    #Queue pending edits on the database worker. Failures come back through
+    #databaseSignals.
+    def flushEdits(self):
+        self.databaseSignals.watch(p.flush())
+    
+    #A queued write failed. The edits are pending again, so try again after
+    #the usual idle time.
+    def databaseError(self, exception):
+        print('Database write failed: ' + repr(exception), file=sys.stderr)
+        self.flushTimer.start()
+    
+    #Pick up stations changed by other programs. This runs on F5 and on a
+    #timer; when nothing has changed it costs two pragma reads.
+    def refreshStations(self):
+        result = self.stations.refreshFromDatabase(p)
+        self.stats.refresh(p)
+        self.updateScript('unacked', 'checkins', 'firsttime')
+        if result is None:
+            self.stationModel.reset()
+        else:
+            changedRows, restructured = result
+            if restructured:
+                self.stationModel.reset()
+            else:
+                for row in changedRows:
+                    self.stationModel.stationChanged(row)
+            if not restructured and self.stations.currentStationIndex not in changedRows:
+                return
+        self.changeSelection()
+    
+    '''--------------------------------------------
+    Text search over callsigns, names and notes.
+    F3 starts it, typing narrows the results in
+    the table, Return jumps to the selected one
+    and Escape or F3 goes back to the list.
+    --------------------------------------------'''
+    
+    def searchKeyPress(self, event):
+        key = event.key()
+        if (key >= Qt.Key_A and key <= Qt.Key_Z) or (key >= Qt.Key_0 and key <= Qt.Key_9) or key == Qt.Key_Space:
+            self.searchBox.handleInput(event)
+            self.runSearch()
+        elif key == Qt.Key_Backspace:
+            self.searchBox.handleBackspace()
+            self.runSearch()
+        elif key == Qt.Key_Delete:
+            self.searchBox.handleDelete()
+            self.runSearch()
+        elif key == Qt.Key_Right:
+            self.searchBox.cursorRight()
+        elif key == Qt.Key_Left:
+            self.searchBox.cursorLeft()
+        elif key == Qt.Key_Down and self.searchRow < len(self.searchModel.results) - 1:
+            self.searchRow = self.searchRow + 1
+            self.stationTable.setSelection(self.searchRow)
+        elif key == Qt.Key_Up and self.searchRow > 0:
+            self.searchRow = self.searchRow - 1
+            self.stationTable.setSelection(self.searchRow)
+        elif key in (Qt.Key_Return, Qt.Key_Enter):
+            self.acceptSearch()
+        elif key in (Qt.Key_Escape, Qt.Key_F3):
+            self.endSearch()
+    
+    def startSearch(self):
+        self.flushEdits()
+        self.searching = True
+        self.searchBox.setText('')
+        self.searchBox.cursorPos = 0
+        self.searchBox.select()
+        self.searchModel.setResults([])
+        self.searchRow = 0
+        self.stationTable.setModel(self.searchModel)
+        self.searchRowWidget.show()
+    
+    def runSearch(self):
+        results = self.stations.textSearch(p, self.searchBox.text(), SEARCH_RESULT_LIMIT)
+        self.searchModel.setResults(results)
+        self.searchRow = 0
+        if len(results) > 0:
+            self.stationTable.setSelection(0)
+        if len(results) >= SEARCH_RESULT_LIMIT:
+            self.searchCountLabel.setText('First ' + str(len(results)))
+        else:
+            self.searchCountLabel.setText(str(len(results)) + ' found')
+    
+    def endSearch(self):
+        self.searching = False
+        self.searchBox.deselect()
+        self.searchRowWidget.hide()
+        self.stationTable.setModel(self.stationModel)
+        self.changeSelection()
+    
+    #Select the chosen station in the station list, adding it if it was
+    #past the loaded pages
+    def acceptSearch(self):
+        if len(self.searchModel.results) == 0:
+            return
+        station = self.searchModel.results[self.searchRow]
+        rows = len(self.stations.list)
+        self.stations.selectFound(station)
+        if len(self.stations.list) != rows:
+            self.stationModel.reset()
+        self.endSearch()
+    
+    '''--------------------------------------------
+    Net script: values for its placeholders, and
+    updates of the lines that show them
+    --------------------------------------------'''
+    
+    def scriptValue(self, name):
+        if name == 'checkins':
+            return self.stats.checkIns
+        elif name == 'firsttime':
+            return self.stats.firstTime
+        elif name == 'unacked':
+            return self.stations.unackedCount
+        elif name == 'callsign':
+            return self.stations.currentStation.callsign.strip()
+        elif name == 'phonetics':
+            return ' '.join(word for word in self.stations.currentStation.getPhoneticArray() if word)
+        elif name == 'net':
+            return self.net.name
+    
+    #Re-render the script lines showing any of the named values, if they
+    #have changed. Values the script does not use are not worked out.
+    def updateScript(self, *names):
+        if self.script is None:
+            return
+        compiled = self.script.compiled()
+        used = compiled.placeholders()
+        values = {name: self.scriptValue(name) for name in names if name in used}
+        if values:
+            self.scriptPanel.updateLines(compiled.update(values))
+    
+    #Show a script in the panel, or hide the panel if there is none
+    def showScript(self, script):
+        self.script = script
+        if script is None:
+            self.scriptPanel.setScript(None)
+            self.scriptArea.hide()
+            return
+        self.scriptPanel.setScript(script.compiled())
+        self.updateScript(*script.compiled().placeholders())
+        self.scriptArea.show()
+    
+    #Show or hide the instrumentation overlay, if instrumentation is on
+    def toggleDebugOverlay(self):
+        if not instrumentation.enabled:
+            return
+        if self.debugOverlay.isVisible():
+            self.debugOverlay.hide()
+            self.debugTimer.stop()
+        else:
+            self.updateDebugOverlay()
+            self.debugOverlay.show()
+            self.debugOverlay.raise_()
+            self.debugTimer.start()
+    
+    def updateDebugOverlay(self):
+        self.debugOverlay.setText(instrumentation.report())
+        self.debugOverlay.adjustSize()
     
     #Refresh the widgets when the selected station changes
     def changeSelection(self):
@@ -140,15 +463,28 @@ class MainFormWidget(QWidget):
         self.nameBox.setText(self.stations.currentStation.name)
         self.noteBox.setText(self.stations.currentStation.note)
         self.setAck(self.stations.currentStation.ack)
-        self.stationTable.setSelection(self.stations.currentStation.callsign)
+        if not self.searching:
+            self.stationTable.setSelection(self.stations.currentStationIndex)
         self.updatePhonetics()
+        self.updateEntity()
+        self.updateScript('callsign', 'phonetics')
+        self.updateMatches()
+        self.suggestionLabel.setText('')
+        self.updateHistory()
+        self.updateNameSuggestion()
     
-    #Action helpers for advancing / retreating the selection
+    #Action helpers for advancing / retreating the selection. Pending
+    #edits to the station being left are queued for writing first. Moving
+    #past the last loaded station loads the next page before wrapping around.
     def selectNext(self):
+        self.flushEdits()
+        if self.stations.currentStationIndex == len(self.stations.list) - 1:
+            self.stationModel.fetchMore()
         self.stations.selectNext()
         self.changeSelection()
     
     def selectPrevious(self):
+        self.flushEdits()
         self.stations.selectPrevious()
         self.changeSelection()
     
@@ -159,12 +495,33 @@ class MainFormWidget(QWidget):
         else:
             self.ackLabel.setPixmap(self.ackPixmap)
     
+    #Acknowledging a station checks it in to the current net and
+    #un-acknowledging withdraws the check-in. The net itself is only saved
+    #once something checks in to it.
+    def recordCheckIn(self, station):
+        checkIn = self.checkIns.get(station)
+        if station.ack:
+            if self.net.id is None:
+                p.markDirty(self.net)
+            if checkIn is None:
+                checkIn = self.checkIns[station] = CheckIn(self.net, station)
+            checkIn.active = True
+            self.stats.checkInChanged(checkIn,
+                not self.stations.hasCheckedInBefore(p, station.callsign, self.net.id))
+        elif checkIn is not None:
+            checkIn.active = False
+            self.stats.checkInChanged(checkIn)
+    
     #Update the state of the station, refresh the indicator
     def toggleAck(self):
         if self.callsignBox.selected:
-            self.stations.currentStation.toggleAck()
-            self.stations.currentStation.saveToDatabase(p)
-            self.setAck(self.stations.currentStation.ack)
+            station = self.stations.currentStation
+            self.stations.setAck(station, not station.ack)
+            self.recordCheckIn(station)
+            self.queueSave()
+            self.stationTable.refreshRow(self.stations.currentStationIndex)
+            self.setAck(station.ack)
+            self.updateScript('checkins', 'firsttime', 'unacked')
     
     #Change which editor is highlighted / selected
     def changeHighlight(self, highlightIndex):
@@ -198,6 +555,21 @@ class MainFormWidget(QWidget):
         super().__init__()
         self.mainLayout = QVBoxLayout()
         self.selectedControl = 0
+        self.loadScheduled = False
+        
+        #Results of writes queued on the database worker
+        self.databaseSignals = futureSignals()
+        self.databaseSignals.failed.connect(self.databaseError)
+        
+        #Idle timer for the write-behind flush of edited stations
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.timeout.connect(timed(self.flushEdits))
+        
+        #Timer polling for changes made to the database by other programs
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setInterval(REFRESH_INTERVAL_MS)
+        self.refreshTimer.timeout.connect(timed(self.refreshStations))
         
         '''--------------------------------------------
         Upper layout: editors and their labels
@@ -221,8 +593,8 @@ class MainFormWidget(QWidget):
         #Ack indicator uses a pixmap
         self.ackLabel = QLabel('Acknowledged')
         self.upperLayout.addWidget(self.ackLabel,0,2)
-        self.ackPixmap = QPixmap('green-check.png').scaled(20, 20)
-        self.unackPixmap = QPixmap('red-dashed-square.png').scaled(20,20)
+        self.ackPixmap = None
+        self.unackPixmap = None
         self.ackLabel = QLabel()
         self.ackLabel.setFocusPolicy(Qt.NoFocus)
         self.upperLayout.addWidget(self.ackLabel,1,2)
@@ -246,70 +618,225 @@ class MainFormWidget(QWidget):
         self.phoneticLayout = QHBoxLayout()
         self.phoneticLabels = []
         for i in range(6):
-            self.phoneticLabels.append(QLabel(''))
-            self.phoneticLabels[i].setStyleSheet(PHONETIC_STYLESHEET)
-            self.phoneticLayout.addWidget(self.phoneticLabels[i])
+            self.addPhoneticLabel()
         self.mainLayout.addLayout(self.phoneticLayout)
         
+        #Other known callsigns matching the one being typed
+        self.matchLabel = QLabel('')
+        self.matchLabel.setStyleSheet(MATCH_STYLESHEET)
+        self.mainLayout.addWidget(self.matchLabel)
+        
+        #Known callsigns close to the one being typed
+        self.suggestionLabel = QLabel('')
+        self.suggestionLabel.setStyleSheet(MATCH_STYLESHEET)
+        self.mainLayout.addWidget(self.suggestionLabel)
+        
+        #Check-in history of the current callsign
+        self.historyLabel = QLabel('')
+        self.historyLabel.setStyleSheet(MATCH_STYLESHEET)
+        self.mainLayout.addWidget(self.historyLabel)
+        
+        #Text search box and result count, shown while searching
+        self.searching = False
+        self.searchRow = 0
+        self.searchModel = searchResultsModel()
+        self.searchRowWidget = QWidget()
+        self.searchLayout = QHBoxLayout()
+        self.searchLayout.setContentsMargins(0, 0, 0, 0)
+        self.searchLayout.addWidget(QLabel('Search'))
+        self.searchBox = primaryEdit()
+        self.searchBox.setFocusPolicy(Qt.NoFocus)
+        self.searchLayout.addWidget(self.searchBox, 1)
+        self.searchCountLabel = QLabel('')
+        self.searchLayout.addWidget(self.searchCountLabel)
+        self.searchRowWidget.setLayout(self.searchLayout)
+        self.searchRowWidget.hide()
+        self.mainLayout.addWidget(self.searchRowWidget)
+        
+        #Net script, hidden until one is loaded
+        self.script = None
+        self.scriptPanel = scriptPanel()
+        self.scriptArea = QScrollArea()
+        self.scriptArea.setWidget(self.scriptPanel)
+        self.scriptArea.setWidgetResizable(True)
+        self.scriptArea.setMaximumHeight(SCRIPT_PANEL_HEIGHT)
+        self.scriptArea.setFocusPolicy(Qt.NoFocus)
+        self.scriptArea.hide()
+        self.mainLayout.addWidget(self.scriptArea)
+        
         '''--------------------------------------------
-        Set up the window and get the station list
+        Set up the window. The station list is loaded
+        by loadStations once the first frame is drawn
         --------------------------------------------'''
-        self.stations = StationList(p)
+        self.stations = None
+        
+        #This session's net and the check-ins made to it, by station
+        self.net = Net('Net ' + time.strftime('%Y-%m-%d'))
+        self.checkIns = {}
         self.setGeometry(300,300,800,500)
         self.setWindowTitle('Simple Net Scribe')
         
         '''--------------------------------------------
-        Table to hold the list of stations, custom
-        version of QTableWidget
+        Table to hold the list of stations, a view
+        over a model that reads the station list
         --------------------------------------------'''
-        self.stationTable = stationTable(len(self.stations.list), 4)
-        
-        #Tell the station table to update its data from the
-        #station list
-        self.stationTable.populate(self.stations)
-        #Render the selection for item 0
-        self.changeSelection()
+        self.stationModel = None
+        self.stationTable = stationTable(None)
         
         '''--------------------------------------------
         Signal and slot connections
         --------------------------------------------'''
-        self.acknowledgedToggle.connect(self.toggleAck)
-        self.selectRight.connect(self.changeSelectionRight)
-        self.selectLeft.connect(self.changeSelectionLeft)
-        self.refreshSignal.connect(lambda: self.stationTable.refresh(self.stations))
-        self.selectNextSignal.connect(self.selectNext)
-        self.selectPreviousSignal.connect(self.selectPrevious)
+        self.acknowledgedToggle.connect(timed(self.toggleAck))
+        self.selectRight.connect(timed(self.changeSelectionRight))
+        self.selectLeft.connect(timed(self.changeSelectionLeft))
+        self.refreshSignal.connect(timed(self.refreshStations))
+        self.selectNextSignal.connect(timed(self.selectNext))
+        self.selectPreviousSignal.connect(timed(self.selectPrevious))
         
         #Editors ignore events unless selected, so just connect
         #the common controls to all three
-        self.cursorRight.connect(self.callsignBox.cursorRight)
-        self.cursorRight.connect(self.nameBox.cursorRight)
-        self.cursorRight.connect(self.noteBox.cursorRight)
+        self.cursorRight.connect(timed(self.callsignBox.cursorRight))
+        self.cursorRight.connect(timed(self.nameBox.cursorRight))
+        self.cursorRight.connect(timed(self.noteBox.cursorRight))
         
-        self.cursorLeft.connect(self.callsignBox.cursorLeft)
-        self.cursorLeft.connect(self.nameBox.cursorLeft)
-        self.cursorLeft.connect(self.noteBox.cursorLeft)
+        self.cursorLeft.connect(timed(self.callsignBox.cursorLeft))
+        self.cursorLeft.connect(timed(self.nameBox.cursorLeft))
+        self.cursorLeft.connect(timed(self.noteBox.cursorLeft))
         
         #Need to come up with a way to not save everything every time...
-        self.deleteSignal.connect(self.callsignBox.handleDelete)
-        self.deleteSignal.connect(self.saveCallsign)
-        self.deleteSignal.connect(self.nameBox.handleDelete)
-        self.deleteSignal.connect(self.saveName)
-        self.deleteSignal.connect(self.noteBox.handleDelete)
-        self.deleteSignal.connect(self.saveNote)
+        self.deleteSignal.connect(timed(self.callsignBox.handleDelete))
+        self.deleteSignal.connect(timed(self.saveCallsign))
+        self.deleteSignal.connect(timed(self.nameBox.handleDelete))
+        self.deleteSignal.connect(timed(self.saveName))
+        self.deleteSignal.connect(timed(self.noteBox.handleDelete))
+        self.deleteSignal.connect(timed(self.saveNote))
         
         '''--------------------------------------------
         Final layout additions
         --------------------------------------------'''
         self.mainLayout.addWidget(self.stationTable)
         self.setLayout(self.mainLayout)
+        
+        #Instrumentation overlay floats over the window, outside the layout
+        self.debugOverlay = QLabel(self)
+        self.debugOverlay.setStyleSheet(DEBUG_OVERLAY_STYLESHEET)
+        self.debugOverlay.move(10, 10)
+        self.debugOverlay.hide()
+        self.debugTimer = QTimer(self)
+        self.debugTimer.setInterval(500)
+        self.debugTimer.timeout.connect(self.updateDebugOverlay)
         self.show()
+        startupProfile.mark('window shown')
+    
+    #The first paint means the window is on screen; the data is loaded
+    #after it, so the user sees the window without waiting for the database
+    def paintEvent(self, event):
+        if self.stations is None and not self.loadScheduled:
+            self.loadScheduled = True
+            startupProfile.mark('first frame painted')
+            QTimer.singleShot(0, self.loadStations)
+        QWidget.paintEvent(self, event)
+    
+    '''--------------------------------------------
+    Deferred startup: open the database, read the
+    first page of stations and start the timers
+    --------------------------------------------'''
+    def loadStations(self):
+        if self.stations is not None:
+            return
+        if p is None:
+            openDatabase()
+            startupProfile.mark('database opened')
+        self.flushTimer.setInterval(p.flushInterval)
+        self.databaseSignals.watch(p.pruneChanges())
+        self.stations = StationList(p)
+        #Only needed once the database is open, and brings in the report
+        #modules with it
+        from netStats import NetStatistics
+        self.stats = NetStatistics(p, self.net)
+        self.stations.stats = self.stats
+        startupProfile.mark('stations loaded')
+        
+        self.stationModel = stationTableModel(self.stations, p)
+        self.stationModel.rowsInserted.connect(lambda: self.updateScript('unacked'))
+        self.stationTable.setModel(self.stationModel)
+        self.ackPixmap = QPixmap('green-check.png').scaled(20, 20)
+        self.unackPixmap = QPixmap('red-dashed-square.png').scaled(20,20)
+        
+        #Setting NETSCRIBE_SCRIPT to a script name shows that script,
+        #otherwise the first one by name is shown
+        self.showScript(Script.loadByName(p, os.environ.get('NETSCRIBE_SCRIPT')))
+        
+        #Render the selection for item 0
+        self.changeSelection()
+        self.refreshTimer.start()
+        
+        #Timers run after the paints queued by the above, so this is the
+        #first frame the user can work with
+        if startupProfile.enabled:
+            QTimer.singleShot(0, self.reportStartup)
+    
+    def reportStartup(self):
+        startupProfile.mark('first interactive frame')
+        startupProfile.report()
 
 
 
+#Open the database and the name lookup file. Called by the main window
+#once it is showing, so these imports and the migrations are not on the
+#path to the first frame.
+def openDatabase():
+    global p, names
+    from persist import Persist
+    import nameLookup
+    
+    #Setting NETSCRIBE_JOURNAL to a file name records station edits in an
+    #append-only journal there instead of updating their rows in place
+    p = Persist(journalPath=os.environ.get('NETSCRIBE_JOURNAL'))
+    instrumentation.instrumentPersist(p)
+    names = nameLookup.openLookup()
+    #Write out any edits still pending when the application exits
+    QApplication.instance().aboutToQuit.connect(p.close)
+    
+    #Setting NETSCRIBE_BACKUP_DIR to a directory takes a verified snapshot
+    #there every NETSCRIBE_BACKUP_INTERVAL minutes while the net runs
+    backupDirectory = os.environ.get('NETSCRIBE_BACKUP_DIR')
+    if backupDirectory:
+        import backup
+        prepare = None
+        if p.journal is not None:
+            #Journaled edits are only in the database file once compacted
+            prepare = lambda: p.submit(p.compactJournal).result()
+        service = backup.BackupService(p.path, backupDirectory,
+            float(os.environ.get('NETSCRIBE_BACKUP_INTERVAL', backup.DEFAULT_INTERVAL)), prepare=prepare)
+        service.start()
+        QApplication.instance().aboutToQuit.connect(service.stop)
+
+    #Setting NETSCRIBE_SERVER to host:port shares the station list with the
+    #other loggers on a net server. Connected after p.close, so the last
+    #edits are written before it sends them and stops.
+    serverAddress = os.environ.get('NETSCRIBE_SERVER')
+    if serverAddress:
+        import netSync
+        sync = netSync.NetSync(p.path, *netSync.parseAddress(serverAddress))
+        sync.start()
+        QApplication.instance().aboutToQuit.connect(sync.stop)
+
 if __name__ == '__main__':
     print('here')
-    import sys
     app = QApplication(sys.argv)
+    startupProfile.mark('application created')
+    
+    #Setting NETSCRIBE_INSTRUMENT to a file name times SQL, signal handlers
+    #and painting, writes the histograms there on exit and enables the F12
+    #overlay
+    instrumentPath = os.environ.get('NETSCRIBE_INSTRUMENT')
+    if instrumentPath:
+        instrumentation.enable()
+        instrumentation.instrumentPaint(callsignEdit, primaryEdit, stationTable)
+        instrumentation.instrumentMethod(MainFormWidget, 'keyPressEvent', 'input: keyPressEvent')
+    
+    if instrumentPath:
+        app.aboutToQuit.connect(lambda: instrumentation.dump(instrumentPath))
     mainWindow = MainFormWidget()
     sys.exit(app.exec_())
\ No newline at end of file
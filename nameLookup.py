@@ -0,0 +1,150 @@
+"""
+    Offline callsign to name lookup file, built from the callbook table so
+    names can be suggested the moment a callsign is typed.
+
+    Layout, all integers little endian:
+
+        magic        8 bytes   b'NSNAMES2'
+        count        4 bytes   number of callsigns
+        key width    4 bytes   length of the longest callsign
+        keys         count * key width bytes, justified callsigns in sorted
+                     order, padded with zero bytes to the key width
+        offsets      (count + 1) * 4 bytes, start of each name in the
+                     names region, with the end of the last one at the end
+        names        UTF-8 names packed back to back
+
+    The file is opened with mmap and searched in place, so a lookup touches
+    a handful of pages whatever the size of the file and nothing is loaded
+    up front. Justified callsigns are six characters unless they have a
+    long prefix or suffix, a location prefix or a designator, so the key
+    width is that of the longest callsign in the callbook. Zero bytes sort
+    before any character, so padding keeps the keys in the same order.
+
+    Files from before the key width was stored (b'NSNAMES1') have six
+    character keys and are still read.
+
+        python nameLookup.py --database dev.db --output callbook.idx
+"""
+
+import argparse
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+MAGIC = b'NSNAMES2'
+HEADER = struct.Struct('<8sII')
+FIXED_WIDTH_MAGIC = b'NSNAMES1'
+FIXED_WIDTH_HEADER = struct.Struct('<8sI')
+FIXED_KEY_WIDTH = 6
+OFFSET = struct.Struct('<I')
+
+#Default location of the lookup file, next to the database
+DEFAULT_PATH = 'callbook.idx'
+
+#Write the lookup file from the callbook table. Rows are streamed in key
+#order into temporary files for each region, then joined, so memory use
+#does not grow with the number of rows. The file is replaced atomically.
+def buildLookup(p, path=DEFAULT_PATH):
+    directory = os.path.dirname(os.path.abspath(path))
+    count = 0
+    nameOffset = 0
+    keyWidth = p.con.execute('SELECT MAX(LENGTH(callsign)) FROM callbook;').fetchone()[0] or FIXED_KEY_WIDTH
+    with tempfile.TemporaryFile(dir=directory) as keys, \
+            tempfile.TemporaryFile(dir=directory) as offsets, \
+            tempfile.TemporaryFile(dir=directory) as names:
+        cursor = p.con.execute('SELECT callsign, name FROM callbook ORDER BY callsign;')
+        for callsign, name in cursor:
+            name = (name or '').encode('utf-8')
+            keys.write(callsign.encode('ascii', 'replace').ljust(keyWidth, b'\0'))
+            offsets.write(OFFSET.pack(nameOffset))
+            names.write(name)
+            nameOffset = nameOffset + len(name)
+            count = count + 1
+        offsets.write(OFFSET.pack(nameOffset))
+
+        with open(path + '.tmp', 'wb') as output:
+            output.write(HEADER.pack(MAGIC, count, keyWidth))
+            for region in (keys, offsets, names):
+                region.seek(0)
+                shutil.copyfileobj(region, output)
+    os.replace(path + '.tmp', path)
+    return count
+
+'''--------------------------------------------
+Read side: binary search of the mapped file
+--------------------------------------------'''
+class NameLookup:
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            #Empty files cannot be mapped
+            self.file.close()
+            raise ValueError('Not a name lookup file: ' + path)
+        magic = self.map[:len(MAGIC)]
+        if magic == MAGIC:
+            magic, self.count, self.keyWidth = HEADER.unpack_from(self.map, 0)
+            self.keysStart = HEADER.size
+        elif magic == FIXED_WIDTH_MAGIC:
+            magic, self.count = FIXED_WIDTH_HEADER.unpack_from(self.map, 0)
+            self.keyWidth = FIXED_KEY_WIDTH
+            self.keysStart = FIXED_WIDTH_HEADER.size
+        else:
+            self.close()
+            raise ValueError('Not a name lookup file: ' + path)
+        self.offsetsStart = self.keysStart + self.count * self.keyWidth
+        self.namesStart = self.offsetsStart + (self.count + 1) * OFFSET.size
+
+    #Name for a justified callsign such as ' W3LOR', or None if unknown
+    def lookup(self, callsign):
+        key = callsign.encode('ascii', 'replace')
+        if len(key) > self.keyWidth:
+            return None
+        key = key.ljust(self.keyWidth, b'\0')
+        width = self.keyWidth
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.keysStart + middle * width
+            if self.map[start:start + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        start = self.keysStart + low * width
+        if low == self.count or self.map[start:start + width] != key:
+            return None
+        nameStart, = OFFSET.unpack_from(self.map, self.offsetsStart + low * OFFSET.size)
+        nameEnd, = OFFSET.unpack_from(self.map, self.offsetsStart + (low + 1) * OFFSET.size)
+        return self.map[self.namesStart + nameStart:self.namesStart + nameEnd].decode('utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+#Open the lookup file if it has been built, otherwise return None
+def openLookup(path=DEFAULT_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        return NameLookup(path)
+    except ValueError:
+        return None
+
+if __name__ == '__main__':
+    from persist import Persist
+
+    parser = argparse.ArgumentParser(description='Build the offline callsign to name lookup file')
+    parser.add_argument('--database', default='dev.db')
+    parser.add_argument('--output', default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    p = Persist(args.database)
+    print('Wrote ' + str(buildLookup(p, args.output)) + ' names to ' + args.output)
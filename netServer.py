@@ -0,0 +1,436 @@
+"""
+    Shared net log for several loggers on a local network. One copy runs
+    the server, which holds the authoritative station list and database;
+    loggers connect as clients, send edits to single fields and get back
+    only the fields other loggers changed.
+
+        python netServer.py --database net.db --port 7373
+
+    The main window joins a server as a client through netSync.py.
+
+    The protocol is one JSON object per line over TCP:
+
+        client -> server
+            {"op": "hello", "since": seq or null}
+            {"op": "edit", "ref": 1, "id": 12, "field": "name", "value": "JOHN", "base": seq}
+            {"op": "insert", "ref": 2, "callsign": " K7JWF", "name": "", "ack": false, "note": ""}
+            {"op": "delete", "ref": 3, "id": 12}
+
+        server -> client
+            {"op": "snapshot", "seq": seq, "stations": [{"id": .., "callsign": .., ...}, ...]}
+            {"op": "delta", "seq": seq, "id": 12, "field": "name", "value": "JOHN"}
+            {"op": "deleted", "seq": seq, "id": 12}
+            {"op": "ack", "ref": 1, "seq": seq, "conflict": false}     after an edit or delete
+            {"op": "inserted", "ref": 2, "id": 13, "seq": seq}         after an insert
+            {"op": "error", "ref": 1, "message": "..."}
+
+    ref is chosen by the client and echoed in the reply to that request.
+
+    Every change gets the next sequence number. An edit carries the
+    sequence number of the value it was based on. Conflicts are resolved
+    per field: edits to different fields of a station never conflict, and
+    two loggers editing the same field are applied in the order they reach
+    the server, the later one flagged as a conflict in its ack. A logger
+    overwriting its own earlier edit is never a conflict, however far
+    behind its base is. Edits to a station that has been deleted are
+    refused, and its id is not given to another station while the server
+    runs.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import sys
+
+from persist import Persist
+from dataStructures import Station, StationList
+
+DEFAULT_PORT = 7373
+
+#Station fields clients may edit
+FIELDS = ('callsign', 'name', 'ack', 'note')
+
+#Deltas kept for clients reconnecting with a sequence number; ones that
+#fall further behind are sent a snapshot instead
+DELTA_HISTORY = 10000
+
+#Longest line accepted, in bytes. Snapshots are a single line.
+LINE_LIMIT = 2 ** 24
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def stationFields(station):
+    return {'id': station.id, 'callsign': station.callsign, 'name': station.name,
+        'ack': bool(station.ack), 'note': station.note}
+
+'''--------------------------------------------
+Server
+--------------------------------------------'''
+class NetServer:
+
+    def __init__(self, p):
+        self.p = p
+        #The whole list is loaded so every station can be edited by id
+        self.stations = StationList(p, pageSize=10000)
+        while self.stations.hasMore:
+            self.stations.updateListFromDatabase(p)
+
+        self.seq = 0
+        #(station id, field) -> (seq it last changed at, client that changed it)
+        self.fieldVersions = {}
+        self.history = collections.deque(maxlen=DELTA_HISTORY)
+        #Outgoing queue of every connected client
+        self.clients = {}
+        #Callsigns of stations being inserted, until they are written
+        self.inserting = set()
+        #Highest id given to a station
+        self.lastId = max(self.stations.idIndex, default=0)
+        #Tasks serving connected clients
+        self.handlers = set()
+        self.server = None
+        self.flushTask = None
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handleClient, host, port, limit=LINE_LIMIT)
+        self.flushTask = asyncio.ensure_future(self.flushPeriodically())
+        return self.server.sockets[0].getsockname()[1]
+
+    #Stop accepting clients, disconnect the connected ones and write out
+    #pending edits
+    async def close(self):
+        self.server.close()
+        self.flushTask.cancel()
+        for queue in list(self.clients.values()):
+            queue.put_nowait(None)
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        self.p.close()
+
+    #Write edits behind, as the main window does
+    async def flushPeriodically(self):
+        while True:
+            await asyncio.sleep(self.p.flushInterval / 1000)
+            future = self.p.flush()
+            if future is not None:
+                try:
+                    await asyncio.wrap_future(future)
+                except Exception as exception:
+                    print('Database write failed: ' + repr(exception), file=sys.stderr)
+
+    #Send a message to every client, through each one's own queue so a
+    #slow client never holds up the others
+    def broadcast(self, message):
+        data = encode(message)
+        for queue in self.clients.values():
+            queue.put_nowait(data)
+
+    #Record and broadcast a change to one field
+    def publish(self, station, field, value, client):
+        self.seq = self.seq + 1
+        self.fieldVersions[(station.id, field)] = (self.seq, client)
+        delta = {'op': 'delta', 'seq': self.seq, 'id': station.id, 'field': field, 'value': value}
+        self.history.append(delta)
+        self.broadcast(delta)
+        return self.seq
+
+    #Record and broadcast a station's deletion
+    def publishDeletion(self, stationId):
+        self.seq = self.seq + 1
+        for field in FIELDS:
+            self.fieldVersions.pop((stationId, field), None)
+        deletion = {'op': 'deleted', 'seq': self.seq, 'id': stationId}
+        self.history.append(deletion)
+        self.broadcast(deletion)
+        return self.seq
+
+    async def handleClient(self, reader, writer):
+        queue = asyncio.Queue()
+        sender = asyncio.ensure_future(self.sendQueued(queue, writer))
+        client = object()
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = {}
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        message = {}
+                        raise ValueError('Not a JSON object')
+                    reply = await self.handleMessage(message, client, queue)
+                except (ValueError, KeyError, TypeError, AttributeError) as exception:
+                    reply = {'op': 'error', 'message': str(exception)}
+                if reply is not None:
+                    if 'ref' in message:
+                        reply['ref'] = message['ref']
+                    queue.put_nowait(encode(reply))
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.pop(client, None)
+            queue.put_nowait(None)
+            await sender
+            self.handlers.discard(handler)
+
+    async def sendQueued(self, queue, writer):
+        try:
+            while True:
+                data = await queue.get()
+                if data is None:
+                    break
+                writer.write(data)
+                if queue.empty():
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handleMessage(self, message, client, queue):
+        op = message['op']
+        if op == 'hello':
+            return self.hello(message.get('since'), client, queue)
+        elif op == 'edit':
+            return self.edit(message['id'], message['field'], message['value'], message.get('base', 0), client)
+        elif op == 'insert':
+            return await self.insert(message, client)
+        elif op == 'delete':
+            return await self.delete(message['id'])
+        raise ValueError('Unknown op: ' + str(op))
+
+    #A new or reconnecting client gets the deltas it missed if they are
+    #still in the history, otherwise a snapshot, and then live deltas
+    def hello(self, since, client, queue):
+        self.clients[client] = queue
+        if since is not None and since <= self.seq and (since == self.seq or
+                (len(self.history) > 0 and self.history[0]['seq'] <= since + 1)):
+            for delta in self.history:
+                if delta['seq'] > since:
+                    queue.put_nowait(encode(delta))
+            return None
+        return {'op': 'snapshot', 'seq': self.seq,
+            'stations': [stationFields(station) for station in self.stations.list]}
+
+    def edit(self, stationId, field, value, base, client):
+        station = self.stations.idIndex.get(stationId)
+        if station is None:
+            raise ValueError('No station with id ' + str(stationId))
+        if field not in FIELDS:
+            raise ValueError('Not an editable field: ' + str(field))
+
+        version, lastClient = self.fieldVersions.get((stationId, field), (0, None))
+        conflict = version > base and lastClient is not client
+        if field == 'callsign':
+            value = value.upper()
+            other = self.stations.find(value)
+            if (other is not None and other is not station) or value in self.inserting:
+                raise ValueError('Callsign already in use: ' + value.strip())
+            self.stations.setCallsign(station, value)
+        elif field == 'ack':
+            value = bool(value)
+            self.stations.setAck(station, value)
+        elif field == 'note':
+            self.stations.setNote(station, value)
+        else:
+            setattr(station, field, value)
+        self.p.markDirty(station)
+        return {'op': 'ack', 'seq': self.publish(station, field, value, client), 'conflict': conflict}
+
+    #New stations are written straight away so they have an id to share.
+    #The id is chosen here rather than by SQLite, which would give the id
+    #of a deleted station to the next one added.
+    async def insert(self, message, client):
+        station = Station(message['callsign'], message.get('name', ''), bool(message.get('ack', False)),
+            message.get('note', ''))
+        if self.stations.find(station.callsign) is not None or station.callsign in self.inserting:
+            raise ValueError('Callsign already in use: ' + station.callsign.strip())
+        self.lastId = self.lastId + 1
+        station.id = self.lastId
+        self.inserting.add(station.callsign)
+        try:
+            await asyncio.wrap_future(self.p.submit(self.writeNewStation, station))
+        except Exception as exception:
+            raise ValueError('Could not add station: ' + repr(exception))
+        finally:
+            self.inserting.discard(station.callsign)
+        self.stations.insertStation(station)
+        self.stations.idIndex[station.id] = station
+        fields = stationFields(station)
+        for field in FIELDS:
+            seq = self.publish(station, field, fields[field], client)
+        return {'op': 'inserted', 'id': station.id, 'seq': seq}
+
+    #These two run on the database worker
+    def writeNewStation(self, writer, station):
+        writer.cur.execute('INSERT INTO stations (rowid, callsign, name, ack, note) VALUES (?, ?, ?, ?, ?);',
+            (station.id, station.callsign, station.name, station.ack, station.note))
+
+    def deleteStation(self, writer, stationId):
+        writer.cur.execute('DELETE FROM stations WHERE rowid = ?;', (stationId,))
+
+    #The station leaves the list at once, so later edits to it are refused,
+    #and is deleted from the database after any of its edits already queued
+    async def delete(self, stationId):
+        station = self.stations.idIndex.get(stationId)
+        if station is None:
+            raise ValueError('No station with id ' + str(stationId))
+        self.p.discard(station)
+        self.stations.removeStation(self.stations.rowOfStation(station))
+        del self.stations.idIndex[stationId]
+        try:
+            await asyncio.wrap_future(self.p.submit(self.deleteStation, stationId))
+        except Exception as exception:
+            self.stations.insertStation(station)
+            self.stations.idIndex[stationId] = station
+            raise ValueError('Could not delete station: ' + repr(exception))
+        return {'op': 'ack', 'seq': self.publishDeletion(stationId), 'conflict': False}
+
+'''--------------------------------------------
+Client, keeping a copy of the station fields
+in step with the server
+--------------------------------------------'''
+class NetClient:
+
+    #onDelta(delta) is called after each delta is applied to the copy,
+    #onSnapshot(message) after a snapshot has replaced it and
+    #onDelete(deletion) after a station has been removed from it
+    def __init__(self, onDelta=None, onSnapshot=None, onDelete=None):
+        #Station fields by id, as dicts
+        self.stations = {}
+        #(station id, field) -> seq of the value this client last saw
+        self.fieldVersions = {}
+        self.seq = None
+        self.onDelta = onDelta
+        self.onSnapshot = onSnapshot
+        self.onDelete = onDelete
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        #Futures for replies to this client's requests, by ref
+        self.pending = {}
+        self.nextRef = 0
+        #Edits applied over another logger's newer value
+        self.conflicts = 0
+        self.snapshot = None
+
+    async def connect(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        self.snapshot = asyncio.get_event_loop().create_future()
+        self.send({'op': 'hello', 'since': self.seq})
+        self.receiver = asyncio.ensure_future(self.receive())
+        if self.seq is None:
+            await self.snapshot
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
+
+    def send(self, message):
+        self.writer.write(encode(message))
+
+    #Send a request and return a future for its reply
+    def request(self, message):
+        self.nextRef = self.nextRef + 1
+        future = asyncio.get_event_loop().create_future()
+        self.pending[self.nextRef] = future
+        self.send(dict(message, ref=self.nextRef))
+        return future
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            op = message['op']
+            if op == 'delta':
+                self.applyDelta(message)
+            elif op == 'deleted':
+                self.applyDeletion(message)
+            elif op == 'snapshot':
+                self.stations = {fields['id']: fields for fields in message['stations']}
+                self.fieldVersions = {}
+                self.seq = message['seq']
+                if self.onSnapshot is not None:
+                    self.onSnapshot(message)
+                if not self.snapshot.done():
+                    self.snapshot.set_result(message)
+            else:
+                if message.get('conflict'):
+                    self.conflicts = self.conflicts + 1
+                future = self.pending.pop(message.get('ref'), None)
+                if future is not None:
+                    future.set_result(message)
+                elif op == 'error':
+                    print('Server error: ' + message['message'], file=sys.stderr)
+
+    def applyDelta(self, delta):
+        fields = self.stations.setdefault(delta['id'], {'id': delta['id']})
+        fields[delta['field']] = delta['value']
+        self.fieldVersions[(delta['id'], delta['field'])] = delta['seq']
+        self.seq = delta['seq']
+        if self.onDelta is not None:
+            self.onDelta(delta)
+
+    def applyDeletion(self, deletion):
+        self.stations.pop(deletion['id'], None)
+        for field in FIELDS:
+            self.fieldVersions.pop((deletion['id'], field), None)
+        self.seq = deletion['seq']
+        if self.onDelete is not None:
+            self.onDelete(deletion)
+
+    #Send an edit without waiting for the reply; the returned future can be
+    #awaited for it. The local copy is updated straight away, and put back
+    #if the server refuses the edit.
+    def edit(self, stationId, field, value):
+        future = self.request({'op': 'edit', 'id': stationId, 'field': field, 'value': value,
+            'base': self.fieldVersions.get((stationId, field), 0)})
+        fields = self.stations.get(stationId)
+        if fields is not None:
+            oldValue = fields.get(field)
+            fields[field] = value
+
+            def restore(future):
+                if future.result()['op'] == 'error' and fields.get(field) == value:
+                    fields[field] = oldValue
+            future.add_done_callback(restore)
+        return future
+
+    #Add a station and wait for its id
+    async def insert(self, callsign, name='', ack=False, note=''):
+        reply = await self.request({'op': 'insert', 'callsign': callsign, 'name': name, 'ack': ack, 'note': note})
+        if reply['op'] == 'error':
+            raise ValueError(reply['message'])
+        return reply['id']
+
+    #Send a delete without waiting for the reply. The station leaves the
+    #copy when the server's deletion comes back.
+    def delete(self, stationId):
+        return self.request({'op': 'delete', 'id': stationId})
+
+async def serve(path, host, port):
+    p = Persist(path)
+    server = NetServer(p)
+    port = await server.start(host, port)
+    print('Serving ' + path + ' on ' + host + ':' + str(port))
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared net log server')
+    parser.add_argument('--database', default='dev.db')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.database, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,247 @@
+"""
+    Net statistics and reports.
+
+    NetStatistics holds the totals asked for after a net: check-ins,
+    first-time stations, acknowledged and unacknowledged stations and
+    stations with notes. They are kept up to date from each edit as it
+    happens, through the StationList and the main window, so reading them
+    never rescans a table. Changes made by other programs may be to
+    stations that are not loaded, so whenever the database's data_version
+    changes the station totals are counted again from the database.
+
+    Reports are read from the database a row at a time and written out as
+    they are produced, so a report over years of nets runs in the same
+    memory as one over a single net.
+
+        python netStats.py totals --database dev.db
+        python netStats.py summary --format html --output nets.html
+        python netStats.py history --since 2020-01-01 --output history.csv
+"""
+
+import argparse
+import csv
+import html
+import sys
+
+from dataStructures import Station
+
+#True if a check-in is a callsign's first, i.e. it has not checked in any
+#earlier. Answered from the checkins_callsign index.
+FIRST_TIME = ('NOT EXISTS (SELECT 1 FROM checkins earlier WHERE earlier.callsign = checkins.callsign '
+    'AND earlier.checkedIn < checkins.checkedIn)')
+
+'''--------------------------------------------
+Live totals for a net session
+--------------------------------------------'''
+class NetStatistics:
+
+    def __init__(self, p, net):
+        self.net = net
+        #Check-ins counted, with whether each was a first-time station
+        self.firstTimeCheckIns = {}
+        self.checkIns = 0
+        self.firstTime = 0
+        self.recount(p)
+
+    #Count everything from the database. Stations with edits that are not
+    #in the database yet are counted as they are in memory instead.
+    def recount(self, p):
+        #Read first, so a commit made while counting brings another recount
+        self.dataVersion = p.dataVersion()
+        row = p.cur.execute("SELECT COUNT(*), TOTAL(ack), TOTAL(note IS NOT NULL AND note != '') FROM stations;").fetchone()
+        self.stations = row[0]
+        self.acknowledged = int(row[1])
+        self.withNotes = int(row[2])
+        for station in p.pendingObjects():
+            if not isinstance(station, Station):
+                continue
+            if station.id is not None:
+                saved = p.cur.execute('SELECT ack, note FROM stations WHERE rowid = ?;', (station.id,)).fetchone()
+            else:
+                saved = None
+            if saved is not None:
+                self.stationRemoved(Station(ack=saved[0], note=saved[1]))
+            self.stationAdded(station)
+        #Check-ins made in this session may not be written yet, so once
+        #there are any the deltas are trusted over the database
+        if self.net.id is not None and not self.firstTimeCheckIns:
+            row = p.cur.execute('SELECT COUNT(*), TOTAL(' + FIRST_TIME + ') FROM checkins WHERE netId = ?;',
+                (self.net.id,)).fetchone()
+            self.checkIns = row[0]
+            self.firstTime = int(row[1])
+
+    #Count again if another connection has committed since the last count.
+    #With nothing changed this costs one pragma read.
+    def refresh(self, p):
+        if p.dataVersion() != self.dataVersion:
+            self.recount(p)
+    
+    @property
+    def unacknowledged(self):
+        return self.stations - self.acknowledged
+
+    #Totals by name, in the order they are reported
+    def totals(self):
+        return {'net': self.net.name, 'checkIns': self.checkIns, 'firstTime': self.firstTime,
+            'stations': self.stations, 'acknowledged': self.acknowledged,
+            'unacknowledged': self.unacknowledged, 'withNotes': self.withNotes}
+
+    '''--------------------------------------------
+    Deltas. Each is called before the station is
+    changed, so the old value can be compared.
+    --------------------------------------------'''
+
+    def stationAdded(self, station):
+        self.stations = self.stations + 1
+        if station.ack:
+            self.acknowledged = self.acknowledged + 1
+        if station.note:
+            self.withNotes = self.withNotes + 1
+
+    def stationRemoved(self, station):
+        self.stations = self.stations - 1
+        if station.ack:
+            self.acknowledged = self.acknowledged - 1
+        if station.note:
+            self.withNotes = self.withNotes - 1
+
+    def ackChanged(self, station, ack):
+        if ack and not station.ack:
+            self.acknowledged = self.acknowledged + 1
+        elif station.ack and not ack:
+            self.acknowledged = self.acknowledged - 1
+
+    def noteChanged(self, station, note):
+        if note and not station.note:
+            self.withNotes = self.withNotes + 1
+        elif station.note and not note:
+            self.withNotes = self.withNotes - 1
+
+    #A check-in was made, or withdrawn if it is no longer active. firstTime
+    #is only looked at the first time a check-in is seen.
+    def checkInChanged(self, checkIn, firstTime=False):
+        counted = checkIn in self.firstTimeCheckIns
+        if checkIn.active and not counted:
+            self.firstTimeCheckIns[checkIn] = firstTime
+            self.checkIns = self.checkIns + 1
+            if firstTime:
+                self.firstTime = self.firstTime + 1
+        elif counted and not checkIn.active:
+            if self.firstTimeCheckIns.pop(checkIn):
+                self.firstTime = self.firstTime - 1
+            self.checkIns = self.checkIns - 1
+
+'''--------------------------------------------
+Report rows. Each is a generator over a cursor
+of its own, so rows are read from the database
+only as they are written out.
+--------------------------------------------'''
+
+SUMMARY_HEADER = ('Net', 'Started', 'Check-ins', 'First-time')
+
+#One row per net, oldest first
+def summaryRows(p, since=None, until=None):
+    cursor = p.con.execute('SELECT name, started, '
+        '(SELECT COUNT(*) FROM checkins WHERE netId = nets.id), '
+        '(SELECT COUNT(*) FROM checkins WHERE netId = nets.id AND ' + FIRST_TIME + ') '
+        'FROM nets WHERE (? IS NULL OR started >= ?) AND (? IS NULL OR started < ?) ORDER BY id;',
+        (since, since, until, until))
+    for row in cursor:
+        yield row
+
+HISTORY_HEADER = ('Net', 'Started', 'Callsign', 'Name', 'Checked in', 'First time')
+
+#One row per check-in, net by net. Check-ins are read in the order of the
+#checkins_net index so SQLite has nothing to sort.
+def historyRows(p, since=None, until=None):
+    cursor = p.con.execute('SELECT nets.name, nets.started, checkins.callsign, checkins.name, checkins.checkedIn, ' +
+        FIRST_TIME + ' FROM nets JOIN checkins ON checkins.netId = nets.id '
+        'WHERE (? IS NULL OR nets.started >= ?) AND (? IS NULL OR nets.started < ?) '
+        'ORDER BY checkins.netId, checkins.callsign;',
+        (since, since, until, until))
+    for netName, started, callsign, name, checkedIn, firstTime in cursor:
+        yield (netName, started, callsign.strip(), name, checkedIn, 'Yes' if firstTime else '')
+
+TOTALS_HEADER = ('Total', 'Value')
+
+def totalsRows(stats):
+    for name, value in stats.totals().items():
+        yield (name, value)
+
+'''--------------------------------------------
+Output formats. Each turns a header and rows
+into a generator of text to write.
+--------------------------------------------'''
+
+#csv.writer wants a file; this one just keeps the last line written
+class lastLine:
+
+    def write(self, text):
+        self.text = text
+
+def csvLines(title, header, rows):
+    line = lastLine()
+    writer = csv.writer(line)
+    writer.writerow(header)
+    yield line.text
+    for row in rows:
+        writer.writerow(row)
+        yield line.text
+
+def htmlLines(title, header, rows):
+    yield ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>' + html.escape(title) +
+        '</title></head>\n<body><h1>' + html.escape(title) + '</h1>\n<table>\n')
+    yield '<tr>' + ''.join('<th>' + html.escape(str(cell)) + '</th>' for cell in header) + '</tr>\n'
+    for row in rows:
+        yield '<tr>' + ''.join('<td>' + html.escape('' if cell is None else str(cell)) + '</td>'
+            for cell in row) + '</tr>\n'
+    yield '</table>\n</body></html>\n'
+
+FORMATS = {'csv': csvLines, 'html': htmlLines}
+
+#Write a report to a path, or to stdout if the path is None or '-'
+def writeReport(lines, path=None):
+    if path is None or path == '-':
+        for text in lines:
+            sys.stdout.write(text)
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for text in lines:
+            f.write(text)
+
+if __name__ == '__main__':
+    from persist import Persist
+    from dataStructures import Net
+
+    parser = argparse.ArgumentParser(description='Net statistics and reports')
+    parser.add_argument('report', choices=['totals', 'summary', 'history'])
+    parser.add_argument('--database', default='dev.db')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--output', help='file to write, standard output if not given')
+    parser.add_argument('--net', type=int, help='net id for totals, the latest net if not given')
+    parser.add_argument('--since', help='first date to include, e.g. 2020-01-01')
+    parser.add_argument('--until', help='date to stop before')
+    args = parser.parse_args()
+
+    p = Persist(args.database)
+    if args.report == 'totals':
+        if args.net is None:
+            row = p.cur.execute('SELECT name, started, id FROM nets ORDER BY id DESC LIMIT 1;').fetchone()
+        else:
+            row = p.cur.execute('SELECT name, started, id FROM nets WHERE id = ?;', (args.net,)).fetchone()
+        if row is None:
+            sys.exit('No such net')
+        stats = NetStatistics(p, Net(row[0], row[1], row[2]))
+        title = 'Totals for ' + row[0]
+        header = TOTALS_HEADER
+        rows = totalsRows(stats)
+    elif args.report == 'summary':
+        title = 'Nets'
+        header = SUMMARY_HEADER
+        rows = summaryRows(p, args.since, args.until)
+    else:
+        title = 'Check-in history'
+        header = HISTORY_HEADER
+        rows = historyRows(p, args.since, args.until)
+    writeReport(FORMATS[args.format](title, header, rows), args.output)
+    p.close()
@@ -0,0 +1,361 @@
+"""
+    Keeps the main window's database in step with a net server, so each
+    logger on a net runs the usual application and they all share one
+    station list.
+
+        NETSCRIBE_SERVER=192.168.1.10:7373 python main.py
+
+    The window reads and writes its own database as it always does.
+    NetSync runs a NetClient on a thread and connection of its own and
+    - writes the server's stations and deltas to the database, where the
+      window's refresh picks them up like a change by any other program
+    - follows the stationChanges log for the window's writes and sends the
+      fields that differ from the server's copy as edits, stations the
+      server does not have as inserts and deleted stations as deletes
+
+    Local rowids and server ids are different numbers; serverStations maps
+    one to the other for each server. On connecting, a local station with a
+    callsign the server already has is matched to it and takes the server's
+    fields, and the rest are sent to the server, so copies of the database
+    that were used apart are merged. Stations changed locally since the
+    application started keep the local fields. The same merge means a
+    station deleted on the server while this logger was away for longer
+    than the server's delta history comes back from this logger's copy.
+
+    Edits reach the server once the window has flushed them; with the edit
+    journal on that is when the journal is compacted. A station being edited
+    in the window when another logger changes it keeps the window's fields,
+    as the window writes whole stations.
+"""
+
+import asyncio
+import sqlite3
+import sys
+import threading
+
+from persist import BUSY_TIMEOUT
+from netServer import NetClient, DEFAULT_PORT, FIELDS
+
+#Seconds between checks for local writes, which are also when received
+#deltas are written out
+POLL_INTERVAL = 0.25
+
+#Seconds to wait before connecting again after the server went away
+RECONNECT_DELAY = 5
+
+#Largest number of rowids in one IN (...) list
+CHUNK_SIZE = 500
+
+#'host:port' or 'host' to (host, port)
+def parseAddress(address):
+    host, colon, port = address.rpartition(':')
+    if not colon:
+        return address, DEFAULT_PORT
+    return host, int(port)
+
+#Station fields as the server keeps them. The database may hold NULL for
+#an empty name or note and 0 or 1 for ack.
+def normalFields(callsign, name, ack, note):
+    return {'callsign': callsign, 'name': name or '', 'ack': bool(ack), 'note': note or ''}
+
+'''--------------------------------------------
+Sync between a database and a net server, on a
+thread of its own until it is stopped
+--------------------------------------------'''
+class NetSync:
+
+    def __init__(self, path, host, port=DEFAULT_PORT):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.server = host + ':' + str(port)
+        self.con = None
+        self.client = NetClient(self.deltaReceived, self.snapshotReceived, self.deletionReceived)
+        #Local rowid to server id and back
+        self.serverIds = {}
+        self.localIds = {}
+        #Fields of server stations received but not written yet, by server
+        #id, and whether a snapshot came with them
+        self.incoming = {}
+        self.snapshot = False
+        #Server ids of stations deleted on the server, not deleted here yet
+        self.deleted = set()
+        #Local rowids of stations sent to the server as inserts
+        self.inserting = set()
+        #Last change log entry looked at, and the ranges of entries this
+        #connection wrote itself, which are not sent back
+        self.watermark = 0
+        self.ownChanges = []
+        self.dataVersion = None
+        self.loop = asyncio.new_event_loop()
+        self.stopping = asyncio.Event()
+        #Set while connected, for callers that want to wait for it
+        self.connected = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='netSync', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    #Send the last local writes and disconnect
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        self.con = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        try:
+            #Writes made before the application started are not sent, the
+            #server's fields win for those
+            self.watermark = self.con.execute('SELECT COALESCE(MAX(seq), 0) FROM stationChanges;').fetchone()[0]
+            self.loop.run_until_complete(self.sync())
+        finally:
+            self.con.close()
+            self.loop.close()
+
+    #Connect, and connect again whenever the server goes away
+    async def sync(self):
+        while not self.stopping.is_set():
+            try:
+                await self.session()
+            except (OSError, ValueError, sqlite3.Error) as exception:
+                print('Net server ' + self.server + ': ' + str(exception), file=sys.stderr)
+            self.connected.clear()
+            if not self.stopping.is_set():
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), RECONNECT_DELAY)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def session(self):
+        self.loadIds()
+        await self.client.connect(self.host, self.port)
+        try:
+            self.connected.set()
+            while not self.client.receiver.done():
+                self.exchange()
+                if self.stopping.is_set():
+                    await self.client.writer.drain()
+                    break
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.client.writer.close()
+            await self.client.receiver
+            #Replies that will never come; inserts are sent again next time
+            for future in self.client.pending.values():
+                future.cancel()
+            self.client.pending = {}
+
+    #Send local writes, then write what was received. In that order a local
+    #edit is in the server's copy before received fields are written over it.
+    def exchange(self):
+        self.sendLocalChanges()
+        self.writeIncoming()
+        if self.snapshot:
+            self.snapshot = False
+            self.sendUnmatched()
+
+    def loadIds(self):
+        self.serverIds = dict(self.con.execute('SELECT stationId, serverId FROM serverStations WHERE server = ?;',
+            (self.server,)))
+        self.localIds = {serverId: stationId for stationId, serverId in self.serverIds.items()}
+
+    def mapStation(self, stationId, serverId):
+        self.con.execute('INSERT OR REPLACE INTO serverStations (server, serverId, stationId) VALUES (?, ?, ?);',
+            (self.server, serverId, stationId))
+        self.serverIds[stationId] = serverId
+        self.localIds[serverId] = stationId
+    
+    def unmapStation(self, stationId):
+        serverId = self.serverIds.pop(stationId)
+        del self.localIds[serverId]
+        self.con.execute('DELETE FROM serverStations WHERE server = ? AND stationId = ?;', (self.server, stationId))
+
+    '''--------------------------------------------
+    Server to database
+    --------------------------------------------'''
+
+    def deltaReceived(self, delta):
+        self.incoming.setdefault(delta['id'], set()).add(delta['field'])
+
+    #Every station is written again, and matched ones the server no longer
+    #has are sent to it as new
+    def snapshotReceived(self, message):
+        self.incoming = {fields['id']: set(FIELDS) for fields in message['stations']}
+        self.deleted = set()
+        for stationId, serverId in list(self.serverIds.items()):
+            if serverId not in self.incoming:
+                self.unmapStation(stationId)
+        self.snapshot = True
+    
+    def deletionReceived(self, deletion):
+        self.incoming.pop(deletion['id'], None)
+        self.deleted.add(deletion['id'])
+
+    #Write the received fields and deletions in one transaction, together
+    #with any matches a snapshot dropped
+    def writeIncoming(self):
+        if not self.incoming and not self.deleted:
+            self.con.commit()
+            return
+        incoming = self.incoming
+        self.incoming = {}
+        deleted = self.deleted
+        self.deleted = set()
+        if not self.con.in_transaction:
+            self.con.execute('BEGIN;')
+        try:
+            before = self.con.execute('SELECT COALESCE(MAX(seq), 0) FROM stationChanges;').fetchone()[0]
+            for serverId, names in incoming.items():
+                fields = self.client.stations.get(serverId)
+                if fields is None or 'callsign' not in fields:
+                    continue
+                self.con.execute('SAVEPOINT station;')
+                try:
+                    self.writeStation(serverId, names, normalFields(fields['callsign'], fields.get('name'),
+                        fields.get('ack'), fields.get('note')))
+                except sqlite3.IntegrityError as exception:
+                    self.con.execute('ROLLBACK TO station;')
+                    print('Station from the net server not written: ' + str(exception), file=sys.stderr)
+                    self.loadIds()
+                self.con.execute('RELEASE station;')
+            for serverId in deleted:
+                stationId = self.localIds.get(serverId)
+                if stationId is not None:
+                    self.con.execute('DELETE FROM stations WHERE rowid = ?;', (stationId,))
+                    self.unmapStation(stationId)
+            after = self.con.execute('SELECT COALESCE(MAX(seq), 0) FROM stationChanges;').fetchone()[0]
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            self.loadIds()
+            raise
+        if after > before:
+            self.ownChanges.append((before, after))
+
+    #A station the database does not have yet is matched by callsign to an
+    #unmatched local station, whose fields are then all replaced, or added.
+    #Rows that already hold the fields are not written, so a snapshot only
+    #touches the stations that differ.
+    def writeStation(self, serverId, names, fields):
+        stationId = self.localIds.get(serverId)
+        if stationId is None:
+            row = self.con.execute('SELECT rowid FROM stations WHERE callsign = ?;', (fields['callsign'],)).fetchone()
+            if row is None or row[0] in self.serverIds:
+                cursor = self.con.execute('INSERT INTO stations (callsign, name, ack, note) VALUES (?, ?, ?, ?);',
+                    (fields['callsign'], fields['name'], fields['ack'], fields['note']))
+                self.mapStation(cursor.lastrowid, serverId)
+                return
+            stationId = row[0]
+            self.mapStation(stationId, serverId)
+            names = FIELDS
+        self.con.execute('UPDATE stations SET ' + ', '.join(name + ' = ?' for name in names) + ' WHERE rowid = ? AND (' +
+            ' OR '.join(name + ' IS NOT ?' for name in names) + ');',
+            [fields[name] for name in names] + [stationId] + [fields[name] for name in names])
+
+    '''--------------------------------------------
+    Database to server
+    --------------------------------------------'''
+
+    #Send every station written or deleted by another connection since the
+    #last look. With nothing written this costs one pragma read.
+    def sendLocalChanges(self):
+        version = self.con.execute('PRAGMA data_version;').fetchone()[0]
+        if version == self.dataVersion:
+            return
+        self.dataVersion = version
+        changes = self.con.execute('SELECT MIN(seq), MAX(seq) FROM stationChanges;').fetchone()
+        if changes[1] is None or changes[1] <= self.watermark:
+            return
+        if changes[0] > self.watermark + 1:
+            #Some of the log was pruned before it was looked at
+            stationIds = set(row[0] for row in self.con.execute('SELECT rowid FROM stations;')) | set(self.serverIds)
+        else:
+            stationIds = set()
+            for seq, stationId in self.con.execute('SELECT seq, stationId FROM stationChanges WHERE seq > ? AND seq <= ?;',
+                    (self.watermark, changes[1])):
+                if not any(start < seq <= end for start, end in self.ownChanges):
+                    stationIds.add(stationId)
+        self.watermark = changes[1]
+        self.ownChanges = [(start, end) for start, end in self.ownChanges if end > self.watermark]
+        self.sendStations(list(stationIds))
+
+    #Send the stations never matched to one on the server
+    def sendUnmatched(self):
+        self.sendStations([row[0] for row in self.con.execute('SELECT rowid FROM stations WHERE rowid NOT IN '
+            '(SELECT stationId FROM serverStations WHERE server = ?);', (self.server,))])
+
+    #Stations no longer in the database are deleted on the server
+    def sendStations(self, stationIds):
+        for start in range(0, len(stationIds), CHUNK_SIZE):
+            chunk = stationIds[start:start + CHUNK_SIZE]
+            missing = set(chunk)
+            for row in self.con.execute('SELECT rowid, callsign, name, ack, note FROM stations WHERE rowid IN (' +
+                    ','.join('?' * len(chunk)) + ');', chunk):
+                missing.discard(row[0])
+                self.sendStation(row[0], normalFields(*row[1:]))
+            for stationId in missing:
+                if stationId in self.serverIds:
+                    self.sendDelete(stationId)
+
+    #Send the fields that differ from the server's copy, or the whole
+    #station if the server does not have it
+    def sendStation(self, stationId, fields):
+        serverId = self.serverIds.get(stationId)
+        if serverId is None:
+            self.sendInsert(stationId, fields)
+            return
+        known = self.client.stations.get(serverId, {})
+        for name in FIELDS:
+            if name not in known or normalFields(known.get('callsign'), known.get('name'), known.get('ack'),
+                    known.get('note'))[name] != fields[name]:
+                self.sendEdit(stationId, serverId, name, fields[name])
+
+    #A refused edit, e.g. a callsign another logger has, is put back to
+    #the server's value
+    def sendEdit(self, stationId, serverId, name, value):
+        def replied(future):
+            if not future.cancelled() and future.result()['op'] == 'error':
+                print('Net server refused an edit: ' + future.result()['message'], file=sys.stderr)
+                self.incoming.setdefault(serverId, set()).add(name)
+        self.client.edit(serverId, name, value).add_done_callback(replied)
+
+    #The match is dropped straight away. A station the server no longer
+    #has, e.g. one another logger deleted first, is refused and left at that.
+    def sendDelete(self, stationId):
+        serverId = self.serverIds[stationId]
+        self.unmapStation(stationId)
+        
+        def replied(future):
+            if not future.cancelled() and future.result()['op'] == 'error' and \
+                    not future.result()['message'].startswith('No station with id'):
+                print('Net server refused a delete: ' + future.result()['message'], file=sys.stderr)
+        self.client.delete(serverId).add_done_callback(replied)
+    
+    #The server's deltas for the new station usually come before the reply
+    #and match it by callsign. Fields edited while the insert was on its way
+    #are sent once it is matched.
+    def sendInsert(self, stationId, fields):
+        if stationId in self.inserting:
+            return
+        self.inserting.add(stationId)
+
+        def replied(future):
+            self.inserting.discard(stationId)
+            if future.cancelled():
+                return
+            reply = future.result()
+            if reply['op'] == 'error':
+                #Another logger added the same callsign first, and its
+                #deltas match this station to that one
+                if not reply['message'].startswith('Callsign already in use'):
+                    print('Net server refused ' + fields['callsign'].strip() + ': ' + reply['message'], file=sys.stderr)
+                return
+            if stationId not in self.serverIds:
+                self.mapStation(stationId, reply['id'])
+                self.con.commit()
+            self.sendStations([stationId])
+        self.client.request(dict(fields, op='insert')).add_done_callback(replied)
@@ -1,37 +1,468 @@
 import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-#A class to handle data persistence
+from journal import EditJournal
+
+#Seconds a connection waits for another one's write lock before failing
+BUSY_TIMEOUT = 10
+
+#Columns the edit journal may write, by table
+JOURNAL_COLUMNS = {
+    'stations': ('callsign', 'name', 'ack', 'note'),
+}
+
+#Triggers logging the rowid of every station inserted, updated or deleted,
+#so readers can catch up from a watermark instead of reloading the table
+STATION_CHANGE_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS stations_insert_log AFTER INSERT ON stations BEGIN INSERT INTO stationChanges (stationId) VALUES (new.rowid); END',
+    'CREATE TRIGGER IF NOT EXISTS stations_update_log AFTER UPDATE ON stations BEGIN INSERT INTO stationChanges (stationId) VALUES (new.rowid); END',
+    'CREATE TRIGGER IF NOT EXISTS stations_delete_log AFTER DELETE ON stations BEGIN INSERT INTO stationChanges (stationId) VALUES (old.rowid); END',
+]
+
+#Full text search over callsign, name and note. The index keeps no copy
+#of the text, it reads it from stations, and triggers keep it in step with
+#every write. Ack changes do not touch it. Prefixes of up to five
+#characters are indexed, so the short prefixes seen while a word is being
+#typed do not have to merge every matching term. Every statement can run
+#again, so checkSearchIndex can use them to repair the index.
+SEARCH_INDEX_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS stations_search_insert AFTER INSERT ON stations BEGIN "
+        "INSERT INTO stationSearch (rowid, callsign, name, note) VALUES (new.rowid, new.callsign, new.name, new.note); END",
+    "CREATE TRIGGER IF NOT EXISTS stations_search_delete AFTER DELETE ON stations BEGIN "
+        "INSERT INTO stationSearch (stationSearch, rowid, callsign, name, note) VALUES ('delete', old.rowid, old.callsign, old.name, old.note); END",
+    "CREATE TRIGGER IF NOT EXISTS stations_search_update AFTER UPDATE OF callsign, name, note ON stations BEGIN "
+        "INSERT INTO stationSearch (stationSearch, rowid, callsign, name, note) VALUES ('delete', old.rowid, old.callsign, old.name, old.note); "
+        "INSERT INTO stationSearch (rowid, callsign, name, note) VALUES (new.rowid, new.callsign, new.name, new.note); END",
+]
+
+SEARCH_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS stationSearch USING fts5(callsign, name, note, content='stations', content_rowid='rowid', prefix='1 2 3 4 5')",
+] + SEARCH_INDEX_TRIGGERS + [
+    "INSERT INTO stationSearch (stationSearch) VALUES ('rebuild')",
+]
+
+#Whether this build of SQLite has FTS5. Some distributions leave it out.
+def hasFullTextSearch(cur):
+    try:
+        cur.execute('CREATE VIRTUAL TABLE temp.fullTextProbe USING fts5(text);')
+        cur.execute('DROP TABLE temp.fullTextProbe;')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+#Schema migrations in order. Step n takes a database from user_version n
+#to n + 1. Steps are only ever appended; never edit one that has shipped.
+MIGRATIONS = [
+    #1: the original tables. Databases from before versioning already have
+    #them, so they are only created if missing.
+    [
+        'CREATE TABLE IF NOT EXISTS stations (callsign string, name string, note string, ack bool, CONSTRAINT callsign_unique UNIQUE (callsign))',
+        'CREATE TABLE IF NOT EXISTS scripts (name string, contents string, CONSTRAINT name_unique UNIQUE (name))',
+    ],
+    #2: change tracking for incremental refresh
+    [
+        'CREATE TABLE IF NOT EXISTS stationChanges (seq INTEGER PRIMARY KEY AUTOINCREMENT, stationId integer)',
+    ] + STATION_CHANGE_TRIGGERS,
+    #3: rebuild stations with TEXT columns. The old 'string' type gave the
+    #columns numeric affinity, which stops SQLite using the callsign index
+    #for GLOB/LIKE prefix searches. Rowids are kept so the change log stays
+    #valid. Also add a covering index so the paged ORDER BY callsign query
+    #is answered from the index alone.
+    [
+        'CREATE TABLE stations_new (callsign text, name text, note text, ack bool, CONSTRAINT callsign_unique UNIQUE (callsign))',
+        'INSERT INTO stations_new (rowid, callsign, name, note, ack) SELECT rowid, callsign, name, note, ack FROM stations',
+        'DROP TABLE stations',
+        'ALTER TABLE stations_new RENAME TO stations',
+    ] + STATION_CHANGE_TRIGGERS + [
+        'CREATE INDEX stations_page ON stations (callsign, name, ack, note)',
+    ],
+    #4: check-in history. checkins_callsign covers the "seen before"
+    #questions (exists, how many times, last name given) so they are
+    #answered from the index without touching the table.
+    [
+        'CREATE TABLE nets (id INTEGER PRIMARY KEY, name text, started text)',
+        'CREATE TABLE checkins (id INTEGER PRIMARY KEY, netId integer REFERENCES nets (id), callsign text, name text, checkedIn text)',
+        'CREATE UNIQUE INDEX checkins_net ON checkins (netId, callsign)',
+        'CREATE INDEX checkins_callsign ON checkins (callsign, checkedIn, netId, name)',
+    ],
+    #5: names from external callsign databases, and how far each import
+    #file has got so an interrupted import can resume
+    [
+        'CREATE TABLE callbook (callsign text PRIMARY KEY, name text, source text) WITHOUT ROWID',
+        'CREATE TABLE imports (source text PRIMARY KEY, size integer, modified real, offset integer, rows integer, finished integer)',
+    ],
+    #6: ids the stations have on each net server this database is kept in
+    #step with, see netSync.py
+    [
+        'CREATE TABLE serverStations (server text, serverId integer, stationId integer, '
+            'PRIMARY KEY (server, stationId), UNIQUE (server, serverId))',
+    ],
+    #7: full text search, see SEARCH_INDEX
+    SEARCH_INDEX,
+]
+
+#The worker thread's own connection. Operations queued with
+#Persist.submit() get one of these, and since it has the same cur and con
+#attributes as Persist the objects' writeToDatabase methods accept either.
+class writeConnection:
+    
+    def __init__(self, path):
+        self.con = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.cur = self.con.cursor()
+
+#A class to handle data persistence.
+#
+#Edits are written behind: callers mark objects dirty with markDirty() and
+#flush() writes every pending object in a single transaction. Crash safety:
+#a crash or power cut loses at most the edits made since the last flush, and
+#because each flush is one transaction the database holds either all of a
+#flushed batch or none of it, never a partially written one. The one
+#exception is an object that breaks a constraint: it is rolled back and
+#dropped on its own so it cannot fail every later flush. tests/test_persist.py
+#covers these cases.
+#
+#Writes run on a single database worker thread with its own connection, so
+#a slow disk never stalls the UI. Operations are queued with submit() and
+#run in order; each returns a future. cur and con are the synchronous read
+#path for the thread that created the Persist, and with the database in WAL
+#mode those reads are not blocked by the worker's writes.
+#
+#With an edit journal (opt-in), flushed edits to existing rows of objects
+#with journalFields() are appended to the journal rather than written to
+#their rows. Only the fields that changed since the last flush are
+#recorded. Once the journal grows past journalLimit bytes it is compacted:
+#the latest value of each field is written to the database in one
+#transaction and the journal is emptied. Compaction also runs on startup,
+#which replays whatever a crash left in the journal before the constructor
+#returns, and on close.
 class Persist:
     
-    #Constructor sets up a connection and checks the database structure.
-    def __init__(self, path="dev.db"):
+    #Constructor sets up a connection and migrates the database structure.
+    #flushInterval is the idle time in milliseconds after which the UI
+    #should flush pending edits. journalPath turns on the edit journal.
+    def __init__(self, path="dev.db", flushInterval=2000, journalPath=None, journalLimit=262144):
         self.path = path
-        self.con = sqlite3.connect(self.path)
+        self.con = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
         self.cur = self.con.cursor()
+        self.flushInterval = flushInterval
         
-        self.stationTableCreate = 'CREATE TABLE stations (callsign string, name string, note string, ack bool, CONSTRAINT callsign_unique UNIQUE (callsign))'
+        #Objects with unsaved edits, in the order they were first marked.
+        #The worker puts objects back here when a write fails, so it is only
+        #changed under dirtyLock.
+        self.dirty = {}
+        self.dirtyLock = threading.Lock()
+        #Objects handed to the worker whose writes have not finished yet,
+        #with the number of flushes they are queued in
+        self.inFlight = {}
+        self.inFlightLock = threading.Lock()
         
-        self.scriptTableCreate = 'CREATE TABLE scripts (name string, contents string, CONSTRAINT name_unique UNIQUE (name))'
+        self.fullTextSearch = hasFullTextSearch(self.cur)
+        self.migrate()
+        self.checkSearchIndex()
+        #The pragma returns a row; fetch it so the statement does not stay
+        #active and hold a lock the worker's first write would wait on
+        self.cur.execute('PRAGMA journal_mode = WAL;').fetchone()
         
-        self.checkDatabaseStructure()
+        #The worker opens its connection when it starts
+        self.writer = None
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database',
+            initializer=self.openWriter)
         
-    #Check one table against its create statement
-    def checkTableStructure(self, name, desiredStructure):
-        self.cur.execute("SELECT sql FROM sqlite_master WHERE name = ?", (name,))
-        currentTableStructure = self.cur.fetchone()
-        if currentTableStructure is None or currentTableStructure[0] != desiredStructure:
-            self.cur.execute("SELECT COUNT(sql) FROM sqlite_master WHERE name = ?", (name,))
-            if self.cur.fetchone()[0] > 0:
-                self.cur.execute("DROP TABLE "+name+";")
+        self.journal = None
+        self.journalLimit = journalLimit
+        #Objects whose latest edits are in the journal but not yet in the
+        #database, and the field values last journaled for each row
+        self.journaled = {}
+        self.journalValues = {}
+        if journalPath is not None:
+            self.journal = EditJournal(journalPath)
+            #Readers of cur must see what the journal held, so wait for it
+            self.submit(self.compactJournal).result()
+    
+    #Bring the schema up to date. PRAGMA user_version holds the number of
+    #migration steps already applied, so an up to date database costs a
+    #single pragma read. Each step runs in its own transaction together
+    #with the version bump, so an interrupted upgrade leaves the database
+    #at the previous version rather than half migrated.
+    def migrate(self):
+        version = self.cur.execute('PRAGMA user_version;').fetchone()[0]
+        for step in range(version, len(MIGRATIONS)):
+            statements = MIGRATIONS[step]
+            #Without FTS5 the search index is left out; checkSearchIndex
+            #builds it once the database is opened by a build that has it
+            if statements is SEARCH_INDEX and not self.fullTextSearch:
+                statements = []
+            try:
+                self.cur.execute('BEGIN;')
+                for statement in statements:
+                    self.cur.execute(statement)
+                self.cur.execute('PRAGMA user_version = ' + str(step + 1) + ';')
                 self.con.commit()
-            self.cur.execute(desiredStructure)
+            except Exception:
+                self.con.rollback()
+                raise
+            print('Migrated database to version ' + str(step + 1))
+    
+    #Make the full text index fit this build of SQLite. Without FTS5 its
+    #triggers would fail every write to stations, so they are dropped and
+    #StationList.textSearch falls back to scanning the table. With FTS5, an
+    #index that is missing or lost its triggers that way is built again
+    #from the stations table.
+    def checkSearchIndex(self):
+        if self.cur.execute('PRAGMA user_version;').fetchone()[0] < MIGRATIONS.index(SEARCH_INDEX) + 1:
+            return
+        triggers = self.cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND "
+            "name LIKE 'stations_search_%';").fetchone()[0]
+        if self.fullTextSearch and triggers < len(SEARCH_INDEX_TRIGGERS):
+            statements = SEARCH_INDEX
+        elif not self.fullTextSearch and triggers:
+            statements = ['DROP TRIGGER IF EXISTS ' + name for name in
+                ('stations_search_insert', 'stations_search_delete', 'stations_search_update')]
+        else:
+            return
+        try:
+            self.cur.execute('BEGIN;')
+            for statement in statements:
+                self.cur.execute(statement)
             self.con.commit()
-            print('Reset table: ' + name)
-        
-    #Use the previous method to check all required tables
-    def checkDatabaseStructure(self):
-        self.checkTableStructure('stations', self.stationTableCreate)
-        self.checkTableStructure('scripts', self.scriptTableCreate)
+        except Exception:
+            self.con.rollback()
+            raise
+    
+    #Counter that changes whenever another connection commits to the
+    #database. Reading it is the cheapest way to ask whether anything
+    #needs to be refreshed.
+    def dataVersion(self):
+        return self.cur.execute('PRAGMA data_version;').fetchone()[0]
+    
+    #Highest change sequence number logged so far
+    def latestChange(self):
+        return self.cur.execute('SELECT COALESCE(MAX(seq), 0) FROM stationChanges;').fetchone()[0]
+    
+    #Delete all but the newest keep entries of the change log. Readers whose
+    #watermark falls behind the pruned range fall back to a full reload.
+    def pruneChanges(self, keep=10000):
+        return self.submit(self.deleteOldChanges, keep)
+    
+    def deleteOldChanges(self, writer, keep):
+        writer.cur.execute('DELETE FROM stationChanges WHERE seq <= (SELECT MAX(seq) FROM stationChanges) - ?;', (keep,))
+    
+    '''--------------------------------------------
+    Database worker
+    --------------------------------------------'''
+    
+    #Runs on the worker thread when it starts
+    def openWriter(self):
+        self.writer = writeConnection(self.path)
+    
+    #Queue operation(writer, *args) to run on the worker thread, where
+    #writer is the worker's connection. Its statements are committed when
+    #it returns and rolled back if it raises. Returns a future for the
+    #operation's result.
+    def submit(self, operation, *args):
+        return self.worker.submit(self.runOperation, operation, args)
+    
+    def runOperation(self, operation, args):
+        try:
+            result = operation(self.writer, *args)
+            self.writer.con.commit()
+        except Exception:
+            self.writer.con.rollback()
+            raise
+        return result
+    
+    #Block until everything queued so far has been written
+    def wait(self):
+        self.submit(lambda writer: None).result()
+    
+    #Flush pending edits, fold the journal into the database, wait for the
+    #worker to finish and stop it
+    def close(self):
+        self.flush()
+        if self.journal is not None:
+            self.submit(self.compactJournal)
+        self.worker.shutdown(wait=True)
+        if self.journal is not None:
+            self.journal.close()
+    
+    '''--------------------------------------------
+    Write-behind of edited objects
+    --------------------------------------------'''
        
-    def loadFromDatabase(self):
-        pass
\ No newline at end of file
+    #Queue an object with a writeToDatabase method for the next flush
+    def markDirty(self, obj):
+        with self.dirtyLock:
+            self.dirty[obj] = True
+    
+    #Drop an object's unsaved edits, e.g. a new object that could not be
+    #written and is being discarded
+    def discard(self, obj):
+        with self.dirtyLock:
+            self.dirty.pop(obj, None)
+    
+    #True if an object has edits that are not in the database yet, either
+    #waiting for the next flush, queued on the worker or in the journal
+    def isDirty(self, obj):
+        return obj in self.dirty or obj in self.inFlight or obj in self.journaled
+    
+    #Every object with edits that are not in the database yet. Copying the
+    #dicts runs without releasing the GIL, so the worker cannot change them
+    #part way through.
+    def pendingObjects(self):
+        with self.dirtyLock:
+            dirty = set(self.dirty)
+        return dirty | set(self.inFlight) | set(self.journaled)
+    
+    #Queue all pending objects to be written in one transaction on the
+    #worker. Returns the future of the write, or None if nothing was
+    #pending. The future's result is a list of (object, exception) for
+    #objects rejected by a constraint, e.g. a callsign another station
+    #already has. Those are rolled back on their own and dropped, so the
+    #rest of the batch still commits. If the write fails for any other
+    #reason the whole batch is rolled back and marked dirty again for the
+    #next attempt.
+    #
+    #The worker reads the objects' fields when it writes them, so an object
+    #edited in the meantime is written with its newer values; it is marked
+    #dirty again by that edit and written once more by the next flush.
+    def flush(self):
+        if not self.dirty:
+            return None
+        with self.dirtyLock:
+            pending = list(self.dirty)
+            self.dirty = {}
+        with self.inFlightLock:
+            for obj in pending:
+                self.inFlight[obj] = self.inFlight.get(obj, 0) + 1
+        return self.submit(self.writeObjects, pending)
+    
+    #Runs on the worker. Objects are written in the order they were marked,
+    #so one inserted earlier in the batch has its id before anything that
+    #refers to it is written.
+    def writeObjects(self, writer, pending):
+        inserted = [obj for obj in pending if obj.id is None]
+        entries = []
+        journaled = []
+        rejected = []
+        try:
+            #Begin explicitly so releasing the first savepoint does not
+            #commit it on its own
+            if not writer.con.in_transaction:
+                writer.cur.execute('BEGIN;')
+            for obj in pending:
+                if self.journal is not None and obj.id is not None and hasattr(obj, 'journalFields'):
+                    fields = obj.journalFields()
+                    entry = self.journalEntry(obj, fields)
+                    if entry is not None:
+                        entries.append(entry)
+                        journaled.append((obj, fields))
+                else:
+                    exception = self.writeObject(writer, obj)
+                    if exception is not None:
+                        rejected.append((obj, exception))
+            #The journal record goes first; if it cannot be written the
+            #database writes are rolled back with it
+            if entries:
+                self.journal.append(entries)
+            writer.con.commit()
+            #Only now are the journaled values known to be on disk, so a
+            #failed append is journaled again by the retry
+            for obj, fields in journaled:
+                self.journalValues[(obj.JOURNAL_TABLE, obj.id)] = fields
+            with self.inFlightLock:
+                for obj, fields in journaled:
+                    self.journaled[obj] = True
+        except Exception:
+            writer.con.rollback()
+            for obj in inserted:
+                obj.id = None
+            with self.dirtyLock:
+                for obj in pending:
+                    self.dirty.setdefault(obj, True)
+            raise
+        finally:
+            with self.inFlightLock:
+                for obj in pending:
+                    count = self.inFlight[obj] - 1
+                    if count == 0:
+                        del self.inFlight[obj]
+                    else:
+                        self.inFlight[obj] = count
+        if self.journal is not None and self.journal.size > self.journalLimit:
+            try:
+                self.compactJournal(writer)
+            except Exception as exception:
+                #The journal is kept, so nothing is lost; try again later
+                writer.con.rollback()
+                print('Journal compaction failed: ' + repr(exception), file=sys.stderr)
+        for obj, exception in rejected:
+            print('Edit rejected by the database: ' + repr(exception), file=sys.stderr)
+        return rejected
+    
+    #Runs on the worker. Write one object inside a savepoint and return
+    #None, or roll back just that object and return the exception if it
+    #breaks a constraint.
+    def writeObject(self, writer, obj):
+        writer.cur.execute('SAVEPOINT object;')
+        try:
+            obj.writeToDatabase(writer)
+        except sqlite3.IntegrityError as exception:
+            writer.cur.execute('ROLLBACK TO object;')
+            writer.cur.execute('RELEASE object;')
+            return exception
+        writer.cur.execute('RELEASE object;')
+        return None
+    
+    '''--------------------------------------------
+    Edit journal
+    --------------------------------------------'''
+    
+    #Journal entry for the fields of an object changed since they were
+    #last journaled, or None if nothing changed. journalValues is updated
+    #by the caller once the entry is on disk.
+    def journalEntry(self, obj, fields):
+        last = self.journalValues.get((obj.JOURNAL_TABLE, obj.id), {})
+        changed = {name: value for name, value in fields.items() if name not in last or last[name] != value}
+        if not changed:
+            return None
+        return [obj.JOURNAL_TABLE, obj.id, changed]
+    
+    #Runs on the worker. Write the latest value of every journaled field
+    #to the database in one transaction, then empty the journal. Replaying
+    #a journal twice gives the same result, so a crash between the commit
+    #and the reset is harmless.
+    #
+    #A journaled value the database rejects, e.g. a callsign another
+    #station already has, is dropped on its own so it cannot stop every
+    #later compaction; the row's other fields are still written.
+    def compactJournal(self, writer):
+        if not writer.con.in_transaction:
+            writer.cur.execute('BEGIN;')
+        for (table, rowid), fields in self.journal.latestValues().items():
+            names = [name for name in sorted(fields) if name in JOURNAL_COLUMNS.get(table, ())]
+            if names and self.updateFields(writer, table, rowid, names, fields) is not None:
+                for name in names:
+                    exception = self.updateFields(writer, table, rowid, [name], fields)
+                    if exception is not None:
+                        print('Journaled edit rejected by the database: ' + repr(exception), file=sys.stderr)
+        writer.con.commit()
+        self.journal.reset()
+        self.journalValues = {}
+        with self.inFlightLock:
+            self.journaled = {}
+    
+    #Update some fields of one row inside a savepoint. Returns None, or
+    #the exception if the row breaks a constraint and was rolled back.
+    def updateFields(self, writer, table, rowid, names, fields):
+        writer.cur.execute('SAVEPOINT row;')
+        try:
+            writer.cur.execute('UPDATE ' + table + ' SET ' + ', '.join(name + ' = ?' for name in names) +
+                ' WHERE rowid = ?;', [fields[name] for name in names] + [rowid])
+        except sqlite3.IntegrityError as exception:
+            writer.cur.execute('ROLLBACK TO row;')
+            writer.cur.execute('RELEASE row;')
+            return exception
+        writer.cur.execute('RELEASE row;')
+        return None
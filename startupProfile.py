@@ -0,0 +1,59 @@
+"""
+This module records where the time goes between launching the process and
+the main window becoming usable. Setting NETSCRIBE_STARTUP_PROFILE runs
+the application as usual and prints the phases of its startup to stderr
+once the first frame with the station list in it has been drawn:
+
+    NETSCRIBE_STARTUP_PROFILE=1 python main.py
+
+Marks are only stored when profiling is on, so it costs a dictionary
+lookup per mark otherwise. Import it before anything else so the time
+spent importing the other modules is included.
+"""
+
+import os
+import sys
+import time
+
+enabled = bool(os.environ.get('NETSCRIBE_STARTUP_PROFILE'))
+
+#(phase, time.perf_counter()) in the order they were reached
+marks = []
+
+#Seconds the process had been running before this module was imported,
+#from the process start time the kernel keeps. None where that is not
+#available, in which case the profile starts at the import.
+def secondsSinceLaunch():
+    try:
+        with open('/proc/self/stat') as f:
+            #The command name can contain spaces, so split after it
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def mark(phase):
+    if enabled:
+        marks.append((phase, time.perf_counter()))
+
+if enabled:
+    launched = secondsSinceLaunch()
+    marks.append(('imports started', time.perf_counter()))
+    if launched is not None:
+        marks.insert(0, ('process launched', marks[0][1] - launched))
+
+#Print each phase with the time since launch and since the previous phase
+def report(file=sys.stderr):
+    if not enabled or not marks:
+        return
+    start = marks[0][1]
+    previous = start
+    print('Startup profile, milliseconds', file=file)
+    print('{:>10} {:>10}  {}'.format('total', 'phase', 'reached'), file=file)
+    for phase, when in marks:
+        print('{:10.1f} {:10.1f}  {}'.format((when - start) * 1000, (when - previous) * 1000, phase),
+            file=file)
+        previous = when
+    file.flush()
@@ -0,0 +1,41 @@
+"""
+Snapshots taken by backup.py while the edit journal is on include the
+edits that are still only in the journal.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station
+import backup
+
+def test_snapshot_includes_journaled_edits(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'), journalPath=str(tmp_path / 'edits.journal'))
+    station = Station(' W3LOR', 'LORI')
+    p.markDirty(station)
+    p.flush().result()
+    station.name = 'LORRAINE'
+    p.markDirty(station)
+    p.flush().result()
+    assert p.cur.execute('SELECT name FROM stations;').fetchone()[0] == 'LORI'
+    
+    taken = threading.Event()
+    service = backup.BackupService(p.path, str(tmp_path / 'backups'), interval=0.001,
+        onSnapshot=lambda path: taken.set(), prepare=lambda: p.submit(p.compactJournal).result())
+    service.start()
+    try:
+        assert taken.wait(10)
+    finally:
+        service.stop()
+    p.close()
+    
+    con = sqlite3.connect(service.lastSnapshot)
+    try:
+        assert con.execute('SELECT name FROM stations;').fetchone()[0] == 'LORRAINE'
+    finally:
+        con.close()
@@ -0,0 +1,128 @@
+"""
+Callsign structure in callsigns.py and the callsign editor built on it:
+the prefix trie resolves the longest allocated prefix, callsigns parse and
+justify the way the database stores them, and typing into callsignEdit
+lays the parts out as the prefix resolves.
+"""
+
+import os
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtCore import QEvent, Qt
+
+from callsigns import resolvePrefix, canBegin, startsPrefix, parseCallsign
+from customWidgets import callsignEdit
+
+#The longest allocated prefix wins, including the DXCC prefixes listed
+#after the ITU series they fall in and every prefix of a range
+def test_resolve_prefix():
+    assert resolvePrefix('W3LOR') == (1, 'United States')
+    assert resolvePrefix('KH6ABC') == (3, 'Hawaii')
+    assert resolvePrefix('UA9ABC') == (3, 'Asiatic Russia')
+    assert resolvePrefix('UA2ABC') == (3, 'Kaliningrad')
+    assert resolvePrefix('3DA0RU') == (3, 'Eswatini')
+    assert resolvePrefix('3DM0RU') == (3, 'Eswatini')
+    assert resolvePrefix('3DN0RU') == (3, 'Fiji')
+    assert resolvePrefix('4X4ABC') == (2, 'Israel')
+    assert resolvePrefix('QW3LOR') == (0, None)
+    assert resolvePrefix('') == (0, None)
+
+#canBegin accepts anything on the way to an allocated prefix or past one;
+#startsPrefix only paths through the trie, so a numeral after a prefix
+#fails it unless an allocation continues with that digit
+def test_prefix_continuations():
+    assert canBegin('')
+    assert canBegin('3D')
+    assert canBegin('W3LOR')
+    assert not canBegin('Q')
+    assert startsPrefix('E2')
+    assert startsPrefix('KH6')
+    assert not startsPrefix('W3')
+    assert not startsPrefix('Q')
+
+@pytest.mark.parametrize('text, justified, valid, entity', [
+    ('W3LOR', ' W3LOR', True, 'United States'),
+    (' w3lor', ' W3LOR', True, 'United States'),
+    ('KU0L', 'KU0L  ', True, 'United States'),
+    ('3DA0RU', '3DA0RU ', True, 'Eswatini'),
+    ('VE3/W3LOR', 'VE3/W3LOR', True, 'Canada'),
+    ('F/G4ABC', 'F/G4ABC', True, 'France'),
+    ('G4ABC/P', 'G4ABC/P', True, 'England'),
+    ('G4ABC/MM', 'G4ABC/MM', True, None),
+    ('G4ABC/X', 'G4ABC/X', False, 'England'),
+    ('W3', ' W3   ', False, 'United States'),
+    ('QW3LOR', 'QW3LOR', False, None),
+])
+def test_parse_and_justify(text, justified, valid, entity):
+    callsign = parseCallsign(text)
+    assert callsign.justified() == justified
+    assert callsign.isValid() == valid
+    assert callsign.entity() == entity
+    #Justified text parses back to the same callsign
+    assert parseCallsign(justified).justified() == justified
+
+@pytest.fixture(scope='module')
+def app():
+    return QApplication.instance() or QApplication([])
+
+def typed(keys, edit=None):
+    if edit is None:
+        edit = callsignEdit()
+    for key in keys:
+        edit.handleInput(QKeyEvent(QEvent.KeyPress, 0, Qt.NoModifier, key))
+    return edit
+
+#Each key rebuilds the text from the parts: digits join the prefix only
+#while an allocation continues with them, letters that cannot start a
+#prefix are refused, and a stroke starts a location prefix or designator
+@pytest.mark.parametrize('keys, text', [
+    ('w3lor', ' W3LOR'),
+    ('3DA0RU', '3DA0RU '),
+    ('E21ABC', 'E21ABC'),
+    ('4X4ABC', '4X4ABC'),
+    ('QW3LOR', ' W3LOR'),
+    ('KH6ABCDE', 'KH6ABCD'),
+    ('W31LOR', ' W1LOR'),
+    ('G4ABC/P', 'G4ABC/P'),
+    ('VE3/W3LOR', 'VE3/W3LOR'),
+    ('F/G4ABC', 'F/G4ABC'),
+    ('QQ/', ''),
+])
+def test_typing(app, keys, text):
+    edit = typed(keys)
+    assert edit.text() == text
+    assert edit.cursorPos == len(text.rstrip())
+
+#Typing over a callsign set from outside replaces the character under the
+#cursor within its part
+def test_typing_over_a_callsign(app):
+    edit = callsignEdit()
+    edit.setText(' W3LOR')
+    edit.cursorPos = 1
+    assert typed('K', edit).text() == ' K3LOR'
+    edit.cursorPos = 3
+    assert typed('X', edit).text() == ' K3XOR'
+    assert edit.cursorPos == 4
+
+#Delete closes up the part around the cursor; deleting the stroke drops
+#the designator it introduced
+def test_delete(app):
+    edit = typed('W3LOR')
+    edit.cursorPos = 3
+    edit.handleDelete()
+    assert edit.text() == ' W3OR '
+    assert edit.cursorPos == 3
+    edit = typed('G4ABC/P')
+    edit.cursorPos = 5
+    edit.handleDelete()
+    assert edit.text() == ' G4ABC'
+    edit = typed('VE3/W3LOR')
+    edit.cursorPos = 3
+    edit.handleDelete()
+    assert edit.text() == ' W3LOR'
@@ -0,0 +1,159 @@
+"""
+Streaming import of callsign databases in importer.py: the FCC, CSV and
+ADIF parsers, and imports that are interrupted and resumed from the offset
+committed with the last chunk.
+"""
+
+import io
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+import importer
+
+#Synthetic calls with allocated prefixes, K1AAA onwards
+def callsigns(count):
+    return ['K1' + chr(ord('A') + n // 676) + chr(ord('A') + n // 26 % 26) + chr(ord('A') + n % 26)
+        for n in range(count)]
+
+def fccFile(count):
+    lines = [b'HD|1|||K0ZZZ|header record, skipped\r\n']
+    for n, callsign in enumerate(callsigns(count)):
+        lines.append('EN|{0}|||{1}|L|{0}|SMITH, NAME{0}|NAME{0}|A|SMITH|||||\r\n'.format(n, callsign).encode())
+    return b''.join(lines)
+
+def csvFile(count):
+    lines = ['﻿First_Name,Call,Town\r\n'.encode('utf-8')]
+    for n, callsign in enumerate(callsigns(count)):
+        lines.append('"Name{0}, Jr",{1},Town\r\n'.format(n, callsign).encode())
+    return b''.join(lines)
+
+def adifFile(count):
+    parts = [b'Log exported for testing <ADIF_VER:5>3.1.0 <PROGRAMID:4>TEST\n<EOH>\n']
+    for n, callsign in enumerate(callsigns(count)):
+        name = 'NAME{0}'.format(n)
+        parts.append('<call:{0}:S>{1} <NAME:{2}>{3} <QSO_DATE:8>20240101 <eor>\n'.format(
+            len(callsign), callsign, len(name), name).encode())
+    #A record with no call is skipped
+    parts.append(b'<NAME:4>NONE <EOR>\n')
+    return b''.join(parts)
+
+FILES = {'fcc': fccFile, 'csv': csvFile, 'adif': adifFile}
+
+#The callbook as a whole import of a file leaves it. CSV names keep their
+#suffix.
+def names(kind, count):
+    return {importer.justifyCallsign(callsign): 'NAME' + str(n) + (', JR' if kind == 'csv' else '')
+        for n, callsign in enumerate(callsigns(count))}
+
+def parse(kind, data, offset=0):
+    f = io.BytesIO(data)
+    if kind == 'csv':
+        header, headerEnd = importer.readCsvHeader(f)
+        offset = max(offset, headerEnd)
+        f.seek(offset)
+        return list(importer.parseCsv(f, offset, header))
+    f.seek(offset)
+    if kind == 'fcc':
+        return list(importer.parseFcc(f, offset))
+    return list(importer.parseAdif(f, offset))
+
+#Every record is read, and parsing again from the offset after any record
+#gives exactly the records after it
+@pytest.mark.parametrize('kind', sorted(FILES))
+def test_parser_records_and_offsets(kind):
+    data = FILES[kind](40)
+    records = parse(kind, data)
+    assert [callsign for callsign, name, offset in records] == callsigns(40)
+    if kind == 'csv':
+        assert records[0][1] == 'Name0, Jr'
+    else:
+        assert records[0][1] == 'NAME0'
+    for i in (0, 7, 39):
+        assert parse(kind, data, records[i][2]) == records[i + 1:]
+
+#ADIF tags and values split across read blocks, at every place a block
+#can end, give the same records and offsets as one big block
+def test_adif_fields_split_across_blocks(monkeypatch):
+    data = adifFile(30)
+    whole = parse('adif', data)
+    for size in range(1, 40):
+        monkeypatch.setattr(importer, 'ADIF_BLOCK_SIZE', size)
+        assert parse('adif', data) == whole, size
+
+@pytest.fixture
+def p(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    yield p
+    p.close()
+
+def callbook(p):
+    return dict(p.cur.execute('SELECT callsign, name FROM callbook;').fetchall())
+
+class interrupted(Exception):
+    pass
+
+#Stop an import after a number of chunks have been committed
+def stopAfter(chunks):
+    def progress(rows, done, total, rowsPerSecond, finished=False):
+        progress.chunks = progress.chunks + 1
+        if progress.chunks == chunks:
+            raise interrupted()
+    progress.chunks = 0
+    return progress
+
+#An import stopped part way through resumes after the last committed chunk.
+#Nothing is imported twice or left out.
+@pytest.mark.parametrize('kind', sorted(FILES))
+def test_interrupted_import_resumes(p, tmp_path, kind):
+    path = str(tmp_path / ('import.' + kind))
+    with open(path, 'wb') as f:
+        f.write(FILES[kind](1000))
+    
+    with pytest.raises(interrupted):
+        importer.importFile(p, kind, path, chunkSize=300, progress=stopAfter(2))
+    assert len(callbook(p)) == 600
+    assert p.cur.execute('SELECT rows, finished FROM imports;').fetchone() == (600, 0)
+    
+    assert importer.importFile(p, kind, path, chunkSize=300) == 400
+    assert callbook(p) == names(kind, 1000)
+    assert p.cur.execute('SELECT rows, finished FROM imports;').fetchone() == (1000, 1)
+    #A finished import is not run again
+    assert importer.importFile(p, kind, path, chunkSize=300) == 0
+
+#An import that fails inside a chunk leaves that chunk out of the offset, and
+#the run that resumes reads it again
+def test_failure_inside_a_chunk(p, tmp_path, monkeypatch):
+    path = str(tmp_path / 'import.adif')
+    with open(path, 'wb') as f:
+        f.write(adifFile(1000))
+    justify = importer.justifyCallsign
+    def failing(callsign):
+        if callsign == callsigns(1000)[450]:
+            raise interrupted()
+        return justify(callsign)
+    monkeypatch.setattr(importer, 'justifyCallsign', failing)
+    with pytest.raises(interrupted):
+        importer.importFile(p, 'adif', path, chunkSize=300)
+    assert len(callbook(p)) == 300
+    
+    monkeypatch.setattr(importer, 'justifyCallsign', justify)
+    assert importer.importFile(p, 'adif', path, chunkSize=300) == 700
+    assert callbook(p) == names('adif', 1000)
+
+#A file that changed since the interrupted run is imported from the start
+def test_changed_file_starts_again(p, tmp_path):
+    path = str(tmp_path / 'import.fcc')
+    with open(path, 'wb') as f:
+        f.write(fccFile(1000))
+    with pytest.raises(interrupted):
+        importer.importFile(p, 'fcc', path, chunkSize=300, progress=stopAfter(1))
+    with open(path, 'wb') as f:
+        f.write(fccFile(500))
+    assert importer.importFile(p, 'fcc', path, chunkSize=300) == 500
+    assert p.cur.execute('SELECT rows, finished FROM imports;').fetchone() == (500, 1)
@@ -0,0 +1,51 @@
+"""
+The edit journal in journal.py: a record torn by a crash, or damaged, is
+cut off when the journal is opened, so records appended afterwards are
+read back.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import EditJournal
+
+def batch(n):
+    return [['stations', n, {'name': 'NAME ' + str(n)}]]
+
+def test_torn_tail_is_cut_off(tmp_path):
+    path = str(tmp_path / 'edits.journal')
+    journal = EditJournal(path)
+    journal.append(batch(1))
+    journal.append(batch(2))
+    journal.close()
+    good = os.path.getsize(path)
+    #A crash part way through writing a third record
+    with open(path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00\x12\x34\x56\x78[["stat')
+    
+    journal = EditJournal(path)
+    assert journal.size == good
+    assert os.path.getsize(path) == good
+    journal.append(batch(3))
+    journal.close()
+    assert list(EditJournal(path).records()) == [batch(1), batch(2), batch(3)]
+
+def test_damaged_record_and_the_rest_are_cut_off(tmp_path):
+    path = str(tmp_path / 'edits.journal')
+    journal = EditJournal(path)
+    journal.append(batch(1))
+    good = journal.size
+    journal.append(batch(2))
+    journal.append(batch(3))
+    journal.close()
+    with open(path, 'r+b') as f:
+        f.seek(good + 10)
+        f.write(b'X')
+    
+    journal = EditJournal(path)
+    assert journal.size == good
+    journal.append(batch(4))
+    journal.close()
+    assert list(EditJournal(path).records()) == [batch(1), batch(4)]
@@ -0,0 +1,105 @@
+"""
+Schema migrations in persist.py, run on a database laid out the way the
+application created it before versioning: the stations and scripts tables
+that checkTableStructure dropped and created again, with data in them.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import persist
+from persist import Persist, MIGRATIONS
+from dataStructures import Station, StationList
+
+BASELINE_TABLES = [
+    'CREATE TABLE stations (callsign string, name string, note string, ack bool, CONSTRAINT callsign_unique UNIQUE (callsign))',
+    'CREATE TABLE scripts (name string, contents string, CONSTRAINT name_unique UNIQUE (name))',
+]
+
+BASELINE_STATIONS = [
+    (' K7JWF', 'Jesse', '', 1),
+    ('KU0L  ', 'Kevin', 'Announcement', 1),
+    ('KC7ZZB', 'HAL', 'WINLINK NET REPORT', 0),
+    (' W3LOR', 'LORI', None, 0),
+]
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'baseline.db')
+    con = sqlite3.connect(path)
+    for statement in BASELINE_TABLES:
+        con.execute(statement)
+    con.executemany('INSERT INTO stations (callsign, name, note, ack) VALUES (?, ?, ?, ?);', BASELINE_STATIONS)
+    #A gap in the rowids, as left by a deleted station
+    con.execute("DELETE FROM stations WHERE callsign = 'KU0L  ';")
+    con.execute("INSERT INTO stations (callsign, name, note, ack) VALUES ('KU0L  ', 'Kevin', 'Announcement', 1);")
+    con.execute("INSERT INTO scripts (name, contents) VALUES ('A script to read', 'Good evening');")
+    con.commit()
+    con.close()
+    return path
+
+def rows(path, query):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute(query).fetchall()
+    finally:
+        con.close()
+
+def schema(path):
+    return rows(path, 'SELECT type, name, sql FROM sqlite_master ORDER BY name;')
+
+def test_baseline_database_migrates_with_its_rows(path, capsys):
+    before = rows(path, 'SELECT rowid, callsign, name, note, ack FROM stations ORDER BY rowid;')
+    p = Persist(path)
+    p.close()
+    output = capsys.readouterr().out
+    assert 'Migrated database to version ' + str(len(MIGRATIONS)) in output
+    assert 'Reset table' not in output
+    
+    assert rows(path, 'PRAGMA user_version;') == [(len(MIGRATIONS),)]
+    assert rows(path, 'SELECT rowid, callsign, name, note, ack FROM stations ORDER BY rowid;') == before
+    assert rows(path, 'SELECT name, contents FROM scripts;') == [('A script to read', 'Good evening')]
+    #Migration 3 rebuilt the table with TEXT columns
+    assert 'callsign text' in rows(path, "SELECT sql FROM sqlite_master WHERE name = 'stations';")[0][0]
+    assert rows(path, "SELECT name FROM sqlite_master WHERE name = 'stations_page';") == [('stations_page',)]
+    
+    #The migrated database works: the change log and the search index
+    #follow writes, and the stations load
+    p = Persist(path)
+    station = Station(id=rows(path, "SELECT rowid FROM stations WHERE callsign = 'KC7ZZB';")[0][0])
+    station.loadFromDatabase(p)
+    station.name = 'HAROLD'
+    p.markDirty(station)
+    p.flush().result()
+    assert rows(path, 'SELECT stationId FROM stationChanges;') == [(station.id,)]
+    stations = StationList(p)
+    assert [found.callsign for found in stations.textSearch(p, 'harold')] == ['KC7ZZB']
+    assert [found.callsign for found in stations.textSearch(p, 'winlink')] == ['KC7ZZB']
+    assert sorted(found.callsign for found in stations.list) == sorted(row[0] for row in BASELINE_STATIONS)
+    p.close()
+
+#Opening a database that is already up to date changes nothing
+def test_up_to_date_database_is_left_alone(path, capsys):
+    Persist(path).close()
+    capsys.readouterr()
+    before = schema(path), rows(path, 'SELECT rowid, * FROM stations;'), rows(path, 'SELECT * FROM stationChanges;')
+    Persist(path).close()
+    assert capsys.readouterr().out == ''
+    assert rows(path, 'PRAGMA user_version;') == [(len(MIGRATIONS),)]
+    assert (schema(path), rows(path, 'SELECT rowid, * FROM stations;'), rows(path, 'SELECT * FROM stationChanges;')) == before
+
+#A step that fails is rolled back whole and the version is not moved on
+def test_failed_step_is_rolled_back(path, monkeypatch):
+    broken = list(MIGRATIONS)
+    broken[2] = MIGRATIONS[2] + ['CREATE TABLE stations (broken)']
+    monkeypatch.setattr(persist, 'MIGRATIONS', broken)
+    with pytest.raises(sqlite3.OperationalError):
+        Persist(path)
+    assert rows(path, 'PRAGMA user_version;') == [(2,)]
+    assert rows(path, "SELECT name FROM sqlite_master WHERE name = 'stations_new';") == []
+    assert len(rows(path, 'SELECT * FROM stations;')) == len(BASELINE_STATIONS)
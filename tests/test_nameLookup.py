@@ -0,0 +1,32 @@
+"""
+Name lookup files in nameLookup.py find every justified callsign in the
+callbook, whatever its width.
+"""
+
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from persist import Persist
+from nameLookup import buildLookup, openLookup
+
+CALLBOOK = ((' W3LOR', 'LORI'), ('KC7ZZB', 'HAL'), ('3DA0RU ', 'ROB'), (' K1ABCD', 'ABE'), ('G/G4ABC/P', 'GIL'))
+
+def test_lookup_keys_of_every_width(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    with p.con:
+        p.con.executemany('INSERT INTO callbook (callsign, name) VALUES (?, ?);', CALLBOOK)
+    path = str(tmp_path / 'callbook.idx')
+    buildLookup(p, path)
+    p.close()
+    lookup = openLookup(path)
+    try:
+        assert len(lookup) == len(CALLBOOK)
+        for callsign, name in CALLBOOK:
+            assert lookup.lookup(callsign) == name
+        assert lookup.lookup(' W3LO') is None
+        assert lookup.lookup('3DA0RUX ABCDEFGH') is None
+    finally:
+        lookup.close()
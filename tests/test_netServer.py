@@ -0,0 +1,100 @@
+"""
+The shared net log server in netServer.py, run on localhost.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station
+import netServer
+
+#Lines that are valid JSON but not a message get an error reply and the
+#connection stays open
+def test_message_that_is_not_an_object(tmp_path):
+    async def run():
+        server = netServer.NetServer(Persist(str(tmp_path / 'server.db')))
+        port = await server.start(port=0)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        replies = []
+        for line in (b'[]\n', b'1\n', b'{"op": "hello", "since": null}\n'):
+            writer.write(line)
+            replies.append(json.loads(await reader.readline()))
+        writer.close()
+        await server.close()
+        return replies
+    
+    replies = asyncio.run(run())
+    assert [reply['op'] for reply in replies] == ['error', 'error', 'snapshot']
+
+#A dozen clients typing at once, two into each station, one the name and
+#one the note, while each adds a station and one deletes a station. Every
+#client's copy ends up the same as the server's, and so does the database.
+def test_a_dozen_clients_typing_at_once(tmp_path):
+    path = str(tmp_path / 'server.db')
+    p = Persist(path)
+    for callsign in (' W3LOR', 'KC7ZZB', 'KE1CRV', ' K7JWF', ' N5XYZ', ' K4ABC', ' W1AW '):
+        Station(callsign, '').saveToDatabase(p)
+    p.close()
+    
+    async def run():
+        server = netServer.NetServer(Persist(path))
+        port = await server.start(port=0)
+        clients = [netServer.NetClient() for n in range(12)]
+        for client in clients:
+            await client.connect(port=port)
+        ids = sorted(clients[0].stations)
+        
+        async def typeInto(client, stationId, field, text):
+            replies = []
+            for length in range(1, len(text) + 1):
+                replies.append(client.edit(stationId, field, text[:length]))
+                await asyncio.sleep(0)
+            return await asyncio.gather(*replies)
+        
+        async def insert(client, callsign):
+            return await client.insert(callsign, 'NEW')
+        
+        work = [typeInto(clients[n], ids[n // 2], 'name' if n % 2 == 0 else 'note', 'CLIENT NUMBER ' + str(n))
+            for n in range(12)]
+        work = work + [insert(clients[n], ' K1A' + chr(ord('A') + n)) for n in range(12)]
+        work.append(clients[11].delete(ids[6]))
+        results = await asyncio.gather(*work)
+        
+        deadline = time.monotonic() + 10
+        while any(client.seq != server.seq for client in clients):
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+        expected = {station.id: netServer.stationFields(station) for station in server.stations.list}
+        copies = [client.stations for client in clients]
+        
+        #Edits to a deleted station are refused
+        refused = await clients[0].edit(ids[6], 'name', 'GONE')
+        for client in clients:
+            await client.close()
+        await server.close()
+        return results, expected, copies, refused, ids
+    
+    results, expected, copies, refused, ids = asyncio.run(run())
+    assert all(reply['op'] == 'ack' and not reply['conflict'] for replies in results[:12] for reply in replies)
+    assert len(set(results[12:24])) == 12
+    assert results[24]['op'] == 'ack'
+    assert refused['op'] == 'error'
+    
+    assert len(expected) == 6 + 12
+    for n in range(12):
+        assert expected[ids[n // 2]]['name' if n % 2 == 0 else 'note'] == 'CLIENT NUMBER ' + str(n)
+    for copy in copies:
+        assert copy == expected
+    
+    con = sqlite3.connect(path)
+    rows = con.execute('SELECT rowid, callsign, name, ack, note FROM stations;').fetchall()
+    con.close()
+    assert {row[0]: {'id': row[0], 'callsign': row[1], 'name': row[2], 'ack': bool(row[3]), 'note': row[4]}
+        for row in rows} == expected
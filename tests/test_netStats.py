@@ -0,0 +1,54 @@
+"""
+Station totals in netStats.py stay right when other programs change
+stations the list has not loaded, and while local edits are unflushed.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station, StationList, Net
+from netStats import NetStatistics
+
+@pytest.fixture
+def p(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    for number in range(20):
+        Station('KC7A' + chr(ord('A') + number) + 'A', 'NAME').saveToDatabase(p)
+    yield p
+    p.close()
+
+def test_changes_by_another_connection_past_the_loaded_page(p):
+    stations = StationList(p, pageSize=5)
+    stats = NetStatistics(p, Net('Test'))
+    stations.stats = stats
+    assert (stats.stations, stats.acknowledged) == (20, 0)
+    
+    other = sqlite3.connect(p.path)
+    with other:
+        other.execute("INSERT INTO stations (callsign, name, ack) VALUES ('KC7ZZZ', 'NEW', 1);")
+        other.execute("UPDATE stations SET ack = 1, note = 'late' WHERE callsign = 'KC7ATA';")
+        other.execute("DELETE FROM stations WHERE callsign = 'KC7ASA';")
+    other.close()
+    stations.refreshFromDatabase(p)
+    stats.refresh(p)
+    assert (stats.stations, stats.acknowledged, stats.withNotes) == (20, 2, 1)
+
+def test_unflushed_edits_are_counted_as_in_memory(p):
+    stations = StationList(p)
+    stats = NetStatistics(p, Net('Test'))
+    stations.stats = stats
+    stations.setAck(stations.list[0], True)
+    p.markDirty(stations.list[0])
+    added = Station('KC7ZZZ', 'NEW', True)
+    p.markDirty(added)
+    stats.recount(p)
+    assert (stats.stations, stats.acknowledged) == (21, 2)
+    p.flush().result()
+    stats.refresh(p)
+    assert (stats.stations, stats.acknowledged) == (21, 2)
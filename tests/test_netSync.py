@@ -0,0 +1,112 @@
+"""
+Two copies of the application's database kept in step through a net server
+on localhost by netSync.py, as two loggers' windows would be.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station
+import netServer
+import netSync
+
+#Server on a loop of its own thread, closed at the end of the test
+@pytest.fixture
+def port(tmp_path):
+    loop = asyncio.new_event_loop()
+    server = netServer.NetServer(Persist(str(tmp_path / 'server.db')))
+    port = loop.run_until_complete(server.start(port=0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield port
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+#A logger's database, with stations of its own
+def logger(tmp_path, name, *stations):
+    p = Persist(str(tmp_path / (name + '.db')))
+    for callsign, stationName in stations:
+        Station(callsign, stationName).saveToDatabase(p)
+    p.close()
+    return str(tmp_path / (name + '.db'))
+
+def names(path):
+    con = sqlite3.connect(path)
+    try:
+        return dict(con.execute('SELECT callsign, name FROM stations;').fetchall())
+    finally:
+        con.close()
+
+def waitFor(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_two_loggers_share_one_list(tmp_path, port):
+    first = logger(tmp_path, 'first', (' W3LOR', 'LORI'), ('KC7ZZB', 'HAL'))
+    second = logger(tmp_path, 'second', (' W3LOR', 'LORRAINE'), ('KE1CRV', 'EVAN'))
+    syncs = [netSync.NetSync(path, '127.0.0.1', port) for path in (first, second)]
+    try:
+        for sync in syncs:
+            sync.start()
+            assert sync.connected.wait(10)
+        #Stations each had apart are merged; the one both had keeps the
+        #fields of the first to reach the server
+        merged = {' W3LOR': 'LORI', 'KC7ZZB': 'HAL', 'KE1CRV': 'EVAN'}
+        waitFor(lambda: names(first) == merged and names(second) == merged)
+        
+        #An edit written by one window reaches the other's database
+        p = Persist(second)
+        station = Station(id=p.cur.execute("SELECT rowid FROM stations WHERE callsign = 'KC7ZZB';").fetchone()[0])
+        station.loadFromDatabase(p)
+        station.name = 'HAROLD'
+        p.markDirty(station)
+        p.markDirty(Station('K7JWF', 'JOHN'))
+        p.close()
+        waitFor(lambda: names(first).get('KC7ZZB') == 'HAROLD' and names(first).get('K7JWF') == 'JOHN')
+    finally:
+        for sync in syncs:
+            sync.stop()
+    assert names(first) == names(second)
+
+#A station deleted from one logger's database, e.g. by another program, is
+#deleted from the others' too, and one added again afterwards is shared
+#as a new station
+def test_delete_reaches_every_logger(tmp_path, port):
+    paths = [logger(tmp_path, 'first', (' W3LOR', 'LORI'), ('KC7ZZB', 'HAL')),
+        logger(tmp_path, 'second'), logger(tmp_path, 'third')]
+    syncs = [netSync.NetSync(path, '127.0.0.1', port) for path in paths]
+    try:
+        for sync in syncs:
+            sync.start()
+            assert sync.connected.wait(10)
+        waitFor(lambda: all(names(path) == {' W3LOR': 'LORI', 'KC7ZZB': 'HAL'} for path in paths))
+        
+        con = sqlite3.connect(paths[1])
+        con.execute("DELETE FROM stations WHERE callsign = 'KC7ZZB';")
+        con.commit()
+        waitFor(lambda: all(names(path) == {' W3LOR': 'LORI'} for path in paths))
+        
+        con.execute("INSERT INTO stations (callsign, name) VALUES ('KC7ZZB', 'HAROLD');")
+        con.commit()
+        con.close()
+        waitFor(lambda: all(names(path) == {' W3LOR': 'LORI', 'KC7ZZB': 'HAROLD'} for path in paths))
+    finally:
+        for sync in syncs:
+            sync.stop()
+    for path in paths:
+        con = sqlite3.connect(path)
+        assert con.execute('SELECT COUNT(*) FROM serverStations;').fetchone()[0] == 2
+        con.close()
@@ -0,0 +1,91 @@
+"""
+CallsignPatternIndex answers wildcard searches the same way Station.match
+does, and keeps its bitsets the size of the stations it holds while
+stations come and go.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station, StationList, CallsignPatternIndex
+
+#Callsigns of four to eight characters, short ones included so the
+#positions past the end of a callsign are exercised
+def randomCallsign(rng):
+    return ''.join(rng.choice(' K1W3AB/P') for i in range(rng.randint(4, 8)))
+
+#Patterns with '?' for unknown characters. '/' is a real character, as in
+#G4ABC/P.
+def randomPattern(rng):
+    return ''.join(rng.choice('?' * 3 + ' K1W3AB/') for i in range(rng.randint(1, 9)))
+
+def matching(stations, pattern):
+    return set(station for station in stations if station.match(pattern))
+
+def test_search_agrees_with_match():
+    rng = random.Random(4)
+    stations = [Station(randomCallsign(rng)) for i in range(2000)]
+    index = CallsignPatternIndex()
+    index.addMany(stations[:1000])
+    for station in stations[1000:]:
+        index.add(station)
+    for i in range(300):
+        pattern = randomPattern(rng)
+        assert set(index.search(pattern)) == matching(stations, pattern), pattern
+    assert len(index.search('????', limit=10)) == 10
+
+#Stations removed and added during a long net reuse the freed slots, and
+#the edits in between leave the results right
+def test_churn_reuses_slots():
+    rng = random.Random(5)
+    stations = [Station(randomCallsign(rng)) for i in range(1000)]
+    index = CallsignPatternIndex()
+    index.addMany(stations)
+    for round in range(200):
+        for station in rng.sample(stations, 20):
+            stations.remove(station)
+            index.remove(station)
+        added = [Station(randomCallsign(rng)) for i in range(20)]
+        stations.extend(added)
+        if round % 2:
+            index.addMany(added)
+        else:
+            for station in added:
+                index.add(station)
+        edited = rng.choice(stations)
+        oldCallsign = edited.callsign
+        edited.callsign = randomCallsign(rng)
+        index.update(edited, oldCallsign)
+    
+    assert len(index.slots) == 1000
+    assert index.allBits.bit_length() <= 1000
+    for i in range(100):
+        pattern = randomPattern(rng)
+        assert set(index.search(pattern)) == matching(stations, pattern), pattern
+
+#A stroke in the pattern only matches a stroke, both among the loaded
+#stations and in the pages looked up in the database
+def test_stroke_is_not_a_wildcard(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    for callsign in ('F/G4ABC', 'FXG4ABC', 'G4ABC/P', 'G4ABCXP', 'G4ABCYP'):
+        Station(callsign, 'NAME').saveToDatabase(p)
+    stations = StationList(p, pageSize=2)
+    assert stations.hasMore
+    
+    def found(pattern):
+        return [station.callsign for station in stations.search(pattern, p=p)]
+    assert found('F/') == ['F/G4ABC']
+    assert found('F?') == ['F/G4ABC', 'FXG4ABC']
+    assert found('G4ABC/') == ['G4ABC/P']
+    assert found('G4ABC?P') == ['G4ABC/P', 'G4ABCXP', 'G4ABCYP']
+    assert found('?/G') == ['F/G4ABC']
+    
+    while stations.hasMore:
+        stations.updateListFromDatabase(p)
+    assert found('G4ABC/') == ['G4ABC/P']
+    assert found('?????/') == ['G4ABC/P']
+    p.close()
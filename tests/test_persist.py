@@ -0,0 +1,195 @@
+"""
+Crash safety of the write-behind flush in persist.py. A flushed batch is
+either all in the database or none of it, edits not flushed yet are lost in
+a crash, and one object the database rejects does not hold back the rest.
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from persist import Persist
+from journal import EditJournal
+from dataStructures import Station, StationList
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'stations.db')
+    p = Persist(path)
+    for callsign, name in ((' W3LOR', 'LORI'), ('KC7ZZB', 'HAL'), ('KE1CRV', 'EVAN')):
+        Station(callsign, name).saveToDatabase(p)
+    p.close()
+    return path
+
+def names(path):
+    con = sqlite3.connect(path)
+    try:
+        return dict(con.execute('SELECT callsign, name FROM stations;').fetchall())
+    finally:
+        con.close()
+
+def loadStation(p, callsign):
+    station = Station(id=p.cur.execute('SELECT rowid FROM stations WHERE callsign = ?;', (callsign,)).fetchone()[0])
+    station.loadFromDatabase(p)
+    return station
+
+#Edit one station and flush, edit another without flushing, then kill the
+#process without closing anything. Only the flushed edit survives.
+def test_crash_keeps_flushed_edits_only(path):
+    script = textwrap.dedent('''
+        import os, sys
+        sys.path.insert(0, {repo!r})
+        from persist import Persist
+        from dataStructures import Station
+        p = Persist({path!r})
+        flushed = Station(id=p.cur.execute("SELECT rowid FROM stations WHERE callsign = ' W3LOR';").fetchone()[0])
+        flushed.loadFromDatabase(p)
+        flushed.name = 'FLUSHED'
+        p.markDirty(flushed)
+        p.flush().result()
+        pending = Station(id=p.cur.execute("SELECT rowid FROM stations WHERE callsign = 'KC7ZZB';").fetchone()[0])
+        pending.loadFromDatabase(p)
+        pending.name = 'PENDING'
+        p.markDirty(pending)
+        os._exit(0)
+    ''').format(repo=REPO, path=path)
+    subprocess.run([sys.executable, '-c', script], check=True, capture_output=True)
+    
+    assert names(path) == {' W3LOR': 'FLUSHED', 'KC7ZZB': 'HAL', 'KE1CRV': 'EVAN'}
+    con = sqlite3.connect(path)
+    assert con.execute('PRAGMA integrity_check;').fetchone()[0] == 'ok'
+    con.close()
+
+#An object failing part way through a batch rolls back the whole batch,
+#and every object in it is written by the next flush
+def test_failed_batch_is_rolled_back_whole(path):
+    class failingWrite:
+        id = 1
+        failures = 1
+        def writeToDatabase(self, p):
+            if self.failures:
+                self.failures -= 1
+                raise sqlite3.OperationalError('disk I/O error')
+    
+    p = Persist(path)
+    first = loadStation(p, ' W3LOR')
+    first.name = 'FIRST'
+    new = Station('KU0L  ', 'KEVIN')
+    failing = failingWrite()
+    p.markDirty(first)
+    p.markDirty(new)
+    p.markDirty(failing)
+    with pytest.raises(sqlite3.OperationalError):
+        p.flush().result()
+    assert names(path) == {' W3LOR': 'LORI', 'KC7ZZB': 'HAL', 'KE1CRV': 'EVAN'}
+    assert p.isDirty(first) and p.isDirty(new) and p.isDirty(failing)
+    assert new.id is None
+    
+    p.flush().result()
+    assert not p.isDirty(first) and not p.isDirty(new)
+    assert names(path) == {' W3LOR': 'FIRST', 'KC7ZZB': 'HAL', 'KE1CRV': 'EVAN', 'KU0L  ': 'KEVIN'}
+    p.close()
+
+#A station given a callsign another one already has is rejected on its
+#own; the other edits in the same batch are written
+def test_constraint_failure_rejects_only_that_object(path):
+    p = Persist(path)
+    duplicate = loadStation(p, 'KC7ZZB')
+    duplicate.callsign = ' W3LOR'
+    other = loadStation(p, 'KE1CRV')
+    other.name = 'EVAN SAVED'
+    new = Station('KU0L  ', 'KEVIN')
+    p.markDirty(duplicate)
+    p.markDirty(other)
+    p.markDirty(new)
+    
+    rejected = p.flush().result()
+    assert [obj for obj, exception in rejected] == [duplicate]
+    assert isinstance(rejected[0][1], sqlite3.IntegrityError)
+    assert not p.isDirty(duplicate)
+    assert new.id is not None
+    
+    #Nothing is left to fail the next flush
+    assert p.flush() is None
+    p.close()
+    assert names(path) == {' W3LOR': 'LORI', 'KC7ZZB': 'HAL', 'KE1CRV': 'EVAN SAVED', 'KU0L  ': 'KEVIN'}
+
+#The WAL pragma run when the database is opened must not leave a statement
+#holding a lock, or the worker's first write on a new database waits out
+#the busy timeout and fails
+def test_first_write_to_new_database_is_not_blocked(tmp_path):
+    p = Persist(str(tmp_path / 'new.db'))
+    station = Station('KU0L  ', 'KEVIN')
+    p.markDirty(station)
+    assert p.flush().result(timeout=5) == []
+    assert station.id is not None
+    p.close()
+
+#A journal append that fails leaves the edit pending, and the retry
+#journals it again rather than finding nothing changed
+def test_failed_journal_append_is_retried(path, tmp_path):
+    p = Persist(path, journalPath=str(tmp_path / 'edits.journal'))
+    station = loadStation(p, ' W3LOR')
+    station.name = 'JOURNALED'
+    
+    append = p.journal.append
+    def failingAppend(entries):
+        p.journal.append = append
+        raise OSError('No space left on device')
+    p.journal.append = failingAppend
+    p.markDirty(station)
+    with pytest.raises(OSError):
+        p.flush().result()
+    assert p.isDirty(station)
+    
+    assert p.flush().result() == []
+    assert os.path.getsize(str(tmp_path / 'edits.journal')) > 0
+    p.close()
+    assert names(path)[' W3LOR'] == 'JOURNALED'
+
+#Compaction drops a journaled value the database rejects and still writes
+#the other fields and rows
+def test_compaction_skips_rejected_values(path, tmp_path):
+    p = Persist(path, journalPath=str(tmp_path / 'edits.journal'))
+    duplicate = loadStation(p, 'KC7ZZB')
+    duplicate.callsign = ' W3LOR'
+    duplicate.name = 'HAL SAVED'
+    other = loadStation(p, 'KE1CRV')
+    other.name = 'EVAN SAVED'
+    p.markDirty(duplicate)
+    p.markDirty(other)
+    p.flush().result()
+    p.close()
+    assert names(path) == {' W3LOR': 'LORI', 'KC7ZZB': 'HAL SAVED', 'KE1CRV': 'EVAN SAVED'}
+    assert os.path.getsize(str(tmp_path / 'edits.journal')) == 0
+
+#Edits a crash left in the journal are in the database by the time the
+#constructor returns, however long replaying them takes, so a station list
+#loaded straight away does not show the old values
+def test_journal_is_replayed_before_startup_finishes(path, tmp_path, monkeypatch):
+    journalPath = str(tmp_path / 'edits.journal')
+    p = Persist(path)
+    rowid = loadStation(p, ' W3LOR').id
+    p.close()
+    journal = EditJournal(journalPath)
+    journal.append([['stations', rowid, {'name': 'REPLAYED'}]])
+    journal.close()
+    
+    compactJournal = Persist.compactJournal
+    def slowCompaction(self, writer):
+        time.sleep(.3)
+        compactJournal(self, writer)
+    monkeypatch.setattr(Persist, 'compactJournal', slowCompaction)
+    p = Persist(path, journalPath=journalPath)
+    stations = StationList(p)
+    assert stations.find(' W3LOR').name == 'REPLAYED'
+    assert os.path.getsize(journalPath) == 0
+    p.close()
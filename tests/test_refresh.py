@@ -0,0 +1,92 @@
+"""
+StationList.refreshFromDatabase patches in the rows another connection
+inserted, updated and deleted, read from the stationChanges log.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station, StationList
+
+@pytest.fixture
+def p(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    for callsign in (' K1AAA', ' K1BBB', ' K1CCC', ' K1DDD', ' K1EEE', ' K1FFF'):
+        Station(callsign, 'NAME').saveToDatabase(p)
+    yield p
+    p.close()
+
+#Loaded stations as (id, callsign, name, ack, note), and the same read
+#through the callsign index
+def listed(stations):
+    rows = [(station.id, station.callsign, station.name, bool(station.ack), station.note) for station in stations.list]
+    for row, station in enumerate(stations.list):
+        assert stations.find(station.callsign) is station
+        assert stations.rowOf(station.callsign) == row
+        assert stations.idIndex[station.id] is station
+    assert len(stations.callsignIndex) == len(stations.list)
+    return rows
+
+def stored(p, upTo=None):
+    rows = p.cur.execute('SELECT rowid, callsign, name, ack, note FROM stations ORDER BY callsign;').fetchall()
+    return [(row[0], row[1], row[2], bool(row[3]), row[4]) for row in rows if upTo is None or row[1] <= upTo]
+
+def test_changes_from_another_connection(p):
+    stations = StationList(p)
+    stations.selectCallsign(' K1DDD')
+    selected = stations.currentStation
+    
+    other = sqlite3.connect(p.path)
+    other.execute("INSERT INTO stations (callsign, name, ack, note) VALUES (' K1BCD', 'NEW', 0, '');")
+    other.execute("UPDATE stations SET name = 'RENAMED', ack = 1, note = 'NOTE' WHERE callsign = ' K1CCC';")
+    other.execute("UPDATE stations SET callsign = ' K1ZZZ' WHERE callsign = ' K1EEE';")
+    other.execute("DELETE FROM stations WHERE callsign = ' K1AAA';")
+    other.commit()
+    other.close()
+    
+    changedRows, restructured = stations.refreshFromDatabase(p)
+    assert restructured
+    assert set(listed(stations)) == set(stored(p))
+    assert stations.rowOf(' K1CCC') in changedRows
+    assert stations.unackedCount == len(stations.list) - 1
+    assert stations.currentStation is selected
+    assert stations.list[stations.currentStationIndex] is selected
+    
+    #Nothing more to pick up
+    assert stations.refreshFromDatabase(p) == ([], False)
+
+#With only the first page loaded, rows inserted past it are left for the
+#page that reaches them
+def test_inserts_past_the_loaded_pages(p):
+    stations = StationList(p, pageSize=3)
+    other = sqlite3.connect(p.path)
+    other.execute("INSERT INTO stations (callsign, name, ack, note) VALUES (' K1ABC', 'NEW', 0, '');")
+    other.execute("INSERT INTO stations (callsign, name, ack, note) VALUES (' K1XYZ', 'NEW', 0, '');")
+    other.commit()
+    other.close()
+    
+    stations.refreshFromDatabase(p)
+    assert listed(stations) == stored(p, upTo=stations.lastCallsign)
+    while stations.hasMore:
+        stations.updateListFromDatabase(p)
+    assert listed(stations) == stored(p)
+
+#A station with edits not flushed yet keeps them
+def test_dirty_station_is_left_alone(p):
+    stations = StationList(p)
+    station = stations.find(' K1BBB')
+    station.name = 'LOCAL'
+    p.markDirty(station)
+    other = sqlite3.connect(p.path)
+    other.execute("UPDATE stations SET name = 'REMOTE' WHERE callsign = ' K1BBB';")
+    other.commit()
+    other.close()
+    
+    stations.refreshFromDatabase(p)
+    assert station.name == 'LOCAL'
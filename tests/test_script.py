@@ -0,0 +1,64 @@
+"""
+Net scripts compiled into lines: a new placeholder value re-renders only
+the lines that use it, and a script is compiled again only when its
+contents change.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataStructures import Script, CompiledScript
+
+CONTENTS = '\n'.join([
+    'Welcome to the {net}',
+    'This line has no placeholders',
+    'We have {checkins} check-ins, {firsttime} for the first time',
+    'Next up is {callsign}, {phonetics}',
+    'Still {checkins} check-ins and {unacked} to acknowledge',
+    '{{checkins}} and {unknown} are left as they are',
+])
+
+#Lines rendered by a compiled script from now on
+def renderedLines(compiled):
+    rendered = []
+    renderLine = compiled.renderLine
+    def countingRenderLine(parts):
+        rendered.append(compiled.lines.index(parts))
+        return renderLine(parts)
+    compiled.renderLine = countingRenderLine
+    return rendered
+
+def test_only_lines_using_a_changed_value_are_rendered():
+    compiled = CompiledScript(CONTENTS)
+    assert set(compiled.placeholders()) == {'net', 'checkins', 'firsttime', 'callsign', 'phonetics', 'unacked'}
+    compiled.update({'net': 'MONDAY NET', 'checkins': 0, 'firsttime': 0, 'callsign': '', 'phonetics': '',
+        'unacked': 0})
+    rendered = renderedLines(compiled)
+    
+    assert compiled.update({'checkins': 12}) == [2, 4]
+    assert sorted(rendered) == [2, 4]
+    assert compiled.rendered[2] == 'We have 12 check-ins, 0 for the first time'
+    assert compiled.rendered[4] == 'Still 12 check-ins and 0 to acknowledge'
+    
+    del rendered[:]
+    assert compiled.update({'callsign': 'W3LOR', 'checkins': 12, 'net': 'MONDAY NET'}) == [3]
+    assert rendered == [3]
+    assert compiled.rendered == ['Welcome to the MONDAY NET', 'This line has no placeholders',
+        'We have 12 check-ins, 0 for the first time', 'Next up is W3LOR, ',
+        'Still 12 check-ins and 0 to acknowledge', '{checkins} and {unknown} are left as they are']
+    
+    #Nothing changed, nothing rendered
+    del rendered[:]
+    assert compiled.update({'checkins': 12, 'unknown': 'X'}) == []
+    assert rendered == []
+
+def test_compiled_again_only_when_contents_change():
+    script = Script('MONDAY', CONTENTS)
+    compiled = script.compiled()
+    compiled.update({'checkins': 3})
+    assert script.compiled() is compiled
+    script.contents = CONTENTS + '\nGoodnight'
+    assert script.compiled() is not compiled
+    assert script.compiled().rendered[-1] == 'Goodnight'
@@ -0,0 +1,155 @@
+"""
+Callsign index of StationList: lookups stay correct while two stations
+briefly share a callsign, through inserts, deletes and edits in a large
+list, and an empty list can be edited and navigated.
+"""
+
+import os
+import random
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import Station, StationList
+
+@pytest.fixture
+def p(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    yield p
+    p.close()
+
+def addStations(p, *callsigns):
+    for callsign in callsigns:
+        Station(callsign, 'NAME').saveToDatabase(p)
+
+#Typing over another station's callsign and on past it leaves that station
+#findable
+def test_typing_through_another_callsign(p):
+    addStations(p, ' W3LOR', 'KC7ZZB')
+    stations = StationList(p)
+    other = stations.find(' W3LOR')
+    editing = stations.find('KC7ZZB')
+    for text in (' W    ', ' W3   ', ' W3L  ', ' W3LO ', ' W3LOR', ' W3LORX'):
+        stations.setCallsign(editing, text)
+    assert stations.find(' W3LOR') is other
+    assert stations.find(' W3LORX') is editing
+
+#When the station the index points at leaves a shared callsign, the index
+#moves to the one still holding it
+def test_shared_callsign_moves_to_remaining_station(p):
+    addStations(p, ' W3LOR', 'KC7ZZB')
+    stations = StationList(p)
+    first = stations.find(' W3LOR')
+    second = stations.find('KC7ZZB')
+    stations.setCallsign(second, ' W3LOR')
+    stations.setCallsign(first, 'KU0L  ')
+    assert stations.find(' W3LOR') is second
+    assert stations.find('KU0L  ') is first
+    stations.removeStation(stations.rowOf(' W3LOR'))
+    assert stations.find(' W3LOR') is None
+
+#Moving the selection in an empty list keeps the blank station, and the
+#first callsign typed adds it to the list
+def test_empty_list(p):
+    stations = StationList(p)
+    stations.selectNext()
+    stations.selectPrevious()
+    blank = stations.currentStation
+    stations.setCallsign(blank, ' W3LOR')
+    assert stations.list == [blank]
+    assert stations.find(' W3LOR') is blank
+    assert stations.currentStation is blank
+
+#A synthetic callsign for every n below 26**4, in the same order as n
+def syntheticCallsign(n):
+    letters = ''
+    for i in range(4):
+        letters = chr(ord('A') + n % 26) + letters
+        n = n // 26
+    return 'K1' + letters
+
+#Rows and callsigns found through the index agree with the list itself
+def checkIndex(stations, touched):
+    keys = [station.sortKey for station in stations.list]
+    assert keys == sorted(keys)
+    assert len(stations.callsignIndex) == len(stations.list)
+    assert stations.sharedCallsigns == {}
+    for station in touched:
+        if stations.isLoaded(station):
+            assert stations.list[stations.rowOfStation(station)] is station
+            assert stations.find(station.callsign) is station
+        else:
+            assert stations.rowOfStation(station) is None
+            assert stations.find(station.callsign) is not station
+
+#Inserts, deletes and callsign edits in a list of 200k stations each touch
+#only the stations involved. Re-indexing the rows after each insert or
+#delete took over a minute for these 3000 operations.
+def test_index_through_inserts_deletes_and_edits(p):
+    count = 200000
+    stations = StationList(p)
+    stations.appendStations([Station(syntheticCallsign(n * 2), 'NAME', id=n + 1) for n in range(count)])
+    assert len(stations.list) == count
+    
+    rng = random.Random(3)
+    unused = [syntheticCallsign(n * 2 + 1) for n in range(count)]
+    rng.shuffle(unused)
+    touched = []
+    stations.selectStation(count // 2)
+    selected = stations.currentStation
+    start = time.perf_counter()
+    for i in range(3000):
+        operation = i % 3
+        if operation == 0:
+            station = Station(unused.pop(), 'NEW')
+            row = stations.insertStation(station)
+            assert stations.list[row] is station
+        elif operation == 1:
+            row = rng.randrange(len(stations.list))
+            station = stations.list[row]
+            if station is selected:
+                continue
+            assert stations.removeStation(row) is station
+        else:
+            station = stations.list[rng.randrange(len(stations.list))]
+            stations.setCallsign(station, unused.pop())
+        touched.append(station)
+    seconds = time.perf_counter() - start
+    
+    assert stations.currentStation is selected
+    assert stations.list[stations.currentStationIndex] is selected
+    checkIndex(stations, touched + rng.sample(stations.list, 2000))
+    assert seconds < 2, seconds
+
+#An edited callsign keeps its row, and stations inserted afterwards still
+#go where their callsigns sort among the rows
+def test_insert_after_edit_keeps_the_list_in_order(p):
+    addStations(p, ' K1AAA', ' K1BBB', ' K1CCC')
+    stations = StationList(p)
+    moved = stations.find(' K1AAA')
+    stations.setCallsign(moved, ' K1ZZZ')
+    assert stations.rowOf(' K1ZZZ') == 0
+    new = Station(' K1BCC', 'NEW')
+    assert stations.insertStation(new) == 2
+    assert [station.callsign for station in stations.list] == [' K1ZZZ', ' K1BBB', ' K1BCC', ' K1CCC']
+    checkIndex(stations, list(stations.list))
+
+#A shared callsign keeps pointing at a station holding it when stations
+#are inserted and removed around them
+def test_shared_callsign_through_inserts_and_deletes(p):
+    addStations(p, ' W3LOR', 'KC7ZZB', 'KE1CRV')
+    stations = StationList(p)
+    first = stations.find(' W3LOR')
+    second = stations.find('KE1CRV')
+    stations.setCallsign(second, ' W3LOR')
+    stations.insertStation(Station(' K1AAA'))
+    stations.removeStation(stations.rowOf('KC7ZZB'))
+    assert stations.find(' W3LOR') is first
+    stations.removeStation(stations.rowOfStation(first))
+    assert stations.find(' W3LOR') is second
+    assert stations.list[stations.rowOf(' W3LOR')] is second
+    assert stations.sharedCallsigns == {}
@@ -0,0 +1,164 @@
+"""
+Suggestions of known callsigns a callsign may have been misheard for: the
+deletion index finds the same callsigns as comparing against every known
+one, the change log keeps it up to date, and a search stays under a
+millisecond with 100k known callsigns.
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persist import Persist
+from dataStructures import (Station, StationList, Net, CheckIn, CallsignSuggestionIndex, CONFUSABLE_COST,
+    INSERT_DELETE_COST, confusables, substitutionCost)
+
+@pytest.fixture
+def p(tmp_path):
+    p = Persist(str(tmp_path / 'stations.db'))
+    yield p
+    p.close()
+
+#Cost of a known callsign for one typed, worked out by comparing the two,
+#or None if it is not one edit or two confusable swaps away
+def comparedCost(typed, known):
+    if len(known) == len(typed):
+        differences = [i for i in range(len(typed)) if typed[i] != known[i]]
+        if len(differences) == 1:
+            return substitutionCost(typed[differences[0]], known[differences[0]])
+        if len(differences) == 2 and all(known[i] in confusables.get(typed[i], '') for i in differences):
+            return 2 * CONFUSABLE_COST
+    shorter, longer = sorted((typed, known), key=len)
+    if len(longer) == len(shorter) + 1 and any(longer[:i] + longer[i + 1:] == shorter for i in range(len(longer))):
+        return INSERT_DELETE_COST
+    return None
+
+def indexOf(*callsigns):
+    index = CallsignSuggestionIndex()
+    for n, callsign in enumerate(callsigns):
+        index.setStation(n + 1, callsign)
+    return index
+
+#Best first: a confusable letter, then other single edits by how alike the
+#characters sound, with two confusable swaps among them
+def test_ranking():
+    index = indexOf(' K4ABC', ' K4ABD', ' K4ABR', ' K4AB', 'KK4ABC', ' K4AGT', ' W3LOR')
+    assert index.search(' K4ABC', 10) == ['K4ABD', 'K4AGT', 'K4ABR', 'K4AB', 'KK4ABC']
+    assert index.search(' K4ABC', 2) == ['K4ABD', 'K4AGT']
+
+#Portable and location prefixed callsigns are found with and without the
+#stroke
+def test_portable_callsigns():
+    index = indexOf('G4ABC/P', 'F/G4ABC', ' G4ABD ')
+    assert index.search('G4ABC/B', 5) == ['G4ABC/P']
+    assert index.search('G4ABC/', 5) == ['G4ABC/P']
+    assert index.search('/G4ABC', 5) == ['F/G4ABC']
+
+#The index finds exactly the callsigns that comparing against every known
+#one does, with the same costs
+def test_agrees_with_comparing_every_callsign():
+    rng = random.Random(16)
+    letters = 'ABCDEFGKMNPSTVZ'
+    known = set()
+    while len(known) < 3000:
+        known.add(rng.choice('KNW') + rng.choice(' ' + letters).strip() + rng.choice('0123') +
+            ''.join(rng.choice(letters) for i in range(rng.randint(1, 3))))
+    known = sorted(known)
+    index = indexOf(*known)
+    for typed in rng.sample(known, 200) + [typed[:2] + 'E' + typed[3:] for typed in rng.sample(known, 200)]:
+        costs = {}
+        for callsign in known:
+            cost = comparedCost(typed, callsign)
+            if cost is not None and callsign != typed:
+                costs[callsign] = cost
+        assert index.search(typed, len(known)) == sorted(costs, key=lambda callsign: (costs[callsign], callsign))
+
+#Adding and removing callsigns leaves the index as if only the remaining
+#ones had been added
+def test_churn():
+    rng = random.Random(4)
+    callsigns = ['K4A' + chr(ord('A') + n % 26) + chr(ord('A') + n // 26 % 26) for n in range(600)]
+    index = CallsignSuggestionIndex()
+    stations = {}
+    for step in range(5000):
+        stationId = rng.randrange(400)
+        callsign = rng.choice(callsigns) if rng.random() < .7 else None
+        if callsign is None and stationId not in stations:
+            continue
+        index.setStation(stationId, callsign)
+        if callsign is None:
+            del stations[stationId]
+        else:
+            stations[stationId] = callsign
+    rebuilt = indexOf(*stations.values())
+    assert index.counts == rebuilt.counts
+    assert {key: sorted(index.filedUnder(key)) for key in index.keys} == \
+        {key: sorted(rebuilt.filedUnder(key)) for key in rebuilt.keys}
+
+#Stations and earlier check-ins are known. Stations added, renamed and
+#deleted by another connection are picked up from the change log, also
+#while the index is still being built.
+def test_kept_up_to_date_from_the_change_log(p):
+    for callsign in (' K4ABC', ' W3LOR', 'KC7ZZB'):
+        Station(callsign, 'NAME').saveToDatabase(p)
+    net = Net('EARLIER')
+    net.saveToDatabase(p)
+    CheckIn(net, Station(' N5XYZ', 'GONE')).saveToDatabase(p)
+    stations = StationList(p)
+    assert stations.suggest(p, ' N5XYA') == []
+    stations.suggestionIndex(p, wait=True)
+    assert stations.suggest(p, ' K4ABD') == ['K4ABC']
+    assert stations.suggest(p, ' N5XYA') == ['N5XYZ']
+
+    other = sqlite3.connect(p.path)
+    other.execute("INSERT INTO stations (callsign, name) VALUES (' W3LOZ', 'NEW');")
+    other.execute("UPDATE stations SET callsign = ' K4ABE' WHERE callsign = ' K4ABC';")
+    other.execute("DELETE FROM stations WHERE callsign = 'KC7ZZB';")
+    other.commit()
+    stations.refreshFromDatabase(p)
+    assert stations.suggest(p, ' K4ABD') == ['K4ABE']
+    assert stations.suggest(p, ' W3LOX') == ['W3LOR', 'W3LOZ']
+    assert stations.suggest(p, 'KC7ZZA') == []
+
+    #Changes read while the index is built are applied once it is ready,
+    #whether or not the build saw them
+    stations.reload(p)
+    stations.suggestionIndex(p)
+    other.execute("UPDATE stations SET callsign = 'KC7ZZB' WHERE callsign = ' W3LOZ';")
+    other.commit()
+    stations.refreshFromDatabase(p)
+    stations.suggestionIndex(p, wait=True)
+    assert stations.suggest(p, 'KC7ZZA') == ['KC7ZZB']
+    assert stations.suggest(p, ' W3LOX') == ['W3LOR']
+    other.close()
+
+#A search costs a few dictionary probes whatever the number of callsigns
+#known. 100k callsigns filling whole ranges, like the benchmark databases,
+#give the most candidates for each search.
+def test_search_under_a_millisecond():
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    known = [prefix + str(n // 17576 % 10) + letters[n // 676 % 26] + letters[n // 26 % 26] + letters[n % 26]
+        for prefix in ('K', 'W') for n in range(50000)]
+    index = indexOf(*known)
+    for char in letters:
+        for other in letters:
+            if other != char:
+                substitutionCost(char, other)
+
+    rng = random.Random(1)
+    timings = []
+    for i in range(2000):
+        typed = rng.choice(known)
+        position = rng.randrange(len(typed))
+        typed = typed[:position] + rng.choice(letters) + typed[position + 1:]
+        start = time.perf_counter()
+        index.search(typed, 5)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    assert timings[int(len(timings) * .99)] < .001, timings[int(len(timings) * .99)]
@@ -0,0 +1,119 @@
+"""
+Full text search over callsign, name and note: the external content index
+stays in step with the stations table through inserts, edits and deletes,
+and a build of SQLite without FTS5 falls back to scanning the table.
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import persist
+from persist import Persist
+from dataStructures import Station, StationList
+
+def callsigns(stations):
+    return [station.callsign for station in stations]
+
+#FTS5 compares each row's terms in the index with the stations table
+def checkIndexInStep(path):
+    con = sqlite3.connect(path)
+    con.execute("INSERT INTO stationSearch (stationSearch, rank) VALUES ('integrity-check', 1);")
+    con.close()
+
+def addStations(p):
+    Station(' K4ABC', 'HAROLD', note='FLOOD MAIN').saveToDatabase(p)
+    Station(' W3LOR', 'LORI').saveToDatabase(p)
+    Station('G4ABC/P', 'NIGEL', note='PORTABLE ON THE HILL').saveToDatabase(p)
+
+#Edits and deletes through Persist, the journal and another connection all
+#reach the index
+def test_index_follows_updates_and_deletes(tmp_path):
+    path = str(tmp_path / 'stations.db')
+    p = Persist(path, journalPath=str(tmp_path / 'stations.journal'))
+    assert p.fullTextSearch
+    addStations(p)
+    stations = StationList(p)
+    assert callsigns(stations.textSearch(p, 'flood')) == [' K4ABC']
+    
+    harold = stations.find(' K4ABC')
+    harold.note = 'SANDBAGS'
+    p.markDirty(harold)
+    p.flush().result()
+    p.submit(p.compactJournal).result()
+    lori = stations.find(' W3LOR')
+    lori.ack = True
+    lori.saveToDatabase(p)
+    other = sqlite3.connect(path)
+    other.execute("UPDATE stations SET name = 'LORRAINE' WHERE callsign = ' W3LOR';")
+    other.execute("DELETE FROM stations WHERE callsign = 'G4ABC/P';")
+    other.commit()
+    other.close()
+    stations.reload(p)
+    
+    assert stations.textSearch(p, 'flood') == []
+    assert callsigns(stations.textSearch(p, 'sand har')) == [' K4ABC']
+    assert stations.textSearch(p, 'lori ') == []
+    assert callsigns(stations.textSearch(p, 'lorr')) == [' W3LOR']
+    assert stations.textSearch(p, 'nigel') == []
+    assert stations.textSearch(p, 'hill') == []
+    p.close()
+    checkIndexInStep(path)
+
+#Without FTS5 the database is migrated without the index, writes work and
+#searches find the same stations. Opened again with FTS5, the index is
+#built from the stations written in the meantime.
+def test_without_full_text_search(tmp_path, monkeypatch):
+    path = str(tmp_path / 'stations.db')
+    monkeypatch.setattr(persist, 'hasFullTextSearch', lambda cur: False)
+    p = Persist(path)
+    addStations(p)
+    stations = StationList(p)
+    assert callsigns(stations.textSearch(p, 'flood')) == [' K4ABC']
+    assert callsigns(stations.textSearch(p, 'PORT hill')) == ['G4ABC/P']
+    assert callsigns(stations.textSearch(p, 'g4abc p')) == ['G4ABC/P']
+    #Inside a word is not the start of one
+    assert stations.textSearch(p, 'ood') == []
+    assert callsigns(stations.textSearch(p, 'h')) == [' K4ABC', 'G4ABC/P']
+    assert len(stations.textSearch(p, 'h', limit=1)) == 1
+    p.close()
+    
+    monkeypatch.undo()
+    p = Persist(path)
+    stations = StationList(p)
+    assert callsigns(stations.textSearch(p, 'flood')) == [' K4ABC']
+    assert callsigns(stations.textSearch(p, 'g4abc p')) == ['G4ABC/P']
+    p.close()
+    checkIndexInStep(path)
+
+#A database with the index opened without FTS5 loses only the triggers, so
+#writes still work, and the index is rebuilt once FTS5 is back
+def test_index_rebuilt_after_writes_without_full_text_search(tmp_path, monkeypatch):
+    path = str(tmp_path / 'stations.db')
+    p = Persist(path)
+    addStations(p)
+    p.close()
+    
+    monkeypatch.setattr(persist, 'hasFullTextSearch', lambda cur: False)
+    p = Persist(path)
+    stations = StationList(p)
+    harold = stations.find(' K4ABC')
+    harold.note = 'SANDBAGS'
+    harold.saveToDatabase(p)
+    Station(' N5XYZ', 'FLOOD WARDEN').saveToDatabase(p)
+    p.cur.execute("DELETE FROM stations WHERE callsign = ' W3LOR';")
+    p.con.commit()
+    p.close()
+    
+    monkeypatch.undo()
+    p = Persist(path)
+    stations = StationList(p)
+    assert callsigns(stations.textSearch(p, 'flood')) == [' N5XYZ']
+    assert callsigns(stations.textSearch(p, 'sandbags')) == [' K4ABC']
+    assert stations.textSearch(p, 'lori') == []
+    p.close()
+    checkIndexInStep(path)